@@ -17,5 +17,7 @@ import sys
 from streamlit.web import cli as stcli
 
 if __name__ == '__main__':
-    sys.argv = ["streamlit", "run", "webapp/1_Cargar_Documentos.py", "--server.maxUploadSize", "7" , "--theme.base" , "light"]
+    # Los PDF grandes se suben a GCS en partes de GCS_UPLOAD_CHUNK_MB y, por encima de PDF_IN_MEMORY_MAX_MB, se leen
+    # desde un archivo temporal, asi que el tope ya no depende de la memoria que usa la subida
+    sys.argv = ["streamlit", "run", "webapp/1_Cargar_Documentos.py", "--server.maxUploadSize", "200" , "--theme.base" , "light"]
     sys.exit(stcli.main())
\ No newline at end of file
@@ -20,22 +20,33 @@ from pathlib import Path as p
 import pandas as pd
 from langchain.prompts import PromptTemplate
 from langchain.chains.summarize import load_summarize_chain
-from langchain.document_loaders import PyPDFLoader
 from langchain.llms import VertexAI
 from google.cloud import storage
 
 import vertexai
 import streamlit as st
+import asyncio
 import os
+import shutil
 import tempfile
+import traceback
 import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
 from webapp.logo import add_logo
 
 import config
-from summarize_pdf import summarize_doc
+from summarize_pdf import iter_summarize_doc, plan_summary, summarize_sections, CHAIN_TYPES
 import persistence_pdf
+import pdf_tables
 import discovery_engine_datastore
+import llm_cache
+import llm_metrics
+from batch_summarize import asummarize_batch, persist_batch, batch_report
+import pdf_extract
+from pdf_pipeline import PageStream
+from pdf_source import PdfSource
+from pdf_sections import read_sections, section_label
 
 warnings.filterwarnings("ignore")
 
@@ -86,56 +97,303 @@ add_logo()
 st.header('Generador de resumenes de PDFs con Google GenAI y LangChain', divider="violet")
 
 
-# PDF Uploadger widget
-source_doc = st.file_uploader("Subir documento para resumir", type="pdf", accept_multiple_files=False)
+# PDF Uploadger widget (con varios archivos se resumen todos en modo batch)
+source_docs = st.file_uploader("Subir documentos para resumir", type="pdf", accept_multiple_files=True)
+source_doc = source_docs[0] if len(source_docs) == 1 else None
+
+# Metodo de resumen: refine (serial, mantiene contexto), map_reduce (paginas en paralelo, mas rapido en docs largos)
+# o auto (elige segun la estimacion de tiempo de cada estrategia)
+chain_type = st.radio("Método de resumen", CHAIN_TYPES,
+                      index=CHAIN_TYPES.index(conf.SUMMARY_CHAIN_TYPE), horizontal=True)
+pack_short_pages = st.checkbox("Agrupar páginas cortas en una misma llamada al modelo", value=conf.SUMMARY_PACK_PAGES)
+triage_pages = st.checkbox("Omitir índices, avisos legales, encabezados y páginas sin texto", value=conf.SUMMARY_TRIAGE_PAGES)
+
+
+def open_uploaded_pdf(uploaded_file):
+    """
+    PdfSource del archivo subido, leido del buffer de Streamlit sin copiarlo entero cada vez: solo los PDF que
+    entran en PDF_IN_MEMORY_MAX_MB se copian a memoria, los mas grandes se escriben a un archivo temporal.
+    """
+    with uploaded_file.getbuffer() as buffer:
+        return PdfSource(buffer, name=uploaded_file.name)
+
+
+# Las funciones cacheadas se indexan por el file_id del archivo subido: Streamlit no hashea el PDF completo en cada
+# re-ejecucion, y el archivo (argumento con _) solo se lee cuando no esta en el cache
+@st.cache_data(show_spinner=False)
+def load_pdf_sections(file_id, _uploaded_file):
+    """Secciones del PDF segun su outline (marcadores), ver pdf_sections."""
+    with open_uploaded_pdf(_uploaded_file) as pdf, pdf.stream() as stream:
+        return read_sections(stream)
+
+
+@st.cache_resource
+def get_background_executor():
+    """Threads compartidos por todas las sesiones para tareas en segundo plano, como subir el PDF a Cloud Storage."""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_data(show_spinner=False)
+def load_pdf_pages(file_id, _uploaded_file):
+    """Carga el PDF subido y lo divide en paginas, una sola vez por archivo (Streamlit re-ejecuta el script en cada interaccion)."""
+    with open_uploaded_pdf(_uploaded_file) as pdf:
+        return pdf_extract.load_and_split(pdf)
+
+
+def upload_pdf(pdf, gcs_doc_id):
+    """
+    Sube el PDF a Cloud Storage directamente desde memoria (o desde su archivo temporal si es grande), en partes de
+    GCS_UPLOAD_CHUNK_MB con verificacion de CRC32C.
+    """
+    with pdf.stream() as stream:
+        persistence_pdf.upload_pdf_stream_gcs(bucket_gcs=conf.BUCKET_NAME,
+                                              source_stream=stream,
+                                              size=pdf.size,
+                                              destination_gcs_name=gcs_doc_id)
+
+
+def discard_upload(upload, gcs_doc_id):
+    """
+    Espera a que termine (o cancela, si no empezo) la subida del PDF en segundo plano de un documento que no se
+    resumio, y borra el PDF del bucket. Un error al borrarlo se reporta sin ocultar el error del resumen.
+    """
+    if upload.cancel():
+        return
+    try:
+        upload.result()
+    except Exception:
+        # La subida tambien fallo: no quedo ningun objeto en el bucket
+        return
+    try:
+        persistence_pdf.delete_pdf_gcs(conf.BUCKET_NAME, gcs_doc_id)
+    except Exception:
+        traceback.print_exc()
+
+
+# Estimacion previa de costo y tiempo de cada estrategia, antes de que el usuario decida resumir
+if source_doc:
+    recommended, estimates = plan_summary(load_pdf_pages(source_doc.file_id, source_doc),
+                                          vertex_model=conf.MODEL_NAME,
+                                          final_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                          max_workers=conf.SUMMARY_MAX_WORKERS,
+                                          reduce_fanout=conf.SUMMARY_REDUCE_FANOUT,
+                                          token_budget=conf.SUMMARY_CHUNK_TOKENS,
+                                          triage=triage_pages)
+    estimates_df = pd.DataFrame(estimates)
+    estimates_df.columns = ['Estrategia', 'Llamadas al modelo', 'Tokens de entrada', 'Tiempo estimado (s)']
+    st.write(F"Estimación previa (el método auto usaría **{recommended}**):")
+    st.dataframe(estimates_df.round(1), hide_index=True)
+
+    # Resumen por secciones: cada seccion elegida se resume por separado y en paralelo, sin recorrer todo el documento
+    sections = load_pdf_sections(source_doc.file_id, source_doc)
+    section_labels = [section_label(section) for section in sections]
+    selected_labels = st.multiselect("Resumir solo algunas secciones del documento", section_labels)
+    if selected_labels and st.button("Resumir secciones"):
+        try:
+            with st.spinner("Resumiendo secciones..."):
+                sections_df = summarize_sections(project=conf.PROJECT_ID,
+                                                 location=conf.REGION,
+                                                 vertex_model=conf.MODEL_NAME,
+                                                 final_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                                 pages=load_pdf_pages(source_doc.file_id, source_doc),
+                                                 sections=[sections[section_labels.index(label)] for label in selected_labels],
+                                                 max_workers=conf.SUMMARY_MAX_WORKERS,
+                                                 reduce_fanout=conf.SUMMARY_REDUCE_FANOUT,
+                                                 token_budget=conf.SUMMARY_CHUNK_TOKENS,
+                                                 reuse_sections=conf.SUMMARY_REUSE_PAGES)
+            for section in sections_df.to_dict("records"):
+                with st.expander(section_label(section), expanded=True):
+                    st.write(section["section_summary"])
+        except Exception as e:
+            st.write(f"An error occurred: {e}")
+
+
+def summarize_batch(uploaded_docs):
+    """Resume varios PDFs a la vez (ver batch_summarize), mostrando el estado de cada documento a medida que avanza."""
+    status = {doc.name: "en cola" for doc in uploaded_docs}
+    status_table = st.empty()
+
+    def _show_status(event):
+        if event["type"] == "parsed":
+            status[event["name"]] = F"{event['pages']} páginas"
+        elif event["type"] == "page":
+            status[event["name"]] = F"página {event['completed']} de {event['total']}"
+        elif event["type"] == "done":
+            status[event["name"]] = "resumido"
+        else:
+            status[event["name"]] = F"error: {event['error']}"
+        status_table.dataframe(pd.DataFrame({"Documento": list(status), "Estado": list(status.values())}),
+                               hide_index=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i, doc in enumerate(uploaded_docs):
+            # Prefijo por indice: dos archivos subidos pueden tener el mismo nombre
+            paths.append(os.path.join(tmp_dir, F"{i}_{doc.name}"))
+            with open(paths[-1], "wb") as tmp_file:
+                # Se copia en bloques, sin armar otra copia completa del archivo en memoria
+                shutil.copyfileobj(doc, tmp_file, 1024 * 1024)
+
+        results = asyncio.run(asummarize_batch(project=conf.PROJECT_ID,
+                                               location=conf.REGION,
+                                               vertex_model=conf.MODEL_NAME,
+                                               final_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                               paths=paths,
+                                               names=[doc.name for doc in uploaded_docs],
+                                               max_docs=conf.BATCH_MAX_CONCURRENT_DOCS,
+                                               parse_workers=conf.BATCH_PARSE_WORKERS,
+                                               upload_bucket=conf.BUCKET_NAME,
+                                               on_event=_show_status,
+                                               chain_type=chain_type,
+                                               max_workers=conf.SUMMARY_MAX_WORKERS,
+                                               reduce_fanout=conf.SUMMARY_REDUCE_FANOUT,
+                                               pack=pack_short_pages,
+                                               token_budget=conf.SUMMARY_CHUNK_TOKENS,
+                                               reuse_pages=conf.SUMMARY_REUSE_PAGES,
+                                               triage=triage_pages))
+
+    # Todos los resumenes del lote se guardan en BigQuery en un solo load job por tabla
+    persist_batch(results, bucket_name=conf.BUCKET_NAME,
+                  documents_table_id=conf.DOCUMENTS_BQ_TABLE_ID,
+                  pages_table_id=conf.PAGES_BQ_TABLE_ID,
+                  tables_table_id=conf.TABLES_BQ_TABLE_ID,
+                  data_store_id=conf.DATA_STORE_ID)
+
+    status_table.dataframe(batch_report(results), hide_index=True)
+    for result in results:
+        if result["status"] == "ok":
+            with st.expander(result["name"]):
+                st.write(result["summary"])
+
 
 if st.button("Resumir Documento"):
     # Validar inputs
-    if not source_doc:
+    if not source_docs:
         st.write(f"Por favor cargue el archivo a resumir.")
+    elif len(source_docs) > 1:
+        try:
+            vertexai.init(project=conf.PROJECT_ID, location=conf.REGION)
+            summarize_batch(source_docs)
+        except Exception as e:
+            st.write(f"An error occurred: {e}")
     else:
+        # Paginas resumidas por el LLM en este intento (se guardan en el almacen de resumenes apenas se calculan)
+        summarized_pages = 0
         try:
             vertexai.init(project=conf.PROJECT_ID, location=conf.REGION)
             
-            # Save uploaded file temporarily to disk, load and split the file into pages, delete temp file
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            # El PDF se procesa desde los bytes subidos (solo los archivos grandes pasan por un archivo temporal,
+            # mapeado en memoria), que se liberan al salir del bloque aunque el resumen falle
+            with open_uploaded_pdf(source_doc) as pdf:
 
-                # Cargar el PDF dividirlo en páginas
-                tmp_file.write(source_doc.read())
-                loader = PyPDFLoader(tmp_file.name)
-                pages = loader.load_and_split()
+                # Cargar el PDF dividirlo en páginas: las páginas se extraen en segundo plano y el resumen empieza
+                # con la primera página mientras las siguientes todavía se están extrayendo
+                pages = PageStream(pdf)
                 gcs_doc_id = F'{source_doc.name[:-4]}_{datetime.datetime.now()}.pdf'
 
-                # Antes de borrar el archivo temporal, persisto el PDF original en Cloud Storage
-                persistence_pdf.upload_pdf_gcs(bucket_gcs=conf.BUCKET_NAME, 
-                                           source_file_path=tmp_file.name, 
-                                           destination_gcs_name=gcs_doc_id)
+                # Persisto el PDF original en Cloud Storage (en paralelo con el resumen)
+                gcs_upload = get_background_executor().submit(upload_pdf, pdf, gcs_doc_id)
                 
                 
                 #print("Contenido de la pag. 2: {} ".format(pages[2].page_content))
 
-                #Enviar el contenido de las páginas del doc al modelo para resumirlos
-                summary = summarize_doc(project=conf.PROJECT_ID,
-                                        location=conf.REGION, 
-                                        vertex_model=conf.MODEL_NAME, 
-                                        pages=pages)
+                uploaded = False
+                try:
+                    #Enviar el contenido de las páginas del doc al modelo para resumirlos, mostrando cada página apenas se resume
+                    progress_bar = st.progress(0, text="Resumiendo documento...")
+                    pages_expander = st.expander("Resúmenes por página", expanded=True)
+                    for event in iter_summarize_doc(project=conf.PROJECT_ID,
+                                                    location=conf.REGION, 
+                                                    vertex_model=conf.MODEL_NAME,
+                                                    final_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                                    pages=pages,
+                                                    chain_type=chain_type,
+                                                    max_workers=conf.SUMMARY_MAX_WORKERS,
+                                                    reduce_fanout=conf.SUMMARY_REDUCE_FANOUT,
+                                                    pack=pack_short_pages,
+                                                    token_budget=conf.SUMMARY_CHUNK_TOKENS,
+                                                    reuse_pages=conf.SUMMARY_REUSE_PAGES,
+                                                    triage=triage_pages):
+                        if event["type"] == "page":
+                            summarized_pages += not event["reused"]
+                            progress_bar.progress(event["completed"] / event["total"],
+                                                  text=F"Página {event['completed']} de {event['total']} "
+                                                       F"(tiempo restante estimado: {event['eta']:.0f} s)")
+                            pages_expander.markdown(F"**Página {event['page_numbers']}:** {event['summary']}")
+                        else:
+                            summary, pages_summary_df, summary_stats = event["summary"], event["pages"], event["stats"]
+                    progress_bar.empty()
                 
-                # Mostrar el resumen general del documento
-                st.write(summary)                
+                    # Mostrar el resumen general del documento
+                    st.write(summary)                
+
+                    # Tablas numericas del documento: no se enviaron al modelo (solo un resumen de cada una)
+                    doc_tables = pdf_tables.document_tables(pages.pages)
+                    if doc_tables:
+                        with st.expander(F"Tablas extraídas ({len(doc_tables)})"):
+                            for table in doc_tables:
+                                st.caption(F"Página {table['page'] + 1}, tabla {table['table'] + 1}")
+                                st.dataframe(table["dataframe"], hide_index=True)
+
+                    st.caption(F"Páginas reutilizadas de resúmenes anteriores: {summary_stats['pages_reused']}, "
+                               F"páginas resumidas con el modelo: {summary_stats['pages_recomputed']}")
+                    if "strategy" in summary_stats:
+                        st.caption(F"Estrategia de resumen elegida: {summary_stats['strategy']}")
+                    if triage_pages:
+                        st.caption(F"Páginas omitidas: {summary_stats['pages_skipped']}, "
+                                   F"tokens ahorrados: {summary_stats['tokens_saved']}, "
+                                   F"llamadas al modelo ahorradas: {summary_stats['calls_saved']}")
+
+                    response_cache = llm_cache.init_llm_cache()
+                    if response_cache:
+                        cache_stats = response_cache.stats()
+                        st.caption(F"Cache de respuestas del LLM: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                                   F"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} entradas)")
+
+                    # Latencia lado a lado del modelo rapido (pasos por pagina) y del modelo final (consolidacion)
+                    with st.expander("Latencia por modelo"):
+                        st.write("En este resumen:")
+                        st.dataframe(pd.DataFrame(summary_stats["models"]).round(2), hide_index=True)
+                        st.write("Histórico:")
+                        st.dataframe(pd.DataFrame(llm_metrics.latency_report([conf.MODEL_NAME, conf.SUMMARY_FINAL_MODEL_NAME])).round(2),
+                                     hide_index=True)
+
+                    # Histograma de latencia de las llamadas al LLM de este proceso (ver llm_client y llm_metrics)
+                    llm_histogram = llm_metrics.get_latency_histogram().snapshot()
+                    if llm_histogram["buckets"]:
+                        with st.expander("Latencia de las llamadas al LLM"):
+                            st.bar_chart(pd.DataFrame(llm_histogram["buckets"]))
+                            st.caption(F"Eventos: {llm_histogram['events']}")
                 
-                # Creo el dataframe que se enviará a BigQuery y que contiene el resumen de todo el documento
-                doc_uri = F'gs://{conf.BUCKET_NAME}/{gcs_doc_id}'
-                document_summary_df = pd.DataFrame({'document_id':[gcs_doc_id],
-                                                    'document_name': [source_doc.name],
-                                                    'document_gcs_uri': [doc_uri],
-                                                    'document_llm_summary': [summary]
-                                                    })
-                #print(document_summary_df)
+                    # Creo el dataframe que se enviará a BigQuery y que contiene el resumen de todo el documento
+                    doc_uri = F'gs://{conf.BUCKET_NAME}/{gcs_doc_id}'
+                    document_summary_df = pd.DataFrame({'document_id':[gcs_doc_id],
+                                                        'document_name': [source_doc.name],
+                                                        'document_gcs_uri': [doc_uri],
+                                                        'document_llm_summary': [summary]
+                                                        })
+                    #print(document_summary_df)
+
+                    # El PDF tiene que estar en Cloud Storage antes de registrar su URI y actualizar el Data Store
+                    gcs_upload.result()
+                    uploaded = True
+                finally:
+                    # La subida lee el PDF, que se cierra al salir del bloque: si el resumen fallo (o se interrumpio), se
+                    # espera o se cancela antes, y se borra el PDF del bucket para no dejar archivos sin resumen
+                    if not uploaded:
+                        discard_upload(gcs_upload, gcs_doc_id)
 
                 # Persistir el resumen general del documento en la tabla correspondiente en BigQuery
-                persistence_pdf.insert_doc_summary_bq(project=conf.PROJECT_ID, 
-                                                      table_id=conf.DOCUMENTS_BQ_TABLE_ID, 
-                                                      pandas_dataframe=document_summary_df)
+                bq_writes = {"el resumen del documento": persistence_pdf.insert_doc_summary_bq(
+                    project=conf.PROJECT_ID, table_id=conf.DOCUMENTS_BQ_TABLE_ID, pandas_dataframe=document_summary_df)}
+
+                # Persistir los resumenes por pagina, para revisarlos luego sin volver a resumir el documento
+                bq_writes["los resúmenes por página"] = persistence_pdf.insert_pages_summaries_bq(
+                    table_id=conf.PAGES_BQ_TABLE_ID, doc_id=gcs_doc_id, pages_dataframe=pages_summary_df)
+
+                # Persistir las tablas numericas, para consultarlas sin volver a procesar el documento
+                bq_writes["las tablas"] = persistence_pdf.insert_tables_bq(table_id=conf.TABLES_BQ_TABLE_ID,
+                                                                           tables_by_doc={gcs_doc_id: doc_tables})
                 
                 # Actualizar el índice del Data Store de Gen App Builder para que el agente conversacional esté al día con el nuevo doc:
                 discovery_engine_datastore.import_documents_incremental(project_id=conf.PROJECT_ID, 
@@ -143,9 +401,18 @@ if st.button("Resumir Documento"):
                                                                         data_store_id=conf.DATA_STORE_ID, 
                                                                         gcs_uri=doc_uri)
 
-                #Finalmente borro el archivo temporal
-                os.remove(tmp_file.name)
+                # Las escrituras en BigQuery se hacen en segundo plano (ver bq_writer): se esperan para reportar si
+                # alguna fallo, en vez de dar por guardado un resumen que se perdio
+                wait(bq_writes.values(), timeout=conf.BQ_WRITER_WAIT_SECONDS)
+                for name, future in bq_writes.items():
+                    if not future.done():
+                        st.warning(F"Todavía se están guardando {name} en BigQuery.")
+                    elif future.exception() is not None:
+                        st.error(F"No se pudieron guardar {name} en BigQuery: {future.exception()}")
 
         except Exception as e:
             st.write(f"An error occurred: {e}")
+            if conf.SUMMARY_REUSE_PAGES and summarized_pages:
+                st.caption("Los resúmenes por página ya calculados quedaron guardados: al volver a intentar, "
+                           "no se vuelven a pedir al modelo.")
      
\ No newline at end of file
@@ -0,0 +1,244 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo resume lotes de documentos PDF (p.ej. los outlooks trimestrales como los de la carpeta data/).
+ Los PDF se parsean en un pool de procesos y se resumen de forma concurrente con asummarize_doc(), con un maximo de
+ documentos en curso a la vez; las llamadas al LLM de todos los documentos pasan por el mismo limitador de cuota del
+ proceso (ver llm_client), que es el tope global de concurrencia. Al final todos los resumenes se cargan en BigQuery
+ en un solo load job por tabla. Si un documento falla, se reporta y el resto del lote sigue adelante.
+
+ Uso por linea de comandos (desde la carpeta webapp):
+    python batch_summarize.py ../data/*.pdf
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import config
+import discovery_engine_datastore
+import llm_metrics
+import pdf_extract
+import pdf_tables
+import persistence_pdf
+from summarize_pdf import asummarize_doc, CHAIN_TYPES
+
+conf = config.Config()
+
+
+def load_pdf_pages(path):
+    """
+    Carga un PDF y lo divide en paginas. Se ejecuta en los procesos del pool, por eso es una funcion del modulo;
+    el lote ya reparte los documentos entre procesos, asi que cada documento se extrae en un solo proceso.
+    """
+    return pdf_extract.load_and_split(path, workers=1)
+
+
+def upload_pdf(bucket, path, doc_id):
+    """Sube el PDF a Cloud Storage en partes, leyendolo del archivo a medida que se envia."""
+    with open(path, "rb") as stream:
+        persistence_pdf.upload_pdf_stream_gcs(bucket_gcs=bucket, source_stream=stream,
+                                              size=os.path.getsize(path), destination_gcs_name=doc_id)
+
+
+async def _finish_upload(upload, bucket, doc_id, summarized):
+    """
+    Espera a que termine la subida del PDF en segundo plano: el archivo puede estar en un directorio temporal que se
+    borra al terminar el lote. Si el documento no se resumio, borra el PDF del bucket para no dejar archivos sin
+    resumen; un error al borrarlo se reporta sin ocultar el error del resumen.
+    """
+    if summarized:
+        await upload
+        return
+    try:
+        await upload
+    except Exception:
+        # La subida tambien fallo: no quedo ningun objeto en el bucket
+        return
+    try:
+        await asyncio.to_thread(persistence_pdf.delete_pdf_gcs, bucket, doc_id)
+    except Exception:
+        traceback.print_exc()
+
+
+def document_id(name):
+    """Nombre con el que se guarda el PDF en GCS, igual que en la carga de a un documento."""
+    return F'{Path(name).stem}_{datetime.datetime.now()}.pdf'
+
+
+def _emit(on_event, event):
+    if on_event is not None:
+        on_event(event)
+
+
+async def asummarize_batch(project, location, vertex_model, paths, names=None, max_docs=4, parse_workers=None,
+                           upload_bucket=None, on_event=None, **summary_kwargs):
+    """
+    Resume los PDF de `paths` (`names` son los nombres a mostrar, por defecto el nombre del archivo). Como mucho
+    `max_docs` documentos se resumen a la vez; el resto de los parametros (`summary_kwargs`) se pasan a
+    asummarize_doc(). Si se indica `upload_bucket`, cada PDF se sube a ese bucket de GCS mientras se resume.
+
+    Devuelve una lista con un diccionario por documento, en el orden de `paths`:
+    {"path", "name", "document_id", "status": "ok" | "error", "summary", "pages", "stats", "error", "seconds"}.
+    on_event(evento) recibe {"type": "parsed" | "page" | "done" | "error", "name": ..., ...} a medida que avanza
+    cada documento (los eventos "page" son los de summarize_pdf.PageProgress).
+    """
+    names = names or [os.path.basename(path) for path in paths]
+    loop = asyncio.get_running_loop()
+    docs_in_flight = asyncio.Semaphore(max_docs)
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool:
+
+        async def _summarize_one(path, name):
+            result = {"path": path, "name": name, "document_id": document_id(name), "status": "error",
+                      "summary": None, "pages": None, "tables": [], "stats": {}, "error": None}
+            started = time.time()
+            try:
+                pages = await loop.run_in_executor(parse_pool, load_pdf_pages, path)
+                result["tables"] = pdf_tables.document_tables(pages)
+                _emit(on_event, {"type": "parsed", "name": name, "pages": len(pages)})
+
+                async with docs_in_flight:
+                    upload = None
+                    if upload_bucket:
+                        upload = loop.run_in_executor(None, upload_pdf,
+                                                      upload_bucket, path, result["document_id"])
+                    summarized = False
+                    try:
+                        summary, pages_df, stats = await asummarize_doc(
+                            project, location, vertex_model, pages, return_details=True,
+                            on_page=lambda event: _emit(on_event, {**event, "type": "page", "name": name}),
+                            **summary_kwargs
+                        )
+                        summarized = True
+                    finally:
+                        if upload is not None:
+                            await _finish_upload(upload, upload_bucket, result["document_id"], summarized)
+
+                result.update(status="ok", summary=summary, pages=pages_df, stats=stats)
+                _emit(on_event, {"type": "done", "name": name})
+            except Exception as e:
+                traceback.print_exc()
+                result["error"] = F"{type(e).__name__}: {e}"
+                _emit(on_event, {"type": "error", "name": name, "error": result["error"]})
+            result["seconds"] = time.time() - started
+            return result
+
+        return await asyncio.gather(*[_summarize_one(path, name) for path, name in zip(paths, names)])
+
+
+def persist_batch(results, bucket_name, documents_table_id, pages_table_id, tables_table_id=None, data_store_id=None):
+    """
+    Guarda los documentos resumidos con exito: todos los resumenes en BigQuery (un load job por tabla), las tablas
+    numericas de los documentos en `tables_table_id` si se indica y, si se indica `data_store_id`, importa todos los
+    PDF al Data Store en una sola operacion.
+    """
+    succeeded = [result for result in results if result["status"] == "ok"]
+    if not succeeded:
+        return
+
+    documents_df = pd.DataFrame({
+        "document_id": [result["document_id"] for result in succeeded],
+        "document_name": [result["name"] for result in succeeded],
+        "document_gcs_uri": [F'gs://{bucket_name}/{result["document_id"]}' for result in succeeded],
+        "document_llm_summary": [result["summary"] for result in succeeded],
+    })
+    persistence_pdf.insert_batch_summaries_bq(documents_table_id=documents_table_id,
+                                              pages_table_id=pages_table_id,
+                                              documents_dataframe=documents_df,
+                                              pages_by_doc={result["document_id"]: result["pages"] for result in succeeded})
+    if tables_table_id:
+        # El lote espera a que las tablas esten en BigQuery, para reportar si fallaron
+        persistence_pdf.insert_tables_bq(table_id=tables_table_id,
+                                         tables_by_doc={result["document_id"]: result["tables"] for result in succeeded}).result()
+
+    if data_store_id:
+        discovery_engine_datastore.import_documents_incremental(project_id=conf.PROJECT_ID,
+                                                                location='global',
+                                                                data_store_id=data_store_id,
+                                                                gcs_uris=list(documents_df["document_gcs_uri"]))
+
+
+def batch_report(results):
+    """Dataframe con el estado de cada documento del lote, para mostrar al usuario."""
+    return pd.DataFrame({
+        "document_name": [result["name"] for result in results],
+        "status": [result["status"] for result in results],
+        "pages": [len(result["pages"]) if result["pages"] is not None else None for result in results],
+        "strategy": [result["stats"].get("strategy") for result in results],
+        "seconds": [round(result["seconds"], 1) for result in results],
+        "error": [result["error"] for result in results],
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resume un lote de documentos PDF y guarda los resumenes en BigQuery.")
+    parser.add_argument("paths", nargs="+", help="Archivos PDF a resumir")
+    parser.add_argument("--chain-type", choices=CHAIN_TYPES, default=conf.SUMMARY_CHAIN_TYPE)
+    parser.add_argument("--max-docs", type=int, default=conf.BATCH_MAX_CONCURRENT_DOCS,
+                        help="Documentos que se resumen a la vez")
+    parser.add_argument("--no-persist", action="store_true",
+                        help="Solo resumir, sin subir los PDF a GCS ni guardar los resumenes en BigQuery")
+    args = parser.parse_args(argv)
+
+    def _print_event(event):
+        if event["type"] == "parsed":
+            print(F"[{event['name']}] {event['pages']} paginas")
+        elif event["type"] == "page":
+            print(F"[{event['name']}] pagina {event['completed']}/{event['total']}")
+        elif event["type"] == "done":
+            print(F"[{event['name']}] resumen listo")
+        else:
+            print(F"[{event['name']}] ERROR: {event['error']}")
+
+    results = asyncio.run(asummarize_batch(project=conf.PROJECT_ID,
+                                           location=conf.REGION,
+                                           vertex_model=conf.MODEL_NAME,
+                                           final_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                           paths=args.paths,
+                                           max_docs=args.max_docs,
+                                           parse_workers=conf.BATCH_PARSE_WORKERS,
+                                           upload_bucket=None if args.no_persist else conf.BUCKET_NAME,
+                                           on_event=_print_event,
+                                           chain_type=args.chain_type,
+                                           max_workers=conf.SUMMARY_MAX_WORKERS,
+                                           reduce_fanout=conf.SUMMARY_REDUCE_FANOUT,
+                                           pack=conf.SUMMARY_PACK_PAGES,
+                                           token_budget=conf.SUMMARY_CHUNK_TOKENS,
+                                           reuse_pages=conf.SUMMARY_REUSE_PAGES,
+                                           triage=conf.SUMMARY_TRIAGE_PAGES))
+
+    if not args.no_persist:
+        persist_batch(results, bucket_name=conf.BUCKET_NAME,
+                      documents_table_id=conf.DOCUMENTS_BQ_TABLE_ID,
+                      pages_table_id=conf.PAGES_BQ_TABLE_ID,
+                      tables_table_id=conf.TABLES_BQ_TABLE_ID,
+                      data_store_id=conf.DATA_STORE_ID)
+
+    print(batch_report(results).to_string(index=False))
+    print(pd.DataFrame(llm_metrics.latency_report([conf.MODEL_NAME, conf.SUMMARY_FINAL_MODEL_NAME])).to_string(index=False))
+    return 0 if all(result["status"] == "ok" for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Benchmark de los backends de extraccion de texto de pdf_extract: extrae todas las paginas de los PDF indicados
+ (por defecto los de la carpeta data/) con cada backend y compara paginas por segundo.
+
+ Uso por linea de comandos (desde la carpeta webapp):
+    python benchmark_pdf_extract.py
+    python benchmark_pdf_extract.py ../data/*.pdf --repeat 5 --workers 1 4
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import pdf_extract
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+
+def benchmark(paths, backend, workers=None, repeat=3):
+    """Extrae `paths` `repeat` veces con el backend y devuelve un diccionario con el mejor tiempo y paginas/seg."""
+    if workers is None or backend == "pypdf":
+        return _benchmark(paths, backend, workers, repeat)
+    # El pool compartido tiene PDF_EXTRACT_WORKERS procesos: cada cantidad de workers se mide con un pool de ese tamaño
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _benchmark(paths, backend, workers, repeat, executor=executor)
+
+
+def _benchmark(paths, backend, workers, repeat, **params):
+    # Sin el cache de extraccion, que haria que solo la primera extraccion parsee los PDF, ni OCR ni tablas
+    extractor = pdf_extract.get_extractor(backend, use_cache=False, use_ocr=False, use_tables=False, workers=workers,
+                                          **params)
+    # Una extraccion previa sin medir, para no contar el arranque del pool de procesos
+    extractor.extract(paths[0])
+
+    best, pages, chars = None, 0, 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        documents = [page for path in paths for page in extractor.extract(path)]
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+        pages, chars = len(documents), sum(len(page.page_content) for page in documents)
+
+    return {
+        "backend": backend,
+        "workers": extractor.workers if backend != "pypdf" else 1,
+        "files": len(paths),
+        "pages": pages,
+        "chars": chars,
+        "seconds": round(best, 3),
+        "pages_per_second": round(pages / best, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara la velocidad de los backends de extraccion de texto de PDF.")
+    parser.add_argument("paths", nargs="*", help="Archivos PDF (por defecto los de la carpeta data/)")
+    parser.add_argument("--backends", nargs="+", choices=list(pdf_extract.EXTRACTORS), default=list(pdf_extract.EXTRACTORS))
+    parser.add_argument("--workers", nargs="+", type=int, default=[None],
+                        help="Procesos por documento a probar con los backends que usan el pool")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por backend, se reporta la mas rapida")
+    args = parser.parse_args(argv)
+
+    paths = args.paths or sorted(glob.glob(os.path.join(DATA_DIR, "*.pdf")))
+    if not paths:
+        parser.error("No se encontraron archivos PDF")
+
+    results = []
+    for backend in args.backends:
+        for workers in (args.workers if backend != "pypdf" else [None]):
+            results.append(benchmark(paths, backend, workers, args.repeat))
+
+    report = pd.DataFrame(results)
+    baseline = report.loc[report["backend"] == "pypdf", "pages_per_second"]
+    if not baseline.empty:
+        report["speedup"] = (report["pages_per_second"] / baseline.iloc[0]).round(2)
+    print(report.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
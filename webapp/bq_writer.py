@@ -0,0 +1,221 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Escritor de filas en BigQuery del proceso: las escrituras de todas las sesiones (resumenes, resumenes por pagina,
+ tablas) se encolan y un thread en segundo plano las agrupa por tabla y las envia con streaming inserts
+ (insertAll), con el esquema explicito de cada tabla, en vez de un load job por documento. Asi una carga no espera
+ a BigQuery y los uploads concurrentes no llegan a los limites de load jobs ni de actualizaciones de tabla.
+ La cola es acotada (BQ_WRITER_MAX_PENDING_ROWS): si BigQuery no da abasto, las escrituras esperan en vez de
+ acumular filas sin limite. Las filas pendientes se envian al cerrar el proceso (atexit), y cada escritura
+ devuelve un Future que se completa cuando sus filas estan en BigQuery, para quien necesite esperarlas.
+ Los streaming inserts no crean la tabla (a diferencia de los load jobs): antes del primer envio a cada tabla se la
+ crea con su esquema, si no existe.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from google.cloud import bigquery
+
+import config
+import gcp_clients
+
+conf = config.Config()
+
+_STOP = object()
+
+
+class _PendingWrite:
+    # Una llamada a write(): su Future se completa cuando se enviaron todas sus filas
+    def __init__(self, rows):
+        self.future = Future()
+        self.remaining = rows
+        self.errors = []
+
+    def done(self, count, error=None):
+        if error is not None:
+            self.errors.append(error)
+        self.remaining -= count
+        if self.remaining == 0:
+            if self.errors:
+                self.future.set_exception(RuntimeError("; ".join(self.errors)))
+            else:
+                self.future.set_result(None)
+
+
+def _row_id(table_id, row):
+    # insertId deterministico: si se reintenta un envio, BigQuery descarta las filas que ya habia recibido
+    return hashlib.sha256(json.dumps([table_id, row], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class BigQueryWriter:
+    """
+    Envia filas a BigQuery en segundo plano: de a `batch_rows` filas por tabla, o las que haya cada `flush_seconds`
+    segundos. Como mucho `max_pending_rows` filas esperan en la cola. Un envio que falla se reintenta hasta
+    `max_retries` veces; si sigue fallando, el Future de las escrituras afectadas termina con el error.
+    """
+
+    def __init__(self, batch_rows=None, flush_seconds=None, max_pending_rows=None, max_retries=None):
+        self.batch_rows = batch_rows or conf.BQ_WRITER_BATCH_ROWS
+        self.flush_seconds = conf.BQ_WRITER_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.max_retries = conf.BQ_WRITER_MAX_RETRIES if max_retries is None else max_retries
+        self._queue = queue.Queue(maxsize=max_pending_rows or conf.BQ_WRITER_MAX_PENDING_ROWS)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Tablas que ya se crearon (o ya existian); solo las usa el thread del escritor
+        self._tables = set()
+
+    def _start(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("El escritor de BigQuery ya esta cerrado")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bq-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, table_id, schema, rows):
+        """
+        Encola `rows` (diccionarios con los campos de `schema`, una lista de bigquery.SchemaField) para insertarlas
+        en `table_id`. Devuelve un Future que se completa cuando las filas estan en BigQuery.
+        """
+        pending = _PendingWrite(len(rows))
+        if not rows:
+            pending.future.set_result(None)
+            return pending.future
+        self._start()
+        for row in rows:
+            # Bloquea si la cola esta llena, hasta que el thread envie filas
+            self._queue.put((table_id, tuple(schema), row, pending))
+        return pending.future
+
+    def flush(self, timeout=None):
+        """Espera a que se envien todas las filas encoladas hasta ahora."""
+        marker = Future()
+        self._start()
+        self._queue.put(marker)
+        marker.result(timeout)
+
+    def close(self, timeout=None):
+        """Envia las filas pendientes y termina el thread; despues de close() no se aceptan escrituras."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _run(self):
+        batches = {}
+        deadline = None
+        while True:
+            try:
+                item = self._queue.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or isinstance(item, Future):
+                for key in list(batches):
+                    self._send(key, batches.pop(key))
+                deadline = None
+                if item is _STOP:
+                    return
+                item.set_result(None)
+                continue
+
+            if item is None:
+                # Vencio el plazo: se envia lo que haya de todas las tablas
+                for key in list(batches):
+                    self._send(key, batches.pop(key))
+                deadline = None
+                continue
+
+            table_id, schema, row, pending = item
+            batch = batches.setdefault((table_id, schema), [])
+            batch.append((row, pending))
+            if len(batch) >= self.batch_rows:
+                self._send((table_id, schema), batches.pop((table_id, schema)))
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_seconds
+            elif not batches:
+                deadline = None
+
+    def _send(self, key, batch):
+        table_id, schema = key
+        rows = [row for row, _ in batch]
+        row_ids = [_row_id(table_id, row) for row in rows]
+        # Indices de las filas que todavia no se insertaron, y el ultimo error de cada una
+        remaining = list(range(len(rows)))
+        errors = {}
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                # Si el cliente queda en mal estado se descarta, y el reintento usa uno nuevo
+                with gcp_clients.resetting("bigquery"):
+                    client = gcp_clients.get_bigquery_client()
+                    if table_id not in self._tables:
+                        client.create_table(bigquery.Table(table_id, schema=list(schema)), exists_ok=True)
+                        self._tables.add(table_id)
+                    # selected_fields: el esquema explicito, sin consultar la tabla antes de cada envio. Una tabla
+                    # recien creada puede rechazar los primeros inserts unos segundos: se reintentan
+                    row_errors = client.insert_rows(
+                        table_id, [rows[index] for index in remaining], selected_fields=list(schema),
+                        row_ids=[row_ids[index] for index in remaining])
+            except Exception as e:
+                errors = {index: F"{type(e).__name__}: {e}" for index in remaining}
+                continue
+            failed = {remaining[error["index"]]: str(error["errors"]) for error in row_errors}
+            errors = failed
+            remaining = sorted(failed)
+            if not remaining:
+                break
+
+        if errors:
+            print(F"No se pudieron insertar {len(errors)} filas en {table_id}: {next(iter(errors.values()))}")
+        for index, (_, pending) in enumerate(batch):
+            pending.done(1, errors.get(index))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # El thread del escritor no existe en los procesos creados con fork: si lo necesitan, crean el suyo
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_bigquery_writer():
+    """Escritor de BigQuery del proceso (se crea la primera vez que se usa y envia lo pendiente al terminar)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BigQueryWriter()
+            atexit.register(_writer.close)
+    return _writer
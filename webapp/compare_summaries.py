@@ -0,0 +1,180 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo arma un resumen comparativo de varios documentos ya cargados (p.ej. que dicen BlackRock, Vanguard y
+ JPMorgan sobre las tasas), a partir de los resumenes guardados en BigQuery: el resumen general de cada documento y,
+ si hay lugar, sus resumenes por pagina. Nunca vuelve a leer ni a resumir los PDF: la comparacion es una sola
+ llamada al LLM con un prompt de tamaño acotado, y se guarda en el almacen de resumenes indexada por el conjunto de
+ documentos y la version de su contenido, de modo que repetir la misma comparacion no vuelve a llamar al LLM.
+"""
+
+import hashlib
+import re
+
+from langchain import PromptTemplate
+
+import config
+import llm_cache
+import llm_client
+import page_summary_store
+import persistence_pdf
+from summarize_pdf import CHARS_PER_TOKEN
+
+conf = config.Config()
+
+
+compare_prompt_template = """
+                The following text delimited by triple backquotes contains the summaries of several financial documents,
+                each one preceded by its name, and some of them followed by the summaries of their most relevant pages.
+                Write a comparative summary of the documents, focused on: {topic}.
+                Point out where the documents agree, where they differ and the key figures each one gives,
+                and always refer to each document by its name.
+                ```{text}```
+                COMPARATIVE SUMMARY:
+                """
+
+compare_prompt = PromptTemplate(template=compare_prompt_template, input_variables=["text", "topic"])
+
+# Foco de la comparacion cuando el usuario no indica un tema
+DEFAULT_TOPIC = "the main views and recommendations of each document"
+
+
+def _normalize_topic(topic):
+    return re.sub(r"\s+", " ", topic or "").strip()
+
+
+def _text(value):
+    # Las columnas STRING nulas de BigQuery llegan al dataframe como None o NaN
+    return value if isinstance(value, str) else ""
+
+
+def load_stored_summaries(doc_ids):
+    """
+    Lee de BigQuery los resumenes guardados de los documentos `doc_ids`. Devuelve una lista (ordenada por nombre de
+    documento) de diccionarios {"document_id", "document_name", "summary", "pages"}, donde "pages" es una lista de
+    diccionarios {"page_numbers", "page_hash", "summary"} en orden de pagina (vacia si el documento no tiene
+    resumenes por pagina). Los documentos que no estan en la tabla no se incluyen.
+    """
+    docs_df = persistence_pdf.get_docs_summaries_bq(table_id=conf.DOCUMENTS_BQ_TABLE_ID, doc_ids=doc_ids)
+    pages_df = persistence_pdf.get_docs_pages_summaries_bq(table_id=conf.PAGES_BQ_TABLE_ID, doc_ids=doc_ids)
+
+    documents = {}
+    for _, row in docs_df.iterrows():
+        # Si un documento se inserto mas de una vez, se usa la primera fila
+        documents.setdefault(row["document_id"], {
+            "document_id": row["document_id"],
+            "document_name": _text(row["document_name"]) or row["document_id"],
+            "summary": _text(row["document_llm_summary"]),
+            "pages": [],
+        })
+    for _, row in pages_df.iterrows():
+        if row["document_id"] in documents and _text(row["page_llm_summary"]):
+            documents[row["document_id"]]["pages"].append({
+                "page_numbers": _text(row["page_numbers"]),
+                "page_hash": _text(row["page_hash"]),
+                "summary": row["page_llm_summary"],
+            })
+
+    return sorted(documents.values(), key=lambda document: (document["document_name"], document["document_id"]))
+
+
+def content_version(documents):
+    """Huella del contenido de los documentos: cambia si cambia el resumen o alguna pagina de cualquiera de ellos."""
+    digest = hashlib.sha256()
+    for document in documents:
+        parts = [document["document_id"], page_summary_store.page_fingerprint(document["summary"])]
+        parts += [page["page_hash"] or page_summary_store.page_fingerprint(page["summary"]) for page in document["pages"]]
+        digest.update("\x00".join(parts).encode("utf-8") + b"\x01")
+    return digest.hexdigest()
+
+
+def _truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " ..."
+
+
+def _topic_score(text, topic_words):
+    words = set(re.findall(r"\w+", text.lower()))
+    return len(words & topic_words)
+
+
+def document_context(document, topic, max_chars):
+    """
+    Texto de un documento para el prompt, de a lo sumo `max_chars` caracteres: su resumen general y, con el lugar
+    que quede, los resumenes de las paginas que mas mencionan el tema (en orden de pagina).
+    """
+    # Si hay resumenes por pagina, el resumen general ocupa a lo sumo la mitad del lugar del documento
+    header = F"DOCUMENT: {document['document_name']}\nSUMMARY: "
+    summary_chars = (max_chars // 2 if document["pages"] else max_chars) - len(header)
+    text = header + _truncate(document["summary"], max(summary_chars, 0))
+
+    topic_words = {word for word in re.findall(r"\w+", topic.lower()) if len(word) > 2}
+    ranked = sorted(range(len(document["pages"])),
+                    key=lambda i: -_topic_score(document["pages"][i]["summary"], topic_words))
+    selected, remaining = [], max_chars - len(text)
+    for i in ranked:
+        page = document["pages"][i]
+        line = F"\nPAGE {page['page_numbers']}: {page['summary']}"
+        if len(line) <= remaining:
+            selected.append((i, line))
+            remaining -= len(line)
+
+    return text + "".join(line for _, line in sorted(selected))
+
+
+def build_comparison_text(documents, topic, token_budget):
+    """Une el contexto de todos los documentos, repartiendo `token_budget` tokens en partes iguales entre ellos."""
+    max_chars = token_budget * CHARS_PER_TOKEN // len(documents)
+    return "\n\n".join(document_context(document, topic, max_chars) for document in documents)
+
+
+def compare_documents(project, location, vertex_model, doc_ids, topic="", token_budget=6000, reuse=True):
+    """
+    Compara los documentos `doc_ids` (ver el comentario del modulo), opcionalmente enfocado en `topic` (p.ej. "interest
+    rates"). Devuelve un diccionario {"comparison", "documents", "missing", "version", "reused"}: el texto de la
+    comparacion, los nombres de los documentos comparados, los doc_ids que no tienen resumen guardado, la version del
+    contenido usada como clave y si la comparacion salio del almacen sin llamar al LLM.
+    """
+    documents = load_stored_summaries(doc_ids)
+    found = {document["document_id"] for document in documents}
+    missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+    if len(documents) < 2:
+        raise ValueError(F"Se necesitan al menos dos documentos con resumen guardado para compararlos (sin resumen: {missing})")
+
+    topic = _normalize_topic(topic)
+    version = content_version(documents)
+    store = page_summary_store.get_page_summary_store() if reuse else None
+    key = page_summary_store.page_summary_key(vertex_model, compare_prompt.template, version,
+                                              F"compare:{token_budget}:{topic.lower()}")
+
+    comparison = store.get(key) if store else None
+    reused = comparison is not None
+    if comparison is None:
+        llm_client.init_vertexai(project, location)
+        llm_cache.init_llm_cache()
+        prompt = compare_prompt.format(text=build_comparison_text(documents, topic, token_budget),
+                                       topic=topic or DEFAULT_TOPIC)
+        comparison = llm_client.predict(llm_client.get_llm(vertex_model), prompt)
+        if store:
+            store.put_many({key: comparison})
+
+    return {
+        "comparison": comparison,
+        "documents": [document["document_name"] for document in documents],
+        "missing": missing,
+        "version": version,
+        "reused": reused,
+    }
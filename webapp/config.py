@@ -43,11 +43,99 @@ class Config(object):
     BUCKET_NAME = "" #YOUR_BUCKET_NAME (not the URI)
     #FILE_NAME = "morgan_2023_investment.pdf"
     MODEL_NAME="text-bison@001"
+    SUMMARY_FINAL_MODEL_NAME = "text-unicorn@001"  # Larger model used only for the final consolidation of a summary
+
+    # Summarization settings:
+    SUMMARY_CHAIN_TYPE = "auto"  # "refine" (serial), "map_reduce" (pages summarized concurrently) or "auto" (estimated)
+    SUMMARY_MAX_WORKERS = 8  # Max concurrent LLM calls per document in map_reduce mode
+    SUMMARY_REDUCE_FANOUT = 8  # Partial summaries consolidated per LLM call in the collapse step (at least 2)
+    SUMMARY_PACK_PAGES = True  # Merge adjacent pages into chunks that fill the model context before summarizing
+    SUMMARY_CHUNK_TOKENS = 6000  # Token budget per packed chunk (leaves room for the prompt within the 8k input limit)
+    SUMMARY_LATENCY_SLO_SECONDS = 120  # Max estimated summarization time for the strategy picked by "auto"
+    SUMMARY_STRATEGY_PREFERENCE = ("refine", "packed", "map_reduce")  # Strategies "auto" may pick, best quality first
+    SUMMARY_TRIAGE_PAGES = True  # Strip repeated headers/footers and skip TOC, disclosure, contact and blank pages
+    SUMMARY_REFINE_CONSOLIDATE = False  # Rewrite the refine page summaries with collapse/combine on the final model (extra LLM calls) instead of joining them
+    SUMMARY_STREAM_WINDOW_PAGES = 10  # First pages read before summarizing (triage, "auto" estimate) while the rest are extracted
+
+    # PDF text extraction
+    PDF_EXTRACTOR_BACKEND = "pypdfium2"  # "pypdf" (PyPDFLoader, pure Python, one core) or "pypdfium2" (PDFium, process pool)
+    PDF_EXTRACT_WORKERS = min(4, os.cpu_count() or 1)  # Processes that extract page ranges of a PDF in parallel
+    PDF_EXTRACT_MIN_PAGES_PER_WORKER = 8  # Smaller page ranges are not worth sending to another process
+    PDF_IN_MEMORY_MAX_MB = 32  # Larger uploads are processed from a memory-mapped temp file instead of from memory
+    EXTRACTION_CACHE_ENABLED = True  # Cache the extracted pages of each PDF (Parquet, keyed by SHA-256) to parse it only once
+    EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR', '/tmp/pdf_summarizer_cache/extraction')
+    EXTRACTION_CACHE_MAX_MB = 256
+    EXTRACTION_CACHE_GCS_PREFIX = None  # e.g. "extraction_cache" to also keep the cache in BUCKET_NAME, shared by all instances
+    OCR_ENABLED = True  # OCR (tesseract) of the pages without a text layer or with unreadable text, the rest skip it
+    OCR_MAX_WORKERS = 2  # Processes running tesseract, which is CPU heavy
+    OCR_DPI = 200  # Resolution pages are rendered at before OCR
+    OCR_LANGUAGE = "eng"  # tesseract language(s), e.g. "eng+spa"
+    OCR_MIN_TEXT_CHARS = 20  # Pages with less extracted text than this are OCR'd
+    OCR_MIN_READABLE_RATIO = 0.7  # Pages where fewer characters are letters, digits, spaces or punctuation are OCR'd
+    # Numeric tables (pdfplumber) are stored as DataFrames in TABLES_BQ_TABLE_ID and replaced by a one-line digest in the prompts
+    TABLES_ENABLED = True
+    TABLES_MAX_WORKERS = 2  # Processes running pdfplumber, separate from PDF_EXTRACT_WORKERS so text extraction never waits behind tables
+    TABLES_MIN_ROWS = 3  # Rows (header included) of the smallest table taken out of the text
+    TABLES_MIN_NUMERIC_RATIO = 0.4  # Share of non-empty cells that must be numbers; chart grids and text boxes stay in the text
+    TABLES_DIGEST_MAX_COLUMNS = 6  # Columns named (with the range of the numeric ones) in the digest of each table
+    PDF_PIPELINE_QUEUE_PAGES = 8  # Pages extracted ahead of the summarizer when extraction and summarization overlap
+
+    SECTION_FALLBACK_PAGES = 5  # Pages per section when summarizing by section a PDF without outline (bookmarks)
+
+    # Cross-document comparison, built from the summaries already stored in BigQuery (one LLM call per comparison)
+    COMPARE_TOKEN_BUDGET = 6000  # Max tokens of stored summaries sent to the LLM, split evenly among the documents
+    COMPARE_MAX_DOCUMENTS = 6  # Max documents in one comparison, so each one keeps a useful share of the budget
+
+    # Batch mode (several PDFs uploaded at once, or batch_summarize.py from the command line)
+    BATCH_MAX_CONCURRENT_DOCS = 4  # Documents summarized at the same time (LLM calls are also capped by the quota below)
+    BATCH_PARSE_WORKERS = min(4, os.cpu_count() or 1)  # Processes used to parse the PDFs of a batch
     
+    # Google Cloud clients shared by the whole process (see gcp_clients)
+    GCP_HTTP_POOL_SIZE = 32  # Pooled HTTPS connections per client (Storage, BigQuery); sessions and threads reuse them
+
+    # In-process cache of BigQuery reads (summaries, page summaries, tables); writes from this process invalidate it
+    BQ_READ_CACHE_TTL_SECONDS = 300  # Upper bound on how stale a read can be after another instance writes
+    BQ_READ_CACHE_MAX_MB = 256  # Least recently used reads are dropped beyond this size
+
+    # Background BigQuery writer (streaming inserts) for the summaries, page summaries and tables of each upload
+    BQ_WRITER_BATCH_ROWS = 500  # Rows per insert request, per table
+    BQ_WRITER_FLUSH_SECONDS = 2  # Longest time a row waits in the queue before it is sent
+    BQ_WRITER_MAX_PENDING_ROWS = 10000  # Queued rows before writers block (bounded buffering)
+    BQ_WRITER_MAX_RETRIES = 5  # Retries of a failed insert; rows keep their insertId so retries are not duplicated
+    BQ_WRITER_WAIT_SECONDS = 30  # Longest time the upload page waits for its rows before reporting them as pending
+
+    # Uploads of the original PDFs to BUCKET_NAME (resumable, in chunks, with CRC32C verification)
+    GCS_UPLOAD_CHUNK_MB = 8  # Bytes sent per request (a multiple of 256 KB); bounds the memory used by an upload
+    GCS_UPLOAD_RETRY_SECONDS = 300  # How long failed chunks are retried before giving up; each retry resumes from the last committed byte
+
+    # Vertex AI LLM quota shared by all the sessions of the app process
+    LLM_REQUESTS_PER_MINUTE = 60  # Per-minute online prediction quota of MODEL_NAME in your project
+    LLM_MAX_CONCURRENT_REQUESTS = 16  # Max LLM calls in flight at the same time
+    LLM_MAX_RETRIES = 5  # Retries after a 429 (quota exceeded) response, with exponential backoff
+    LLM_DEFAULT_CALL_SECONDS = 4.0  # Assumed latency of one LLM call until real calls have been measured
+    LLM_CALL_TIMEOUT_SECONDS = 60  # Deadline of each LLM call attempt, transient errors and timeouts are retried
+    LLM_HEDGE_ENABLED = True  # Send a duplicate request when a call takes longer than the model's observed p95 latency
+    LLM_HEDGE_MIN_SECONDS = 2.0  # Never hedge before this many seconds
+    LLM_HEDGE_MIN_SAMPLES = 20  # Measured calls needed before the p95 is trusted for hedging
+    LLM_BREAKER_FAILURES = 5  # Consecutive transient failures that open the circuit breaker of a model
+    LLM_BREAKER_RESET_SECONDS = 30  # Seconds the breaker stays open (failing fast) before letting a test call through
+    LLM_METRICS_PATH = os.getenv('LLM_METRICS_PATH', '/tmp/pdf_summarizer_cache/llm_metrics.sqlite')
+
+    # Persistent LLM response cache (SQLite file shared by all the app processes on the same host)
+    LLM_CACHE_ENABLED = True
+    LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '/tmp/pdf_summarizer_cache/llm_cache.sqlite')
+    LLM_CACHE_MAX_MB = 256
+
+    # Per-page summaries indexed by page text hash, reused when a revised document is uploaded again
+    # (and when a failed summary is retried: every page summary is saved as soon as it is computed)
+    SUMMARY_REUSE_PAGES = True
+    PAGE_SUMMARY_STORE_PATH = os.getenv('PAGE_SUMMARY_STORE_PATH', '/tmp/pdf_summarizer_cache/page_summaries.sqlite')
+
     #The following tables need to exist in your project:
     BQ_DATASET_ID = F'{PROJECT_ID}.pdf_summarizer_data'
     DOCUMENTS_BQ_TABLE_ID = F'{PROJECT_ID}.pdf_summarizer_data.pdf-documents-summaries'
     PAGES_BQ_TABLE_ID = F'{PROJECT_ID}.pdf_summarizer_data.pdf-documents-pages-summaries'
+    TABLES_BQ_TABLE_ID = F'{PROJECT_ID}.pdf_summarizer_data.pdf-documents-tables'
 
     # Vertex AI Conversation & Search Datastore ID
     DATA_STORE_ID = ''  # The Data Store ID of the store you created in your project
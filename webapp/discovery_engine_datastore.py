@@ -1,9 +1,9 @@
-from typing import Optional
+from typing import List, Optional
 
-from google.api_core.client_options import ClientOptions
 from google.cloud import discoveryengine
 
 import config
+import gcp_clients
 
 conf = config.Config()
 
@@ -25,17 +25,12 @@ def import_documents_incremental(
     gcs_uri: Optional[str] = None,
     bigquery_dataset: Optional[str] = None,
     bigquery_table: Optional[str] = None,
+    gcs_uris: Optional[List[str]] = None,
 ) -> str:
     #  For more information, refer to:
     # https://cloud.google.com/generative-ai-app-builder/docs/locations#specify_a_multi-region_for_your_data_store
-    client_options = (
-        ClientOptions(api_endpoint=f"{location}-discoveryengine.googleapis.com")
-        if location != "global"
-        else None
-    )
-
-    # Create a client
-    client = discoveryengine.DocumentServiceClient(client_options=client_options)
+    # The client (one per location) is shared by the whole process, see gcp_clients
+    client = gcp_clients.get_document_service_client(location)
 
     # The full resource name of the search engine branch.
     # e.g. projects/{project}/locations/{location}/dataStores/{data_store_id}/branches/{branch}
@@ -46,11 +41,12 @@ def import_documents_incremental(
         branch="default_branch",
     )
 
-    if gcs_uri:
+    # `gcs_uris` imports several documents in a single operation (batch mode)
+    if gcs_uri or gcs_uris:
         request = discoveryengine.ImportDocumentsRequest(
             parent=parent,
             gcs_source=discoveryengine.GcsSource(
-                input_uris=[gcs_uri], data_schema="content"
+                input_uris=gcs_uris or [gcs_uri], data_schema="content"
             ),
             # Options: `FULL`, `INCREMENTAL`
             reconciliation_mode=discoveryengine.ImportDocumentsRequest.ReconciliationMode.INCREMENTAL,
@@ -68,11 +64,12 @@ def import_documents_incremental(
             reconciliation_mode=discoveryengine.ImportDocumentsRequest.ReconciliationMode.INCREMENTAL,
         )
 
-    # Make the request
-    operation = client.import_documents(request=request)
+    # Make the request (a client left in a bad state is dropped, see gcp_clients.resetting)
+    with gcp_clients.resetting("discoveryengine"):
+        operation = client.import_documents(request=request)
 
-    print(f"Waiting for operation to complete: {operation.operation.name}")
-    response = operation.result()
+        print(f"Waiting for operation to complete: {operation.operation.name}")
+        response = operation.result()
 
     # Once the operation is complete,
     # get information from operation metadata
@@ -0,0 +1,145 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo guarda el texto extraido de cada PDF (y el tamaño de cada pagina) una sola vez por contenido: un
+ archivo Parquet por documento, indexado por el hash SHA-256 del PDF y el backend de extraccion. El cache vive en
+ un directorio local y, opcionalmente, tambien en el bucket de los PDF (EXTRACTION_CACHE_GCS_PREFIX), para que
+ las otras instancias de la app y la indexacion no vuelvan a parsear un documento que ya se parseo en otro lado.
+ Lo usan todos los extractores de pdf_extract, ver pdf_extract.CachedExtractor.
+"""
+
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import config
+import gcp_clients
+
+conf = config.Config()
+
+# Version del formato de los archivos del cache, cambiarla invalida todo lo guardado
+CACHE_FORMAT_VERSION = 3
+
+PAGES_SCHEMA = pa.schema([
+    pa.field("page", pa.int32()),
+    pa.field("text", pa.string()),
+    pa.field("width", pa.float32()),
+    pa.field("height", pa.float32()),
+    # Filas de las tablas numericas de la pagina (ver pdf_extract.TableExtractor), nulo si no tiene
+    pa.field("tables", pa.list_(pa.list_(pa.list_(pa.string())))),
+])
+
+
+def cache_key(sha256, backend):
+    """Clave de un documento en el cache: el hash de su contenido y el backend con que se extrajo."""
+    return F"{sha256}.{backend}.v{CACHE_FORMAT_VERSION}"
+
+
+class ExtractionCache:
+    """
+    Cache de paginas extraidas en archivos Parquet en `directory`, con un tamaño maximo de `max_mb` (se borran los
+    archivos usados hace mas tiempo). Si se indica `gcs_bucket`, los documentos tambien se guardan y se buscan en
+    gs://`gcs_bucket`/`gcs_prefix`/.
+    """
+
+    def __init__(self, directory, max_mb, gcs_bucket=None, gcs_prefix=None):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.bucket = gcp_clients.get_storage_client().bucket(gcs_bucket) if gcs_bucket else None
+        self.gcs_prefix = gcs_prefix
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, F"{key}.parquet")
+
+    def _blob(self, key):
+        return self.bucket.blob(F"{self.gcs_prefix}/{key}.parquet")
+
+    def _tmp_path(self, key):
+        return F"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _download(self, key):
+        blob = self._blob(key)
+        if not blob.exists():
+            return False
+        tmp_path = self._tmp_path(key)
+        blob.download_to_filename(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        return True
+
+    def load(self, key):
+        """
+        Devuelve la lista de paginas ({"page", "text", "width", "height", "tables"}) del documento, o None si no
+        esta.
+        """
+        path = self._path(key)
+        try:
+            if not os.path.exists(path) and not (self.bucket and self._download(key)):
+                return None
+            pages = pq.read_table(path).to_pylist()
+            # La fecha de modificacion marca el ultimo uso, para la eviccion
+            os.utime(path)
+            return pages
+        except Exception as e:
+            # El cache nunca hace fallar la extraccion: ante cualquier error se vuelve a parsear el PDF
+            print(F"No se pudo leer el cache de extraccion {key}: {e}")
+            return None
+
+    def save(self, key, pages):
+        try:
+            # Se escribe en un archivo aparte y se reemplaza, para no dejar un archivo a medio escribir
+            tmp_path = self._tmp_path(key)
+            pq.write_table(pa.Table.from_pylist(pages, schema=PAGES_SCHEMA), tmp_path, compression="zstd")
+            os.replace(tmp_path, self._path(key))
+            if self.bucket:
+                self._blob(key).upload_from_filename(self._path(key))
+            self._evict()
+        except Exception as e:
+            print(F"No se pudo guardar el cache de extraccion {key}: {e}")
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """Devuelve el cache de extraccion del proceso, o None si esta deshabilitado (EXTRACTION_CACHE_ENABLED)."""
+    global _cache
+    if not conf.EXTRACTION_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache(conf.EXTRACTION_CACHE_DIR, conf.EXTRACTION_CACHE_MAX_MB,
+                                     gcs_bucket=conf.BUCKET_NAME if conf.EXTRACTION_CACHE_GCS_PREFIX else None,
+                                     gcs_prefix=conf.EXTRACTION_CACHE_GCS_PREFIX)
+    return _cache
@@ -0,0 +1,180 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Registro de los clientes de Google Cloud del proceso (Cloud Storage, BigQuery, Discovery Engine y Matching Engine):
+ cada cliente se crea una sola vez, la primera vez que se usa, y lo comparten todas las sesiones de Streamlit, sus
+ re-ejecuciones y los threads de la app. Todos usan las mismas credenciales (google.auth.default()), que se
+ refrescan antes de vencer, y los clientes HTTP (Storage, BigQuery) usan una sesion con un pool de conexiones de
+ GCP_HTTP_POOL_SIZE, asi que las llamadas concurrentes reutilizan conexiones en vez de abrir una nueva cada vez.
+ Si un cliente queda en mal estado (p.ej. credenciales revocadas o conexiones rotas), quien lo usa lo hace dentro de
+ resetting(): ante un error de CLIENT_ERRORS se descarta el cliente (y las credenciales, si el error es de
+ autenticacion) y el proximo uso crea uno nuevo.
+"""
+
+import contextlib
+import os
+import threading
+
+import google.auth
+import google.auth.exceptions
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.api_core.client_options import ClientOptions
+from google.api_core.exceptions import Unauthenticated
+from google.cloud import bigquery, storage
+import requests
+
+import config
+
+conf = config.Config()
+
+# Errores de autenticacion: las credenciales compartidas ya no sirven, se descartan junto con todos los clientes
+AUTH_ERRORS = (google.auth.exceptions.RefreshError, Unauthenticated)
+# Errores despues de los cuales no conviene seguir usando el cliente (ver resetting())
+CLIENT_ERRORS = AUTH_ERRORS + (google.auth.exceptions.TransportError, requests.exceptions.ConnectionError)
+
+_clients = {}
+_clients_lock = threading.RLock()
+_credentials = None
+_credentials_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Los clientes (y sus conexiones y canales gRPC) no se pueden usar desde un proceso creado con fork: los
+    # procesos de los pools crean los suyos si los necesitan
+    global _clients_lock, _credentials_lock, _credentials
+    _clients.clear()
+    _credentials = None
+    _clients_lock = threading.RLock()
+    _credentials_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_credentials():
+    """Credenciales por defecto del proceso, refrescadas si ya vencieron (o estan por vencer)."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        if not _credentials.valid:
+            _credentials.refresh(Request())
+        return _credentials
+
+
+def _get_client(key, factory):
+    # Doble chequeo: la creacion (que puede tardar) ocurre una sola vez aunque varios threads pidan el cliente.
+    # El lock es reentrante porque la creacion de un recurso puede pedir un cliente (ver get_resource)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def _http_session():
+    session = AuthorizedSession(get_credentials())
+    adapter = requests.adapters.HTTPAdapter(pool_connections=conf.GCP_HTTP_POOL_SIZE,
+                                            pool_maxsize=conf.GCP_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_storage_client():
+    """Cliente de Cloud Storage del proceso."""
+    return _get_client("storage", lambda: storage.Client(project=conf.PROJECT_ID or None,
+                                                         credentials=get_credentials(), _http=_http_session()))
+
+
+def get_storage_session():
+    """Sesion HTTP autorizada del cliente de Cloud Storage (p.ej. para los uploads resumibles)."""
+    return get_storage_client()._http
+
+
+def get_bigquery_client():
+    """Cliente de BigQuery del proceso."""
+    return _get_client("bigquery", lambda: bigquery.Client(project=conf.PROJECT_ID or None,
+                                                           credentials=get_credentials(), _http=_http_session()))
+
+
+def get_document_service_client(location="global"):
+    """Cliente de documentos de Discovery Engine (Gen App Builder) para `location`."""
+    from google.cloud import discoveryengine
+
+    def _create():
+        client_options = (ClientOptions(api_endpoint=F"{location}-discoveryengine.googleapis.com")
+                          if location != "global" else None)
+        return discoveryengine.DocumentServiceClient(client_options=client_options, credentials=get_credentials())
+
+    return _get_client(("discoveryengine", location), _create)
+
+
+def get_index_client(region):
+    """Cliente de indices de Matching Engine (Vector Search) de `region`."""
+    from google.cloud import aiplatform_v1
+
+    return _get_client(("index", region), lambda: aiplatform_v1.IndexServiceClient(
+        client_options=dict(api_endpoint=F"{region}-aiplatform.googleapis.com"), credentials=get_credentials()))
+
+
+def get_index_endpoint_client(region):
+    """Cliente de endpoints de indices de Matching Engine (Vector Search) de `region`."""
+    from google.cloud import aiplatform_v1
+
+    return _get_client(("index_endpoint", region), lambda: aiplatform_v1.IndexEndpointServiceClient(
+        client_options=dict(api_endpoint=F"{region}-aiplatform.googleapis.com"), credentials=get_credentials()))
+
+
+def get_resource(key, factory):
+    """
+    Objeto del proceso identificado por `key` (p.ej. un indice de Matching Engine ya consultado), creado con
+    factory() la primera vez que se pide. Se descarta con reset_clients() igual que los clientes.
+    """
+    return _get_client(("resource",) + tuple(key), factory)
+
+
+def reset_clients(*names):
+    """
+    Descarta los clientes indicados ("storage", "bigquery", "discoveryengine", "index", "index_endpoint",
+    "resource"), o todos si no se indica ninguno, y las credenciales; se vuelven a crear la proxima vez que se usan.
+    """
+    global _credentials
+    with _clients_lock:
+        for key in list(_clients):
+            if not names or (key[0] if isinstance(key, tuple) else key) in names:
+                del _clients[key]
+    if not names:
+        with _credentials_lock:
+            _credentials = None
+
+
+@contextlib.contextmanager
+def resetting(*names):
+    """
+    Ejecuta el bloque y, si falla con un error de CLIENT_ERRORS, descarta los clientes `names` (todos los clientes y
+    las credenciales si el error es de autenticacion) antes de relanzar el error, para que el proximo uso no vuelva a
+    fallar con el mismo cliente roto.
+    """
+    try:
+        yield
+    except CLIENT_ERRORS as e:
+        print(F"Se descartan los clientes {', '.join(names) or 'de GCP'} despues de un error: {type(e).__name__}: {e}")
+        if isinstance(e, AUTH_ERRORS):
+            reset_clients()
+        else:
+            reset_clients(*names)
+        raise
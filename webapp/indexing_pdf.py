@@ -24,11 +24,11 @@ import config
 import numpy as np
 #import vertexai
 import persistence_pdf 
+import pdf_extract
+import llm_client
 
 
 #Langchain
-from langchain.llms import VertexAI
-from langchain.document_loaders import GCSDirectoryLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Vertex AI
@@ -82,14 +82,14 @@ class CustomVertexAIEmbeddings(VertexAIEmbeddings):
         return [r.values for r in results]
 
 
-# Text model instance integrated with langChain
-llm = VertexAI(
-    model_name=conf.MODEL_NAME,
+# Text model instance integrated with langChain, its calls go through llm_client (shared quota, persistent response
+# cache, deadlines, retries, hedged requests and circuit breaker)
+llm = llm_client.get_resilient_llm(
+    conf.MODEL_NAME,
     max_output_tokens=1024,
     temperature=0.2,
     top_p=0.8,
     top_k=40,
-    verbose=True,
 )
 
 
@@ -142,10 +142,10 @@ def bulk_index_documents_ingest():
 
 
     print(f"Processing documents from {GCS_BUCKET_DOCS}")
-    loader = GCSDirectoryLoader(
-        project_name = conf.PROJECT_ID, bucket = GCS_BUCKET_DOCS, prefix=folder_prefix
+    # Una pagina por Document, extraidas con el backend configurado (ver pdf_extract) en vez de GCSDirectoryLoader
+    documents = pdf_extract.load_gcs_directory(
+        project = conf.PROJECT_ID, bucket = GCS_BUCKET_DOCS, prefix=folder_prefix
     )
-    documents = loader.load()
 
 
     # {PROJECT_ID}-documents/documents/google-research-pdfs/file.pdf
@@ -0,0 +1,138 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo implementa un cache persistente en disco de las respuestas del LLM, que se conecta a LangChain
+ (langchain.llm_cache) y por lo tanto aplica a todas las llamadas que se hacen con el LLM VertexAI de LangChain.
+ Las respuestas se guardan en SQLite, indexadas por un hash del modelo, sus parametros de generacion y el prompt
+ ya renderizado, con eviccion LRU cuando se supera el tamaño maximo. Al ser un archivo SQLite, el mismo cache
+ se comparte entre los distintos procesos de Streamlit que corran en la misma maquina.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import langchain
+from langchain.cache import BaseCache, RETURN_VAL_TYPE
+from langchain.schema import Generation
+
+import config
+
+conf = config.Config()
+
+
+class SQLiteLRUCache(BaseCache):
+    """Cache de respuestas del LLM en SQLite, con tamaño maximo y eviccion LRU."""
+
+    def __init__(self, database_path: str, max_bytes: int):
+        self.database_path = database_path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        with self._connect() as conn:
+            # WAL permite lecturas concurrentes desde varios procesos mientras otro escribe
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO llm_cache_stats VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @contextmanager
+    def _connect(self):
+        # Una conexion por operacion: las conexiones de sqlite3 no se pueden compartir entre threads
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        # llm_string es generado por LangChain e incluye el nombre del modelo y todos sus parametros de generacion
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute("UPDATE llm_cache_stats SET value = value + 1 WHERE name = 'misses'")
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.execute("UPDATE llm_cache_stats SET value = value + 1 WHERE name = 'hits'")
+        return [Generation(text=text) for text in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        response = json.dumps([generation.text for generation in return_val])
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                (self._key(prompt, llm_string), response, len(response), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn) -> None:
+        """Borra las entradas usadas hace mas tiempo hasta que el cache vuelva a estar bajo max_bytes."""
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC"):
+            if total_bytes <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total_bytes -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", to_delete)
+        conn.execute("UPDATE llm_cache_stats SET value = value + ? WHERE name = 'evictions'", (len(to_delete),))
+
+    def clear(self, **kwargs) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+            conn.execute("UPDATE llm_cache_stats SET value = 0")
+
+    def stats(self) -> dict:
+        """Devuelve los contadores de hits/misses (compartidos por todos los procesos) y el tamaño del cache."""
+        with self._connect() as conn:
+            stats = dict(conn.execute("SELECT name, value FROM llm_cache_stats").fetchall())
+            stats["entries"], stats["bytes"] = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def init_llm_cache():
+    """Instala (una sola vez por proceso) el cache persistente como cache global de LangChain y lo devuelve."""
+    global _cache
+    if not conf.LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteLRUCache(conf.LLM_CACHE_PATH, conf.LLM_CACHE_MAX_MB * 1024 * 1024)
+            langchain.llm_cache = _cache
+    return _cache
@@ -0,0 +1,573 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo centraliza el acceso al LLM de Vertex AI: inicializa vertexai una sola vez, reutiliza los clientes
+ VertexAI de LangChain entre llamadas, y hace pasar todas las llamadas al LLM (sincronicas y asincronicas) por un
+ limitador de cuota compartido por todo el proceso, de modo que las sesiones concurrentes de Streamlit se reparten
+ la cuota por minuto del modelo en orden de llegada, en vez de que cada una reciba errores 429 y reintente a ciegas.
+
+ Ademas cada llamada tiene un deadline, se reintenta con backoff exponencial con jitter ante errores transitorios,
+ envia un request duplicado ("hedged") cuando tarda mas que el p95 observado del modelo y usa la primera respuesta
+ que llegue, y pasa por un circuit breaker por modelo que falla rapido mientras el backend esta degradado.
+ Para usar el LLM dentro de cadenas de LangChain, get_resilient_llm() devuelve un LLM de LangChain que hace todas
+ sus llamadas a traves de predict()/apredict().
+"""
+
+import asyncio
+import collections
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, List, Optional
+
+import vertexai
+from google.api_core.exceptions import (
+    DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+)
+from langchain.llms import VertexAI
+from langchain.llms.base import LLM
+from langchain.llms.utils import enforce_stop_tokens
+from langchain.schema import Generation
+
+import config
+import gcp_clients
+import llm_cache
+import llm_metrics
+
+conf = config.Config()
+
+
+class QuotaLimiter:
+    """
+    Token bucket con la cuota de llamadas por minuto, mas un maximo de llamadas en vuelo. Es seguro entre threads
+    y entre distintos event loops de asyncio (cada sesion de Streamlit corre en su propio thread), y atiende a los
+    que esperan en orden FIFO para repartir la cuota de forma justa.
+    """
+
+    def __init__(self, requests_per_minute, max_concurrent):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, min(float(max_concurrent), float(requests_per_minute)))
+        self.max_concurrent = max_concurrent
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._waiting = collections.deque()
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, ticket):
+        """Intenta tomar un lugar para `ticket`. Devuelve 0 si lo obtuvo, o los segundos a esperar antes de reintentar."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self._waiting[0] != ticket:
+                return 0.05
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            if self.in_flight >= self.max_concurrent:
+                return 0.05
+            self._waiting.popleft()
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def _enqueue(self):
+        ticket = next(self._tickets)
+        with self._lock:
+            self._waiting.append(ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+
+    def acquire(self):
+        ticket = self._enqueue()
+        try:
+            while True:
+                wait = self._try_acquire(ticket)
+                if not wait:
+                    return
+                time.sleep(wait)
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+
+    async def aacquire(self):
+        ticket = self._enqueue()
+        try:
+            while True:
+                wait = self._try_acquire(ticket)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            # p.ej. asyncio.CancelledError: liberar el turno para no bloquear a los que siguen en la fila
+            self._dequeue(ticket)
+            raise
+
+    def acquire_nowait(self):
+        """Toma un lugar solo si hay cuota disponible ya y nadie esta esperando; devuelve True si lo obtuvo."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._waiting or now < self.paused_until or self.tokens < 1 or self.in_flight >= self.max_concurrent:
+                return False
+            self.tokens -= 1
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def penalize(self, seconds):
+        """Pausa a todos los que usan el limitador, se usa cuando el backend responde 429 (cuota excedida)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class LLMTimeoutError(TimeoutError):
+    """La llamada al LLM no respondio dentro de su deadline (conf.LLM_CALL_TIMEOUT_SECONDS)."""
+
+
+class CircuitOpenError(RuntimeError):
+    """El circuit breaker del modelo esta abierto: el backend fallo varias veces seguidas, no se lo llama."""
+
+
+# Errores del backend que justifican reintentar la llamada (ResourceExhausted se maneja aparte con el limitador)
+TRANSIENT_ERRORS = (LLMTimeoutError, DeadlineExceeded, ServiceUnavailable, InternalServerError)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de un modelo: despues de `failure_threshold` errores transitorios seguidos se abre y rechaza las
+    llamadas durante `reset_seconds`; luego deja pasar una llamada de prueba (half-open) y se cierra si responde bien.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Lanza CircuitOpenError si el circuito esta abierto. Devuelve True si la llamada es la de prueba (half-open):
+        quien llama debe terminarla con record_success(), record_failure() o release_probe().
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_seconds or self._probing:
+                raise CircuitOpenError(
+                    f"El LLM fallo {self.failures} veces seguidas, se reintentara en hasta {self.reset_seconds} s"
+                )
+            self._probing = True
+            return True
+
+    def release_probe(self):
+        """
+        Termina la llamada de prueba sin cambiar el estado del circuito (p.ej. fallo con un 429 o un error que no es
+        transitorio): la proxima llamada puede volver a probar.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+_limiter = None
+_breakers = {}
+_hedge_thresholds = {}
+_executor = None
+_llms = {}
+_initialized = set()
+_lock = threading.Lock()
+
+
+def get_limiter():
+    """Devuelve el limitador de cuota del proceso, compartido por todas las sesiones."""
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            _limiter = QuotaLimiter(conf.LLM_REQUESTS_PER_MINUTE, conf.LLM_MAX_CONCURRENT_REQUESTS)
+    return _limiter
+
+
+def get_circuit_breaker(model_name):
+    """Devuelve el circuit breaker del modelo, compartido por todo el proceso."""
+    with _lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker(conf.LLM_BREAKER_FAILURES, conf.LLM_BREAKER_RESET_SECONDS)
+        return _breakers[model_name]
+
+
+def _get_executor():
+    # Threads de las llamadas sincronicas; las que vencen su deadline siguen ocupando un thread hasta que el backend
+    # responde, por eso hay bastantes mas threads que llamadas en vuelo permitidas
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4 * conf.LLM_MAX_CONCURRENT_REQUESTS,
+                                           thread_name_prefix="llm_call")
+        return _executor
+
+
+def _hedge_after(model_name):
+    """
+    Segundos despues de los cuales se envia un request duplicado: el p95 de latencia observado del modelo (con un
+    minimo de conf.LLM_HEDGE_MIN_SECONDS), recalculado cada 30 s. None si no hay suficientes llamadas medidas.
+    """
+    if not conf.LLM_HEDGE_ENABLED:
+        return None
+    now = time.monotonic()
+    threshold, computed_at = _hedge_thresholds.get(model_name, (None, 0.0))
+    if now - computed_at > 30:
+        stats = llm_metrics.get_latency_recorder().stats(model_name)
+        threshold = None
+        if stats and stats["count"] >= conf.LLM_HEDGE_MIN_SAMPLES:
+            threshold = max(conf.LLM_HEDGE_MIN_SECONDS, stats["p95"])
+        _hedge_thresholds[model_name] = (threshold, now)
+    return threshold
+
+
+def init_vertexai(project, location):
+    """Inicializa vertexai una sola vez por (proyecto, region)."""
+    with _lock:
+        if (project, location) not in _initialized:
+            vertexai.init(project=project, location=location)
+            _initialized.add((project, location))
+
+
+def get_llm(model_name, **params):
+    """Devuelve un cliente VertexAI de LangChain reutilizado para el mismo modelo y parametros de generacion."""
+    key = (model_name, tuple(sorted(params.items())))
+    with _lock:
+        if key not in _llms:
+            # Los reintentos por cuota los maneja predict()/apredict() con el limitador compartido, no LangChain,
+            # y el cache de respuestas se consulta en predict()/apredict() antes de ocupar un lugar del limitador
+            _llms[key] = VertexAI(model_name=model_name, max_retries=1, cache=False, **params)
+        return _llms[key]
+
+
+def _drop_llm(llm):
+    # El cliente del modelo quedo en mal estado (p.ej. credenciales revocadas): el proximo get_llm() crea uno nuevo
+    with _lock:
+        for key in [key for key, value in _llms.items() if value is llm]:
+            del _llms[key]
+
+
+def _llm_string(llm):
+    # Igual que BaseLLM.generate() de LangChain: los parametros del modelo mas la secuencia de stop
+    params = llm.dict()
+    params["stop"] = None
+    return str(sorted([(k, v) for k, v in params.items()]))
+
+
+def _cache_lookup(llm, text):
+    cache = llm_cache.init_llm_cache()
+    if cache is None:
+        return None
+    generations = cache.lookup(text, _llm_string(llm))
+    return generations[0].text if generations else None
+
+
+def _cache_update(llm, text, response):
+    cache = llm_cache.init_llm_cache()
+    if cache is not None:
+        cache.update(text, _llm_string(llm), [Generation(text=response)])
+
+
+def _backoff(attempt):
+    return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _record_latency(llm, text, started):
+    seconds = time.time() - started
+    llm_metrics.get_latency_recorder().record(llm.model_name, seconds, len(text))
+    llm_metrics.get_latency_histogram().observe(llm.model_name, seconds)
+
+
+def _count(llm, event):
+    llm_metrics.get_latency_histogram().count_event(llm.model_name, event)
+
+
+def _timed_call(llm, text):
+    """Una llamada real al modelo, con un lugar del limitador ya tomado que se libera al terminar."""
+    try:
+        started = time.time()
+        response = llm.predict(text)
+        _record_latency(llm, text, started)
+        return response
+    finally:
+        get_limiter().release()
+
+
+def _hedged_call(llm, text):
+    """
+    Llama al modelo con deadline: si la llamada supera el p95 observado se envia un duplicado (solo si hay cuota
+    disponible sin hacer esperar a nadie) y se devuelve la primera respuesta exitosa.
+    """
+    executor = _get_executor()
+    limiter = get_limiter()
+    limiter.acquire()
+    deadline = time.monotonic() + conf.LLM_CALL_TIMEOUT_SECONDS
+    primary = executor.submit(_timed_call, llm, text)
+    pending = {primary}
+    hedge_after = _hedge_after(llm.model_name)
+
+    if hedge_after is not None:
+        done, _ = wait(pending, timeout=min(hedge_after, conf.LLM_CALL_TIMEOUT_SECONDS))
+        if not done and limiter.acquire_nowait():
+            _count(llm, "hedged")
+            pending.add(executor.submit(_timed_call, llm, text))
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            _count(llm, "timeout")
+            raise LLMTimeoutError(f"El LLM no respondio en {conf.LLM_CALL_TIMEOUT_SECONDS} s")
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    _count(llm, "hedge_won")
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def _atimed_call(llm, text):
+    try:
+        started = time.time()
+        response = await llm.apredict(text)
+        # Las metricas y el cache de respuestas son SQLite: se usan desde un thread para no bloquear el event loop
+        await asyncio.to_thread(_record_latency, llm, text, started)
+        return response
+    finally:
+        get_limiter().release()
+
+
+async def _ahedged_call(llm, text):
+    """Version asincronica de _hedged_call(); el request que pierde se cancela."""
+    limiter = get_limiter()
+    await limiter.aacquire()
+    deadline = time.monotonic() + conf.LLM_CALL_TIMEOUT_SECONDS
+    primary = asyncio.ensure_future(_atimed_call(llm, text))
+    pending = {primary}
+    hedge_after = _hedge_after(llm.model_name)
+
+    try:
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(pending, timeout=min(hedge_after, conf.LLM_CALL_TIMEOUT_SECONDS))
+            if not done and limiter.acquire_nowait():
+                _count(llm, "hedged")
+                pending.add(asyncio.ensure_future(_atimed_call(llm, text)))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _count(llm, "timeout")
+                raise LLMTimeoutError(f"El LLM no respondio en {conf.LLM_CALL_TIMEOUT_SECONDS} s")
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _count(llm, "hedge_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def predict(llm, text):
+    """
+    Llama al LLM respetando la cuota compartida; ante un 429 pausa a todos y reintenta con backoff exponencial.
+    Las respuestas que ya estan en el cache (ver llm_cache) se devuelven sin ocupar cuota, y la latencia de cada
+    llamada real al modelo se registra en llm_metrics.
+
+    Cada intento tiene un deadline de conf.LLM_CALL_TIMEOUT_SECONDS y puede enviar un request duplicado (ver
+    _hedged_call()); los errores transitorios (TRANSIENT_ERRORS) se reintentan con backoff y jitter, y cuentan para
+    el circuit breaker del modelo, que mientras esta abierto hace fallar la llamada de inmediato con CircuitOpenError.
+    """
+    cached = _cache_lookup(llm, text)
+    if cached is not None:
+        return cached
+
+    limiter = get_limiter()
+    breaker = get_circuit_breaker(llm.model_name)
+    for attempt in range(conf.LLM_MAX_RETRIES + 1):
+        try:
+            probe = breaker.check()
+        except CircuitOpenError:
+            _count(llm, "circuit_open")
+            raise
+        try:
+            response = _hedged_call(llm, text)
+            breaker.record_success()
+            probe = False
+            _cache_update(llm, text, response)
+            return response
+        except ResourceExhausted:
+            if attempt == conf.LLM_MAX_RETRIES:
+                raise
+            limiter.penalize(_backoff(attempt))
+        except TRANSIENT_ERRORS:
+            breaker.record_failure()
+            probe = False
+            if attempt == conf.LLM_MAX_RETRIES:
+                raise
+            _count(llm, "retry")
+            time.sleep(_backoff(attempt))
+        except gcp_clients.CLIENT_ERRORS:
+            _drop_llm(llm)
+            raise
+        finally:
+            # Una llamada de prueba que termino de cualquier otra forma (429, error no transitorio, cancelacion) no
+            # deja el circuito abierto para siempre
+            if probe:
+                breaker.release_probe()
+
+
+async def apredict(llm, text):
+    """Version asincronica de predict()."""
+    cached = await asyncio.to_thread(_cache_lookup, llm, text)
+    if cached is not None:
+        return cached
+
+    limiter = get_limiter()
+    breaker = get_circuit_breaker(llm.model_name)
+    for attempt in range(conf.LLM_MAX_RETRIES + 1):
+        try:
+            probe = breaker.check()
+        except CircuitOpenError:
+            _count(llm, "circuit_open")
+            raise
+        try:
+            response = await _ahedged_call(llm, text)
+            breaker.record_success()
+            probe = False
+            await asyncio.to_thread(_cache_update, llm, text, response)
+            return response
+        except ResourceExhausted:
+            if attempt == conf.LLM_MAX_RETRIES:
+                raise
+            limiter.penalize(_backoff(attempt))
+        except TRANSIENT_ERRORS:
+            breaker.record_failure()
+            probe = False
+            if attempt == conf.LLM_MAX_RETRIES:
+                raise
+            _count(llm, "retry")
+            await asyncio.sleep(_backoff(attempt))
+        except gcp_clients.CLIENT_ERRORS:
+            _drop_llm(llm)
+            raise
+        finally:
+            # Una llamada de prueba que termino de cualquier otra forma (429, error no transitorio, cancelacion) no
+            # deja el circuito abierto para siempre
+            if probe:
+                breaker.release_probe()
+
+
+# Errores despues de los cuales conviene repetir la llamada con otro modelo (ver predict_with_fallback()): solo los
+# transitorios del backend del modelo (timeouts, 5xx, cuota agotada, circuito abierto). Un request invalido o sin
+# permisos falla igual con el otro modelo, asi que se propaga
+FALLBACK_ERRORS = TRANSIENT_ERRORS + (ResourceExhausted, CircuitOpenError)
+
+
+def predict_with_fallback(llm, fallback_llm, text):
+    """
+    predict() con `llm`; si falla (despues de sus reintentos) con uno de FALLBACK_ERRORS se repite la llamada con
+    `fallback_llm`. Devuelve la tupla (respuesta, llm_que_respondio), para que quien guarde la respuesta la asocie
+    al modelo que realmente la genero.
+    """
+    if fallback_llm is None or fallback_llm is llm:
+        return predict(llm, text), llm
+    try:
+        return predict(llm, text), llm
+    except FALLBACK_ERRORS as e:
+        print(f"Fallo el modelo {llm.model_name} ({type(e).__name__}), se usa {fallback_llm.model_name}")
+        _count(llm, "fallback")
+        return predict(fallback_llm, text), fallback_llm
+
+
+async def apredict_with_fallback(llm, fallback_llm, text):
+    """Version asincronica de predict_with_fallback()."""
+    if fallback_llm is None or fallback_llm is llm:
+        return await apredict(llm, text), llm
+    try:
+        return await apredict(llm, text), llm
+    except FALLBACK_ERRORS as e:
+        print(f"Fallo el modelo {llm.model_name} ({type(e).__name__}), se usa {fallback_llm.model_name}")
+        _count(llm, "fallback")
+        return await apredict(fallback_llm, text), fallback_llm
+
+
+class ResilientLLM(LLM):
+    """
+    LLM de LangChain que hace todas sus llamadas con predict()/apredict() (cuota compartida, cache, deadline,
+    reintentos, hedging y circuit breaker), para usar el LLM de Vertex AI dentro de cadenas de LangChain.
+    """
+
+    llm: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient_vertexai"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.llm._identifying_params
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        response = predict(self.llm, prompt)
+        return enforce_stop_tokens(response, stop) if stop else response
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        response = await apredict(self.llm, prompt)
+        return enforce_stop_tokens(response, stop) if stop else response
+
+
+def get_resilient_llm(model_name, **params):
+    """LLM de LangChain para cadenas (ver ResilientLLM) sobre el cliente VertexAI de get_llm()."""
+    # El cache de respuestas ya lo consulta predict(), LangChain no debe consultarlo de nuevo
+    return ResilientLLM(llm=get_llm(model_name, **params), cache=False)
@@ -0,0 +1,171 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo registra la latencia de las llamadas al LLM (por modelo y tamaño del prompt) en un archivo SQLite
+ compartido por los procesos de la app, para poder estimar cuanto va a tardar un resumen antes de hacerlo.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+conf = config.Config()
+
+
+class LatencyRecorder:
+    """Guarda las ultimas `max_samples` latencias de cada modelo."""
+
+    def __init__(self, database_path, max_samples=1000):
+        self.database_path = database_path
+        self.max_samples = max_samples
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_calls ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT NOT NULL, latency REAL NOT NULL,"
+                " prompt_chars INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_calls_model ON llm_calls (model, id)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, model, latency, prompt_chars):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO llm_calls (model, latency, prompt_chars, created_at) VALUES (?, ?, ?, ?)",
+                (model, latency, prompt_chars, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM llm_calls WHERE model = ? AND id <= ?", (model, cursor.lastrowid - self.max_samples)
+            )
+
+    def stats(self, model):
+        """
+        Devuelve {"count", "mean", "p50", "p95", "base_seconds", "seconds_per_char"} para el modelo, donde las dos
+        ultimas son el ajuste lineal latencia = base_seconds + seconds_per_char * caracteres_del_prompt.
+        Devuelve None si todavia no hay llamadas registradas.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT latency, prompt_chars FROM llm_calls WHERE model = ?", (model,)).fetchall()
+        if not rows:
+            return None
+
+        latencies = sorted(latency for latency, _ in rows)
+        count = len(latencies)
+        mean = sum(latencies) / count
+
+        # Minimos cuadrados de latencia vs. tamaño del prompt
+        mean_chars = sum(chars for _, chars in rows) / count
+        variance = sum((chars - mean_chars) ** 2 for _, chars in rows)
+        slope = 0.0
+        if variance > 0:
+            slope = max(0.0, sum((chars - mean_chars) * (latency - mean) for latency, chars in rows) / variance)
+
+        return {
+            "count": count,
+            "mean": mean,
+            "p50": latencies[int(0.50 * (count - 1))],
+            "p95": latencies[int(0.95 * (count - 1))],
+            "base_seconds": max(0.0, mean - slope * mean_chars),
+            "seconds_per_char": slope,
+        }
+
+    def estimate_seconds(self, model, prompt_chars):
+        """Latencia esperada de una llamada con un prompt de `prompt_chars` caracteres."""
+        stats = self.stats(model)
+        if stats is None:
+            return conf.LLM_DEFAULT_CALL_SECONDS
+        return stats["base_seconds"] + stats["seconds_per_char"] * prompt_chars
+
+
+class LatencyHistogram:
+    """
+    Histograma en memoria (por proceso) de la latencia de las llamadas al LLM por modelo, con buckets fijos en
+    segundos, mas contadores de los eventos de las llamadas (reintentos, timeouts, requests "hedged", etc.).
+    """
+
+    BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, float("inf"))
+
+    def __init__(self):
+        self._counts = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, seconds):
+        bucket = next(upper for upper in self.BUCKETS if seconds <= upper)
+        with self._lock:
+            counts = self._counts.setdefault(model, dict.fromkeys(self.BUCKETS, 0))
+            counts[bucket] += 1
+
+    def count_event(self, model, event):
+        with self._lock:
+            key = (model, event)
+            self._events[key] = self._events.get(key, 0) + 1
+
+    def snapshot(self):
+        """
+        Devuelve {"buckets": {modelo: {"<= 0.5s": n, ...}}, "events": {modelo: {evento: n}}}, donde cada
+        bucket cuenta las llamadas con latencia entre el limite del bucket anterior y el suyo.
+        """
+        with self._lock:
+            buckets = {
+                model: {("> 64s" if upper == float("inf") else f"<= {upper}s"): count for upper, count in counts.items()}
+                for model, counts in self._counts.items()
+            }
+            events = {}
+            for (model, event), count in self._events.items():
+                events.setdefault(model, {})[event] = count
+        return {"buckets": buckets, "events": events}
+
+
+_recorder = None
+_histogram = LatencyHistogram()
+_recorder_lock = threading.Lock()
+
+
+def get_latency_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = LatencyRecorder(conf.LLM_METRICS_PATH)
+    return _recorder
+
+
+def get_latency_histogram():
+    return _histogram
+
+
+def latency_report(models):
+    """
+    Reporte lado a lado de la latencia historica de varios modelos (p.ej. el modelo rapido y el modelo final de un
+    resumen): una lista con {"model", "count", "mean", "p50", "p95"} por modelo, con ceros si no hay llamadas.
+    """
+    report = []
+    for model in dict.fromkeys(models):
+        stats = get_latency_recorder().stats(model) or {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0}
+        report.append({"model": model, **{key: stats[key] for key in ("count", "mean", "p50", "p95")}})
+    return report
@@ -0,0 +1,88 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo aplica OCR (tesseract, instalado en la imagen de Docker) solo a las paginas escaneadas de un PDF: las
+ que no tienen capa de texto o cuyo texto extraido es basura (p.ej. fuentes sin mapa de caracteres). Esas paginas se
+ renderizan con PDFium y se pasan por tesseract en un pool de procesos acotado (OCR_MAX_WORKERS); el resto de las
+ paginas usa el texto extraido sin ningun costo extra. El texto reconocido se guarda en el almacen de resumenes
+ indexado por el hash de la imagen de la pagina, asi que la misma pagina escaneada no vuelve a pasar por OCR.
+"""
+
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdfium2 as pdfium
+import pytesseract
+
+import config
+import page_summary_store
+
+conf = config.Config()
+
+# Caracteres que cuentan como texto legible, ademas de letras, digitos y espacios
+_READABLE_PUNCTUATION = set(".,;:!?%$€£¥()[]{}'\"-–—/&*+=<>@#•·…’‘“”")
+
+
+def needs_ocr(text):
+    """
+    True si la pagina no tiene capa de texto (menos de OCR_MIN_TEXT_CHARS caracteres) o si menos de
+    OCR_MIN_READABLE_RATIO de sus caracteres son letras, digitos, espacios o puntuacion.
+    """
+    stripped = (text or "").strip()
+    if len(stripped) < conf.OCR_MIN_TEXT_CHARS:
+        return True
+    readable = sum(1 for char in stripped if char.isalnum() or char.isspace() or char in _READABLE_PUNCTUATION)
+    return readable / len(stripped) < conf.OCR_MIN_READABLE_RATIO
+
+
+def ocr_page(pdf_input, page_number, dpi, language):
+    """
+    Renderiza la pagina `page_number` de `pdf_input` (ruta o bytes del PDF) y devuelve su texto reconocido por OCR.
+    Se ejecuta en los procesos del pool, por eso es una funcion del modulo.
+    """
+    pdf = pdfium.PdfDocument(pdf_input)
+    try:
+        page = pdf[page_number]
+        image = page.render(scale=dpi / 72, grayscale=True).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+
+    store = page_summary_store.get_page_summary_store()
+    key = page_summary_store.page_summary_key(F"tesseract:{language}", "ocr",
+                                              hashlib.sha256(image.tobytes()).hexdigest(), str(dpi))
+    text = store.get(key)
+    if text is None:
+        try:
+            text = pytesseract.image_to_string(image, lang=language)
+        except Exception as e:
+            # Algunas excepciones de pytesseract no se pueden pasar al proceso principal (y rompen el pool)
+            raise RuntimeError(F"{type(e).__name__}: {e}") from None
+        store.put_many({key: text})
+    return text
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool():
+    """Pool de procesos de OCR del proceso de la app (se crea la primera vez que se usa)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=conf.OCR_MAX_WORKERS)
+    return _pool
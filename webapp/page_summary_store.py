@@ -0,0 +1,108 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo guarda los resumenes parciales de cada pagina, indexados por la huella (hash) del texto de la pagina,
+ para que cuando se vuelve a subir un documento revisado solo se resuman con el LLM las paginas que cambiaron.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+conf = config.Config()
+
+
+def page_fingerprint(text):
+    """Hash SHA-256 del texto de una pagina, ignorando diferencias de espacios en blanco de la extraccion."""
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def page_summary_key(model_name, prompt_template, fingerprint, context=""):
+    """
+    Clave de un resumen de pagina: el mismo texto de pagina resumido con el mismo modelo y el mismo prompt
+    produce el mismo resumen. `context` permite incluir otras entradas del prompt (p.ej. el resumen previo en refine).
+    """
+    raw = "\x00".join([model_name, prompt_template, fingerprint, context])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PageSummaryStore:
+    """Almacen en SQLite de resumenes de pagina, compartido por todos los procesos de la app en la misma maquina."""
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS page_summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT summary FROM page_summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        """Devuelve un diccionario {clave: resumen} solo con las claves que existen en el almacen."""
+        found = {}
+        keys = list(set(keys))
+        with self._connect() as conn:
+            # SQLite limita la cantidad de parametros por consulta, se consulta por lotes
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(conn.execute(
+                    f"SELECT key, summary FROM page_summaries WHERE key IN ({placeholders})", batch
+                ).fetchall())
+        return found
+
+    def put_many(self, summaries):
+        """Guarda un diccionario {clave: resumen}."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO page_summaries VALUES (?, ?, ?)",
+                [(key, summary, now) for key, summary in summaries.items()],
+            )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_page_summary_store():
+    """Devuelve el almacen de resumenes de pagina del proceso (se crea la primera vez que se usa)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PageSummaryStore(conf.PAGE_SUMMARY_STORE_PATH)
+    return _store
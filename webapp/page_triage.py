@@ -0,0 +1,280 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo hace un filtrado rapido (sin LLM) de las paginas del PDF antes de resumirlas: quita las lineas que se
+ repiten en muchas paginas (encabezados, pies de pagina, avisos legales cortos) y detecta con estadisticas simples del
+ texto las paginas con poca informacion (indices, disclosures, paginas de contacto, paginas en blanco o solo imagenes),
+ para que no lleguen al LLM.
+
+ Las paginas llegan como los Document de load_and_split() o de pdf_pipeline.PageStream, donde el splitter puede partir
+ una pagina larga del PDF en varios chunks con el mismo metadata["page"]: las lineas repetidas se cuentan por pagina
+ del PDF y cada pagina se clasifica con el texto de todos sus chunks.
+"""
+
+import itertools
+import re
+from collections import Counter
+
+from langchain.docstore.document import Document
+
+
+# Etiquetas de las paginas que no se envian al LLM
+LOW_INFORMATION_LABELS = ("blank", "toc", "disclosure", "contact")
+
+# Frases y palabras propias de los avisos legales. Las palabras que tambien usa el contenido de un informe financiero
+# ("securities", "affiliates", "subsidiary") no se usan: una pagina de contenido puede tener alguna linea con estos
+# terminos, un disclosure los tiene en buena parte de sus lineas
+DISCLOSURE_TERMS = (
+    "disclosure", "disclaimer", "important information", "past performance", "not indicative of", "reliable indicator",
+    "fdic", "sipc", "finra", "bank guarantee", "may lose value", "recommendation", "informational purposes",
+    "information purposes", "does not constitute", "not be construed", "relied upon", "rely on", "subject to change",
+    "without notice", "without prior notice", "trademark", "all rights reserved", "©", "forward-looking",
+    "investment advice", "tax advice", "legal advice", "not intended", "no representation", "warranty", "liability",
+    "solicitation", "offer to buy", "offer to sell", "regulated", "authorised", "authorized", "jurisdiction",
+    "prospectus", "consult", "advisers", "advisors", "guarantee", "privacy", "issued by", "registered",
+    "unmanaged", "invest directly", "professional investors", "not to be distributed", "unlawful",
+)
+
+# Cargos y titulos de las paginas de autores o de contacto ("Managing Director", "Chief Economist", "CFA")
+ROLE = re.compile(
+    r"\b(managing director|executive director|director|vice president|president|strategist|economist|analyst|"
+    r"portfolio manager|manager|team leader|head of|chief|officer|partner|associate|advisor|adviser|"
+    r"cfa|cfp|caia|ph\.?\s?d|m\.?\s?sc|mba)\b",
+    re.IGNORECASE,
+)
+# Nombres de persona: entre una y cuatro palabras que empiezan con mayuscula, p.ej. "Roger A. Aliaga-Díaz,"
+PERSON_NAME = re.compile(r"^(?:(?:Dr|Mr|Ms|Mrs)\.\s)?[A-ZÀ-Ý][\w'’.-]*(?:\s[A-ZÀ-Ý][\w'’.-]*){0,3},?$")
+
+TOC_LINE = re.compile(r"^[^\d]{3,}?(\.{2,}|\s+)\d{1,3}$")
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+PHONE = re.compile(r"\+?\(?\d{1,3}\)?[\s.-]\d{3}[\s.-]\d{3}[\s.-]?\d{2,4}")
+
+# Lineas del comienzo y del final de cada pagina donde se buscan los encabezados y pies de pagina
+EDGE_LINES = 3
+# Palabras minimas del comienzo de una linea para tratarlo como un encabezado pegado al texto de la pagina
+MIN_PREFIX_WORDS = 3
+
+
+def _normalize_line(line):
+    # Los numeros de pagina y fechas cambian de una pagina a otra en los pies de pagina
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+
+def _page_number(page):
+    return page.metadata.get("page")
+
+
+def _by_page(pages):
+    """Agrupa los chunks consecutivos de una misma pagina del PDF. Funciona tambien con paginas que se van extrayendo."""
+    return (list(chunks) for _, chunks in itertools.groupby(pages, key=_page_number))
+
+
+def _edge_lines(lines, edge_lines):
+    return lines[:edge_lines] + lines[-edge_lines:]
+
+
+def _prefixes(normalized):
+    # La linea completa y sus comienzos de al menos MIN_PREFIX_WORDS palabras
+    words = normalized.split()
+    return {normalized} | {" ".join(words[:n]) for n in range(MIN_PREFIX_WORDS, len(words))}
+
+
+def repeated_lines(pages, min_fraction=0.5, min_pages=3, edge_lines=EDGE_LINES):
+    """
+    Lineas (normalizadas) que se repiten en las paginas del PDF (los chunks con el mismo metadata["page"] cuentan
+    como una sola pagina). Devuelve una tupla (lineas, encabezados):
+      - lineas: aparecen en cualquier lugar de al menos `min_fraction` de las paginas y de no menos de `min_pages`.
+      - encabezados: encabezados y pies de pagina, buscados en las primeras y ultimas `edge_lines` lineas de cada
+        pagina. Se cuentan por separado en las paginas pares e impares, porque muchos informes alternan el encabezado
+        (p.ej. el titulo del informe en una y el nombre de la empresa en la otra), e incluyen los comienzos de linea
+        repetidos, para los encabezados que la extraccion pega al texto de la pagina.
+    """
+    anywhere, edges, pages_by_parity = Counter(), {0: Counter(), 1: Counter()}, Counter()
+    page_count = 0
+    for chunks in _by_page(pages):
+        lines = [line for chunk in chunks for line in chunk.page_content.splitlines() if line.strip()]
+        page_count += 1
+        anywhere.update({_normalize_line(line) for line in lines})
+        parity = (_page_number(chunks[0]) or 0) % 2
+        pages_by_parity[parity] += 1
+        edges[parity].update(set().union(*(_prefixes(_normalize_line(line)) for line in _edge_lines(lines, edge_lines))))
+
+    def _threshold(count):
+        return max(min_pages, min_fraction * count)
+
+    repeated = {line for line, count in anywhere.items() if count >= _threshold(page_count)}
+    headers = {
+        line
+        for parity, counter in edges.items()
+        for line, count in counter.items()
+        if count >= _threshold(pages_by_parity[parity])
+    }
+    return repeated, headers
+
+
+def _strip_header(line, headers):
+    # Quita de la linea el encabezado repetido mas largo con el que empieza; None si la linea es toda encabezado
+    normalized = _normalize_line(line)
+    if normalized in headers:
+        return None
+    words = normalized.split()
+    for n in range(len(words) - 1, MIN_PREFIX_WORDS - 1, -1):
+        if " ".join(words[:n]) in headers:
+            return " ".join(line.split()[n:])
+    return line
+
+
+def strip_lines(page, repeated, edge_lines=EDGE_LINES):
+    """
+    Quita de la pagina (o chunk) las lineas repetidas de `repeated` (ver repeated_lines()); los encabezados solo se
+    buscan en sus primeras y ultimas `edge_lines` lineas. Devuelve una tupla (pagina_limpia, lineas_quitadas).
+    """
+    anywhere, headers = repeated
+    lines = page.page_content.splitlines()
+    non_blank = [i for i, line in enumerate(lines) if line.strip()]
+    edges = set(_edge_lines(non_blank, edge_lines))
+
+    kept, removed = [], 0
+    for i, line in enumerate(lines):
+        if _normalize_line(line) in anywhere:
+            removed += 1
+            continue
+        if i in edges:
+            line = _strip_header(line, headers)
+            if line is None:
+                removed += 1
+                continue
+        kept.append(line)
+    return Document(page_content="\n".join(kept), metadata=dict(page.metadata)), removed
+
+
+def strip_repeated_lines(pages, min_fraction=0.5, min_pages=3):
+    """
+    Quita de cada pagina las lineas repetidas del documento (ver repeated_lines()).
+    Devuelve una tupla (paginas_limpias, lineas_quitadas).
+    """
+    repeated = repeated_lines(pages, min_fraction, min_pages)
+
+    cleaned, removed = [], 0
+    for page in pages:
+        page, page_removed = strip_lines(page, repeated)
+        cleaned.append(page)
+        removed += page_removed
+
+    return cleaned, removed
+
+
+def _is_contact_page(lines):
+    # Paginas de contacto o de autores: muchas lineas, con mail o telefono, o con la disposicion nombre / cargo de
+    # una lista de personas (lineas cortas, buena parte de ellas cargos o titulos)
+    contact_lines = sum(1 for line in lines if EMAIL.search(line) or PHONE.search(line))
+    if contact_lines >= 3 and contact_lines / len(lines) >= 0.3:
+        return True
+
+    if len(lines) < 6 or sum(1 for line in lines if len(line.split()) <= 6) / len(lines) < 0.8:
+        return False
+    roles = sum(1 for line in lines if ROLE.search(line))
+    people = sum(1 for line in lines if ROLE.search(line) or PERSON_NAME.match(line))
+    return roles / len(lines) >= 0.25 and people / len(lines) >= 0.7
+
+
+def classify_page(text, min_chars=20):
+    """
+    Clasifica una pagina como "content" o como alguna de las etiquetas de LOW_INFORMATION_LABELS. Solo se considera
+    en blanco una pagina casi sin texto (menos de `min_chars` letras y numeros): una pagina corta puede tener
+    informacion importante, p.ej. una conclusion o una cifra destacada.
+    """
+    stripped = text.strip()
+    alnum = sum(char.isalnum() for char in stripped)
+    if alnum < min_chars:
+        return "blank"
+    # Paginas que son solo imagenes o graficos suelen extraerse como simbolos sueltos
+    if alnum / len(stripped) < 0.5:
+        return "blank"
+
+    lines = [line.strip() for line in stripped.splitlines() if line.strip()]
+    lower = stripped.lower()
+
+    toc_lines = sum(1 for line in lines if TOC_LINE.match(line))
+    if len(lines) >= 5 and (toc_lines / len(lines) >= 0.5 or ("contents" in lower[:300] and toc_lines / len(lines) >= 0.3)):
+        return "toc"
+
+    # Un disclosure tiene frases legales en buena parte de sus lineas; una pagina de contenido con un aviso corto al
+    # pie las tiene en pocas lineas
+    legal_lines = sum(1 for line in lines if any(term in line.lower() for term in DISCLOSURE_TERMS))
+    if len(lines) >= 10 and legal_lines / len(lines) >= 0.2:
+        return "disclosure"
+
+    if _is_contact_page(lines):
+        return "contact"
+
+    return "content"
+
+
+def _classify_chunks(chunks):
+    # Todos los chunks de una pagina del PDF llevan la etiqueta de la pagina completa
+    return classify_page("\n".join(chunk.page_content for chunk in chunks))
+
+
+def triage_pages(pages, strip_repeated=True):
+    """
+    Aplica strip_repeated_lines() y classify_page() a las paginas del documento (cada pagina del PDF se clasifica con
+    el texto de todos sus chunks). Devuelve una tupla (paginas_a_resumir, paginas_omitidas), donde paginas_omitidas
+    es una lista de (pagina, etiqueta). Si todas las paginas resultan de poca informacion se devuelven las paginas
+    originales, sin quitarles las lineas repetidas, para no dejar el documento sin resumen.
+    """
+    cleaned = strip_repeated_lines(pages)[0] if strip_repeated else pages
+
+    kept, skipped = [], []
+    for chunks in _by_page(cleaned):
+        label = _classify_chunks(chunks)
+        if label in LOW_INFORMATION_LABELS:
+            skipped.extend((chunk, label) for chunk in chunks)
+        else:
+            kept.extend(chunks)
+
+    if not kept:
+        return list(pages), []
+
+    return kept, skipped
+
+
+def iter_triage_pages(pages, sample, skipped, strip_repeated=True):
+    """
+    Version incremental de triage_pages() para paginas que se van extrayendo del PDF: las lineas repetidas se
+    detectan en `sample` (las primeras paginas del documento) y cada pagina de `pages` se limpia y se clasifica
+    apenas llegan todos sus chunks, sin esperar al resto del documento.
+    Entrega las paginas a resumir y agrega las omitidas a `skipped` como (pagina, etiqueta). Igual que
+    triage_pages(), si al final ninguna pagina resulta ser contenido se entregan las paginas originales y `skipped`
+    queda vacia.
+    """
+    repeated = repeated_lines(sample) if strip_repeated else None
+
+    kept_any, originals = False, []
+    for chunks in _by_page(pages):
+        cleaned = [strip_lines(chunk, repeated)[0] for chunk in chunks] if repeated else chunks
+        label = _classify_chunks(cleaned)
+        if label in LOW_INFORMATION_LABELS:
+            skipped.extend((chunk, label) for chunk in cleaned)
+            if not kept_any:
+                originals.extend(chunks)
+        else:
+            kept_any = True
+            originals.clear()
+            yield from cleaned
+
+    if not kept_any:
+        skipped.clear()
+        yield from originals
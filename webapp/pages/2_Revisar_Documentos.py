@@ -125,6 +125,21 @@ with col2:
     expander = st.expander("Resumen del documento")
     expander.write(doc_summary_df.loc[0,'document_llm_summary'])
 
+    # Resumenes por pagina guardados al cargar el documento (no se vuelve a llamar al LLM)
+    pages_summaries_df = persistence_pdf.get_pages_summaries_bq(table_id=conf.PAGES_BQ_TABLE_ID, doc_id=option)
+    if not pages_summaries_df.empty:
+        pages_expander = st.expander("Resumen por página")
+        for _, page_row in pages_summaries_df.iterrows():
+            pages_expander.markdown(F"**Página {page_row['page_numbers']}:** {page_row['page_llm_summary']}")
+
+    # Tablas numericas guardadas al cargar el documento
+    doc_tables = persistence_pdf.get_doc_tables_bq(table_id=conf.TABLES_BQ_TABLE_ID, doc_id=option)
+    if doc_tables:
+        tables_expander = st.expander(F"Tablas del documento ({len(doc_tables)})")
+        for table in doc_tables:
+            tables_expander.caption(F"Página {table['page'] + 1}, tabla {table['table'] + 1}")
+            tables_expander.dataframe(table["dataframe"], hide_index=True)
+
     # Display original PDF
     #print(source_doc)
     #print(tmp_file.name)
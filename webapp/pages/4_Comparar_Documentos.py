@@ -0,0 +1,87 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import streamlit as st
+import persistence_pdf
+import compare_summaries
+import config
+
+from PIL import Image
+from webapp.logo import add_logo
+
+
+st.set_page_config(
+    page_title="Asesor Financiero",
+    page_icon="hello",
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
+
+# Quitar el botón Deploy de Streamlit
+st.markdown("""
+    <style>
+        .reportview-container {
+            margin-top: -2em;
+        }
+        #MainMenu {visibility: hidden;}
+        .stDeployButton {display:none;}
+        footer {visibility: hidden;}
+        #stDecoration {display:none;}
+    </style>
+""", unsafe_allow_html=True)
+
+# Cargar el archivo de configuración
+conf = config.Config()
+
+image2 = Image.open(f"webapp/{conf.COMPANY_LOGO}")
+st.image(image2, width=100)
+
+# Titulo de la pagina
+st.subheader("Comparar Documentos Resumidos", divider="violet")
+add_logo()
+
+# Documentos que ya tienen su resumen guardado en BigQuery (la comparacion no vuelve a leer los PDF)
+all_docs_summaries_df = persistence_pdf.get_all_summaries_bq(table_id=conf.DOCUMENTS_BQ_TABLE_ID)
+docs_names = dict(zip(all_docs_summaries_df["document_id"], all_docs_summaries_df["document_name"]))
+
+col1, col2 = st.columns([1, 2], gap="small")
+
+with col1:
+    selected_docs = st.multiselect("Seleccione los documentos a comparar:", list(docs_names),
+                                   format_func=lambda doc_id: docs_names[doc_id] or doc_id,
+                                   max_selections=conf.COMPARE_MAX_DOCUMENTS)
+    topic = st.text_input("Tema de la comparación (opcional):", placeholder="p.ej. interest rates")
+    compare = st.button("Comparar", type="primary", disabled=len(selected_docs) < 2)
+
+with col2:
+    if compare:
+        try:
+            with st.spinner("Comparando los resúmenes de los documentos..."):
+                result = compare_summaries.compare_documents(project=conf.PROJECT_ID,
+                                                             location=conf.REGION,
+                                                             vertex_model=conf.SUMMARY_FINAL_MODEL_NAME,
+                                                             doc_ids=selected_docs,
+                                                             topic=topic,
+                                                             token_budget=conf.COMPARE_TOKEN_BUDGET)
+
+            st.subheader("Comparación de: " + ", ".join(F":blue[{name}]" for name in result["documents"]))
+            st.write(result["comparison"])
+            if result["reused"]:
+                st.caption("Comparación guardada previamente para estos documentos, no se volvió a llamar al LLM.")
+            if result["missing"]:
+                st.warning("Documentos sin resumen guardado (no incluidos): " + ", ".join(result["missing"]))
+        except Exception as e:
+            st.error(F"No se pudo comparar los documentos: {e}")
+    else:
+        st.info("Seleccione al menos dos documentos y presione Comparar.")
@@ -0,0 +1,392 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo extrae el texto de las paginas de un PDF con un backend intercambiable (PDF_EXTRACTOR_BACKEND):
+ "pypdf" es el PyPDFLoader de LangChain (Python puro, un solo core) y "pypdfium2" usa PDFium (C++) y reparte rangos
+ de paginas entre los procesos de un pool. Todos los backends devuelven los mismos Document de LangChain que
+ PyPDFLoader, una pagina por Document con metadata {"source", "page"}, asi que el resto del codigo no cambia.
+ Los PDF se pueden pasar como ruta o como pdf_source.PdfSource (un archivo subido que esta en memoria), y el texto
+ extraido se guarda en el cache de extraccion (ver extraction_cache) para no volver a parsear el mismo documento.
+ Las paginas escaneadas (sin capa de texto) pasan por OCR, ver page_ocr y OcrExtractor, y las tablas numericas se
+ sacan del texto y se devuelven aparte, ver pdf_tables y TableExtractor.
+ Para comparar la velocidad de los backends ver benchmark_pdf_extract.py.
+"""
+
+import collections
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pypdf
+import pypdfium2 as pdfium
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import config
+import extraction_cache
+import gcp_clients
+import page_ocr
+import pdf_tables
+from pdf_source import PdfSource, open_pdf, pdf_name, pdf_sha256
+
+conf = config.Config()
+
+
+class PDFExtractor:
+    """
+    Interfaz de los backends de extraccion: iter_pages() devuelve las paginas del PDF en orden, y lazy_extract() las
+    convierte en Document de LangChain. `workers` es la cantidad de procesos que puede usar el backend para un
+    documento (los backends de un solo core la ignoran).
+    """
+
+    name = None
+
+    def __init__(self, workers=None):
+        self.workers = workers or conf.PDF_EXTRACT_WORKERS
+
+    def page_count(self, pdf):
+        with open_pdf(pdf) as stream:
+            return len(pypdf.PdfReader(stream).pages)
+
+    def iter_pages(self, pdf):
+        """
+        Itera las paginas de `pdf` (una ruta o un PdfSource) como diccionarios {"page", "text", "width", "height"}:
+        numero de pagina desde 0, texto extraido y tamaño de la pagina en puntos.
+        """
+        raise NotImplementedError
+
+    def lazy_extract(self, pdf, source=None):
+        """
+        Itera los Document de las paginas de `pdf`; metadata["source"] es `source` (por defecto la ruta o el nombre
+        del archivo subido). Las paginas con tablas numericas (ver TableExtractor) llevan sus filas en
+        metadata["tables"].
+        """
+        source = pdf_name(pdf) if source is None else source
+        for page in self.iter_pages(pdf):
+            metadata = {"source": source, "page": page["page"]}
+            if page.get("tables"):
+                metadata["tables"] = page["tables"]
+            yield Document(page_content=page["text"], metadata=metadata)
+
+    def extract(self, pdf, source=None):
+        return list(self.lazy_extract(pdf, source))
+
+
+class PyPDFExtractor(PDFExtractor):
+    """pypdf, el extractor original de la app (el mismo parser que usa el PyPDFLoader de LangChain)."""
+
+    name = "pypdf"
+
+    def iter_pages(self, pdf):
+        with open_pdf(pdf) as stream:
+            for page_number, page in enumerate(pypdf.PdfReader(stream).pages):
+                yield {"page": page_number, "text": page.extract_text(),
+                       "width": float(page.mediabox.width), "height": float(page.mediabox.height)}
+
+
+def _pdfium_input(pdf):
+    # Un PdfSource grande se lee desde su archivo temporal, uno chico desde sus bytes (que se envian a los procesos)
+    if isinstance(pdf, PdfSource):
+        return pdf.data if pdf.in_memory else pdf.path
+    return pdf
+
+
+def _pool_input(pdf):
+    # Las tareas de los pools de OCR y de tablas (una cada pocas paginas) reciben la ruta del PDF: con los bytes,
+    # cada tarea enviaria el documento completo a los procesos
+    return pdf.file_path() if isinstance(pdf, PdfSource) else pdf
+
+
+# PDFium no es thread-safe: dentro de un mismo proceso (p.ej. varias sesiones de Streamlit) se usa de a un thread
+_pdfium_lock = threading.Lock()
+
+
+def _reset_pdfium_lock():
+    # Los procesos de los pools se crean con fork: si otro thread tenia el lock en ese momento, el hijo lo
+    # heredaria tomado para siempre
+    global _pdfium_lock
+    _pdfium_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pdfium_lock)
+
+
+def _page_ranges(page_count, workers, min_pages_per_worker):
+    # Rangos de paginas consecutivas (inclusive), uno por proceso
+    workers = max(1, min(workers, page_count // min_pages_per_worker))
+    size = max(1, -(-page_count // workers))
+    return [(first, min(first + size, page_count) - 1) for first in range(0, page_count, size)]
+
+
+def _pdfium_extract_range(pdf_input, first_page, last_page):
+    """Paginas first_page..last_page (inclusive), como en iter_pages(). Se ejecuta en los procesos del pool."""
+    with _pdfium_lock:
+        return _pdfium_pages(pdf_input, first_page, last_page)
+
+
+def _pdfium_pages(pdf_input, first_page, last_page):
+    pages = []
+    pdf = pdfium.PdfDocument(pdf_input)
+    try:
+        for page_number in range(first_page, last_page + 1):
+            page = pdf[page_number]
+            textpage = page.get_textpage()
+            width, height = page.get_size()
+            # PDFium separa las lineas con \r\n, pypdf con \n
+            pages.append({"page": page_number,
+                          "text": textpage.get_text_range().replace("\r\n", "\n").replace("\r", "\n"),
+                          "width": width, "height": height})
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    return pages
+
+
+class PdfiumExtractor(PDFExtractor):
+    """
+    Extractor con PDFium que divide el documento en rangos de paginas consecutivas y los extrae en paralelo en el
+    pool de procesos compartido (o en `executor`, p.ej. un pool de otro tamaño para el benchmark). Los documentos de
+    menos de 2 * `min_pages_per_worker` paginas se extraen en el mismo proceso, donde el costo de enviar el trabajo al
+    pool es mayor que lo que se gana.
+    """
+
+    name = "pypdfium2"
+
+    def __init__(self, workers=None, min_pages_per_worker=None, executor=None):
+        super().__init__(workers)
+        self.min_pages_per_worker = min_pages_per_worker or conf.PDF_EXTRACT_MIN_PAGES_PER_WORKER
+        self.executor = executor
+
+    def page_count(self, pdf):
+        with _pdfium_lock:
+            document = pdfium.PdfDocument(_pdfium_input(pdf))
+            try:
+                return len(document)
+            finally:
+                document.close()
+
+    def iter_pages(self, pdf):
+        ranges = _page_ranges(self.page_count(pdf), self.workers, self.min_pages_per_worker)
+        if len(ranges) == 1:
+            batches = iter([_pdfium_extract_range(_pdfium_input(pdf), *ranges[0])] if ranges else [])
+        else:
+            # Cada rango recibe la ruta del PDF (ver _pool_input()), no una copia de sus bytes
+            pdf_input = _pool_input(pdf)
+            executor = self.executor or get_process_pool()
+            futures = [executor.submit(_pdfium_extract_range, pdf_input, first, last) for first, last in ranges]
+            # Los rangos se entregan en orden a medida que terminan, sin esperar al resto del documento
+            batches = (future.result() for future in futures)
+
+        for pages in batches:
+            yield from pages
+
+
+class OcrExtractor(PDFExtractor):
+    """
+    Extractor que pasa por OCR (ver page_ocr) solo las paginas que `extractor` devuelve sin texto o con texto
+    ilegible. Las paginas con texto se entregan sin esperar, salvo que una pagina anterior todavia este en OCR,
+    porque las paginas siempre se entregan en orden. Si el OCR de una pagina falla se deja el texto extraido.
+    """
+
+    def __init__(self, extractor, dpi=None, language=None):
+        self.extractor = extractor
+        self.name = F"{extractor.name}+ocr"
+        self.workers = extractor.workers
+        self.dpi = dpi or conf.OCR_DPI
+        self.language = language or conf.OCR_LANGUAGE
+
+    def page_count(self, pdf):
+        return self.extractor.page_count(pdf)
+
+    def _resolve(self, page, ocr):
+        if ocr is None:
+            return page
+        try:
+            return {**page, "text": ocr.result()}
+        except Exception as e:
+            print(F"No se pudo aplicar OCR a la pagina {page['page']}: {e}")
+            return {**page, "ocr_error": str(e)}
+
+    def iter_pages(self, pdf):
+        pdf_input = None
+        pending = collections.deque()
+        for page in self.extractor.iter_pages(pdf):
+            ocr = None
+            if page_ocr.needs_ocr(page["text"]):
+                # Un PdfSource en memoria se escribe a disco solo si alguna pagina necesita OCR
+                pdf_input = pdf_input or _pool_input(pdf)
+                ocr = page_ocr.get_ocr_pool().submit(page_ocr.ocr_page, pdf_input, page["page"],
+                                                     self.dpi, self.language)
+            pending.append((page, ocr))
+            while pending and (pending[0][1] is None or pending[0][1].done()):
+                yield self._resolve(*pending.popleft())
+        while pending:
+            yield self._resolve(*pending.popleft())
+
+
+# Paginas por tarea de deteccion de tablas en el pool de tablas
+_TABLE_PAGES_PER_TASK = 2
+
+
+class TableExtractor(PDFExtractor):
+    """
+    Extractor que busca con pdfplumber las tablas numericas de cada pagina de `extractor` (ver pdf_tables), saca
+    sus lineas del texto, pone en su lugar un resumen de una linea y agrega las filas de cada tabla a la pagina
+    (page["tables"]). pdfplumber es lento, asi que las paginas se reparten en rangos cortos entre los procesos de su
+    propio pool (ver pdf_tables.get_table_pool()), que trabajan mientras `extractor` extrae el texto en el pool de
+    extraccion sin esperar detras de las tablas. Si falla la deteccion de tablas de un rango sus paginas quedan con el
+    texto extraido.
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.name = F"{extractor.name}+tables"
+        self.workers = extractor.workers
+
+    def page_count(self, pdf):
+        return self.extractor.page_count(pdf)
+
+    def _with_tables(self, page, tables):
+        if not tables:
+            return page
+        placeholders = [(rows, pdf_tables.table_placeholder(page["page"], number, pdf_tables.table_dataframe(rows)))
+                        for number, rows in enumerate(tables)]
+        return {**page, "text": pdf_tables.replace_table_text(page["text"], placeholders), "tables": tables}
+
+    def iter_pages(self, pdf):
+        ranges = {}
+        if self.workers == 1:
+            # Un solo proceso (p.ej. en los procesos del modo batch): las tablas se buscan en este mismo proceso
+            page_count = self.page_count(pdf)
+            future = Future()
+            try:
+                future.set_result(pdf_tables.find_tables_range(_pdfium_input(pdf), 0, page_count - 1)
+                                  if page_count else [])
+            except Exception as e:
+                future.set_exception(e)
+            ranges.update({number: (0, future) for number in range(page_count)})
+        else:
+            # Rangos cortos, que el pool procesa en orden: la primera pagina no espera a las tablas del resto
+            executor = pdf_tables.get_table_pool()
+            page_count = self.page_count(pdf)
+            pdf_input = _pool_input(pdf)
+            for first, last in _page_ranges(page_count, page_count, _TABLE_PAGES_PER_TASK):
+                future = executor.submit(pdf_tables.find_tables_range, pdf_input, first, last)
+                ranges.update({number: (first, future) for number in range(first, last + 1)})
+
+        for page in self.extractor.iter_pages(pdf):
+            first, future = ranges[page["page"]]
+            try:
+                tables = future.result()[page["page"] - first]
+            except Exception as e:
+                print(F"No se pudieron extraer las tablas de la pagina {page['page']}: {e}")
+                tables = []
+            yield self._with_tables(page, tables)
+
+
+class CachedExtractor(PDFExtractor):
+    """
+    Extractor que consulta primero el cache de extraccion (ver extraction_cache), indexado por el hash SHA-256 del
+    PDF y el backend. Si el documento no esta en el cache lo extrae con `extractor` y lo guarda al terminar, asi
+    que cada documento distinto se parsea una sola vez.
+    """
+
+    def __init__(self, extractor, cache):
+        self.extractor = extractor
+        self.cache = cache
+        self.name = extractor.name
+        self.workers = extractor.workers
+
+    def _key(self, pdf):
+        return extraction_cache.cache_key(pdf_sha256(pdf), self.extractor.name)
+
+    def page_count(self, pdf):
+        pages = self.cache.load(self._key(pdf))
+        return len(pages) if pages is not None else self.extractor.page_count(pdf)
+
+    def iter_pages(self, pdf):
+        key = self._key(pdf)
+        pages = self.cache.load(key)
+        if pages is not None:
+            yield from pages
+            return
+
+        pages = []
+        for page in self.extractor.iter_pages(pdf):
+            pages.append(page)
+            yield page
+        # Solo se llega aca si se extrajo el documento completo; si fallo el OCR de alguna pagina no se guarda,
+        # para volver a intentarlo la proxima vez
+        if not any("ocr_error" in page for page in pages):
+            self.cache.save(key, pages)
+
+
+EXTRACTORS = {
+    PyPDFExtractor.name: PyPDFExtractor,
+    PdfiumExtractor.name: PdfiumExtractor,
+}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Pool de procesos de extraccion del proceso de la app (se crea la primera vez que se usa)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=conf.PDF_EXTRACT_WORKERS)
+    return _pool
+
+
+def get_extractor(backend=None, use_cache=True, use_ocr=True, use_tables=True, **params):
+    """
+    Devuelve el extractor `backend` (por defecto PDF_EXTRACTOR_BACKEND), con OCR de las paginas escaneadas si
+    OCR_ENABLED y `use_ocr` son True, con las tablas numericas fuera del texto si TABLES_ENABLED y `use_tables` son
+    True, y detras del cache de extraccion si EXTRACTION_CACHE_ENABLED y `use_cache` son True.
+    """
+    backend = backend or conf.PDF_EXTRACTOR_BACKEND
+    if backend not in EXTRACTORS:
+        raise ValueError(F"Backend de extraccion de PDF desconocido: {backend} (opciones: {', '.join(EXTRACTORS)})")
+    extractor = EXTRACTORS[backend](**params)
+    if conf.OCR_ENABLED and use_ocr:
+        extractor = OcrExtractor(extractor)
+    if conf.TABLES_ENABLED and use_tables:
+        extractor = TableExtractor(extractor)
+    cache = extraction_cache.get_extraction_cache() if use_cache else None
+    return CachedExtractor(extractor, cache) if cache is not None else extractor
+
+
+def load_and_split(pdf, backend=None, **params):
+    """Igual que PyPDFLoader(path).load_and_split(), con el backend configurado (`pdf` es una ruta o un PdfSource)."""
+    return RecursiveCharacterTextSplitter().split_documents(get_extractor(backend, **params).extract(pdf))
+
+
+def load_gcs_directory(project, bucket, prefix="", backend=None):
+    """
+    Extrae las paginas de todos los PDF de gs://`bucket`/`prefix`, como GCSDirectoryLoader pero con el backend
+    configurado. metadata["source"] es la URI gs:// de cada archivo, igual que en GCSDirectoryLoader. Los archivos
+    se listan y se descargan con el cliente de Cloud Storage del proceso (ver gcp_clients).
+    """
+    extractor = get_extractor(backend)
+    documents = []
+    for blob in gcp_clients.get_storage_client().list_blobs(bucket, prefix=prefix):
+        if not blob.name.lower().endswith(".pdf"):
+            continue
+        with PdfSource(blob.download_as_bytes(), name=blob.name) as pdf:
+            documents.extend(extractor.extract(pdf, source=F"gs://{bucket}/{blob.name}"))
+    return documents
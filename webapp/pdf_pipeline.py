@@ -0,0 +1,99 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo extrae las paginas de un PDF en un thread aparte y las va entregando a traves de una cola acotada, para
+ que el resumen empiece a llamar al LLM con la primera pagina mientras las siguientes todavia se estan parseando,
+ en vez de esperar a que PyPDFLoader.load_and_split() termine con todo el documento. Las paginas se extraen con el
+ backend configurado en pdf_extract.
+"""
+
+import queue
+import threading
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import config
+import pdf_extract
+import pdf_source
+
+conf = config.Config()
+
+_DONE = object()
+
+
+class PageStream:
+    """
+    Paginas de un PDF (los mismos Document que PyPDFLoader(path).load_and_split()) extraidas en segundo plano;
+    `pdf` es una ruta o un pdf_source.PdfSource.
+    La primera iteracion consume las paginas a medida que se extraen; las siguientes devuelven las ya extraidas.
+    `total` es la cantidad de paginas del PDF y `fingerprint` el hash SHA-256 del archivo, ambos disponibles
+    antes de que termine la extraccion.
+    """
+
+    def __init__(self, pdf, max_queued_pages=None, extractor=None):
+        self.pdf = pdf
+        self.extractor = extractor or pdf_extract.get_extractor()
+        self.total = self.extractor.page_count(pdf)
+        self.fingerprint = pdf_source.pdf_sha256(pdf)
+        self.pages = []
+        self._queue = queue.Queue(maxsize=max_queued_pages or conf.PDF_PIPELINE_QUEUE_PAGES)
+        self._stopped = threading.Event()
+        self._consumed = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # Con timeout para que el thread termine si el consumidor abandona la iteracion (ver close())
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            # Igual que load_and_split(): cada pagina se divide con el splitter por defecto, pero de a una pagina
+            splitter = RecursiveCharacterTextSplitter()
+            for page in self.extractor.lazy_extract(self.pdf):
+                for doc in splitter.split_documents([page]):
+                    if not self._put(doc):
+                        return
+        except Exception as e:
+            self._put(e)
+        self._put(_DONE)
+
+    def __iter__(self):
+        if self._consumed:
+            yield from self.pages
+            return
+        self._consumed = True
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                self.pages.append(item)
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Detiene la extraccion si todavia esta en curso."""
+        self._stopped.set()
+
@@ -0,0 +1,122 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo arma las secciones de un PDF a partir de su outline (marcadores / bookmarks, p.ej. Equities,
+ Fixed Income, Macro...), para poder resumir cada seccion por separado en vez de recorrer todo el documento.
+ Si el PDF no tiene outline, el documento se divide en grupos de paginas consecutivas de tamaño fijo.
+"""
+
+import re
+
+import pypdf
+
+import config
+
+conf = config.Config()
+
+
+def _clean_title(title):
+    # Algunos PDF agregan iconos (caracteres de uso privado) y espacios de mas a los titulos de los marcadores
+    title = re.sub(r"[\ue000-\uf8ff]", "", str(title))
+    return re.sub(r"\s+", " ", title).strip()
+
+
+def _outline_entries(reader, outline, depth=0):
+    """Recorre el outline y devuelve una lista de (profundidad, titulo, pagina) en el orden del outline."""
+    entries = []
+    for item in outline:
+        if isinstance(item, list):
+            entries.extend(_outline_entries(reader, item, depth + 1))
+            continue
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            page = None
+        title = _clean_title(item.title)
+        if page is not None and page >= 0 and title:
+            entries.append((depth, title, page))
+    return entries
+
+
+def _sections_from_starts(starts, page_count):
+    """Convierte una lista ordenada de (pagina_inicial, titulo) en secciones que cubren todo el documento."""
+    sections = []
+    if starts[0][0] > 0:
+        sections.append({"title": "Inicio", "first_page": 0, "last_page": starts[0][0] - 1})
+    for i, (first_page, title) in enumerate(starts):
+        last_page = starts[i + 1][0] - 1 if i + 1 < len(starts) else page_count - 1
+        sections.append({"title": title, "first_page": first_page, "last_page": last_page})
+    return sections
+
+
+def _outline_sections(reader, page_count):
+    entries = _outline_entries(reader, reader.outline)
+
+    # Se usa el nivel mas alto del outline que divide el documento en al menos dos secciones
+    for depth in sorted({depth for depth, _, _ in entries}):
+        starts = []
+        level = [(page, title) for d, title, page in entries if d == depth and page < page_count]
+        for page, title in sorted(level, key=lambda entry: entry[0]):
+            # Si varias entradas apuntan a la misma pagina (p.ej. los enlaces de un "In this issue") se queda la
+            # ultima, y el mismo titulo en paginas consecutivas es una sola seccion
+            if starts and starts[-1][0] == page:
+                starts[-1] = (page, title)
+            elif not (starts and starts[-1][1] == title):
+                starts.append((page, title))
+        if len(starts) >= 2:
+            return _sections_from_starts(starts, page_count)
+
+    return []
+
+
+def read_sections(pdf, fallback_pages=None):
+    """
+    Devuelve las secciones del PDF (`pdf` es una ruta o un archivo/stream binario), como una lista de diccionarios
+    {"title", "first_page", "last_page"} con numeros de pagina desde 0 e inclusivos (igual que metadata["page"] de
+    los Document de PyPDFLoader). Sin outline, se usan grupos de `fallback_pages` paginas consecutivas.
+    """
+    reader = pypdf.PdfReader(pdf)
+    page_count = len(reader.pages)
+
+    try:
+        sections = _outline_sections(reader, page_count)
+    except Exception as e:
+        print(f"No se pudo leer el outline del PDF: {e}")
+        sections = []
+
+    if not sections:
+        size = fallback_pages or conf.SECTION_FALLBACK_PAGES
+        sections = [
+            {"title": f"Parte {first // size + 1}",
+             "first_page": first, "last_page": min(first + size, page_count) - 1}
+            for first in range(0, page_count, size)
+        ]
+
+    return sections
+
+
+def section_label(section):
+    """Nombre para mostrar al usuario, unico aunque dos secciones tengan el mismo titulo."""
+    first, last = section["first_page"] + 1, section["last_page"] + 1
+    pages = f"pág. {first}" if first == last else f"págs. {first}-{last}"
+    return f"{section['title']} ({pages})"
+
+
+def group_pages_by_section(pages, sections):
+    """Devuelve una lista (seccion, paginas_de_la_seccion) con los Document de `pages` que caen en cada seccion."""
+    return [
+        (section, [page for page in pages if section["first_page"] <= page.metadata["page"] <= section["last_page"]])
+        for section in sections
+    ]
@@ -0,0 +1,147 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo representa un PDF subido a la app sin copiarlo a disco cuando no hace falta: el parseo, el hash y la
+ subida a Cloud Storage trabajan directamente sobre los bytes subidos. Solo los archivos mas grandes que
+ PDF_IN_MEMORY_MAX_MB se escriben una vez a un archivo temporal, que se mapea en memoria (mmap) y se borra al cerrar
+ el PdfSource, aunque el procesamiento falle a mitad de camino. Los pools de procesos (OCR, tablas) reciben la
+ ruta de un archivo (ver file_path()) en vez de los bytes en cada tarea.
+"""
+
+import hashlib
+import io
+import mmap
+import tempfile
+import threading
+
+import config
+
+conf = config.Config()
+
+# Tamaño de los bloques con que se copia un PDF grande a su archivo temporal
+_WRITE_BLOCK_BYTES = 1024 * 1024
+
+
+class PdfSource:
+    """
+    PDF en memoria (`data` son sus bytes, o un buffer como UploadedFile.getbuffer() de Streamlit) o, si supera
+    `max_memory_bytes` (por defecto PDF_IN_MEMORY_MAX_MB), en un archivo temporal mapeado en memoria. Un buffer
+    solo se copia si el PDF queda en memoria; si va al archivo temporal se escribe directamente desde el buffer.
+    Usar con `with` (o llamar a close()) para liberar el archivo temporal.
+    """
+
+    def __init__(self, data, name="document.pdf", max_memory_bytes=None):
+        if max_memory_bytes is None:
+            max_memory_bytes = conf.PDF_IN_MEMORY_MAX_MB * 1024 * 1024
+        self.name = name
+        self.size = len(data)
+        self.data = None
+        self.path = None
+        self._tmp_file = None
+        self._mmap = None
+        self._sha256 = None
+        self._lock = threading.Lock()
+
+        if self.size <= max_memory_bytes:
+            # bytes() no copia si `data` ya es bytes
+            self.data = bytes(data)
+            return
+
+        self._write_tmp_file(data)
+        self._mmap = mmap.mmap(self._tmp_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _write_tmp_file(self, data):
+        tmp_file = tempfile.NamedTemporaryFile(suffix=".pdf")
+        try:
+            view = memoryview(data)
+            for start in range(0, self.size, _WRITE_BLOCK_BYTES):
+                tmp_file.write(view[start:start + _WRITE_BLOCK_BYTES])
+            tmp_file.flush()
+        except Exception:
+            tmp_file.close()
+            raise
+        self._tmp_file = tmp_file
+        self.path = tmp_file.name
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    def buffer(self):
+        """Vista de solo lectura del contenido, sin copiarlo (sobre los bytes o sobre el mmap)."""
+        return memoryview(self.data if self.in_memory else self._mmap)
+
+    def stream(self):
+        """
+        Archivo binario nuevo, posicionado al inicio, para los parsers y la subida a GCS (cerrarlo al terminar).
+        Cada stream tiene su propia posicion, asi que se pueden leer varios a la vez desde distintos threads.
+        """
+        if self.in_memory:
+            return io.BytesIO(self.data)
+        return mmap.mmap(self._tmp_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def file_path(self):
+        """
+        Ruta de un archivo con el contenido, para pasarle el PDF a otros procesos sin enviarles los bytes en cada
+        tarea. Un PdfSource en memoria escribe su archivo temporal la primera vez que se pide (se borra al cerrar).
+        """
+        with self._lock:
+            if self.path is None:
+                self._write_tmp_file(self.data)
+            return self.path
+
+    def sha256(self):
+        # El contenido no cambia, el hash se calcula una sola vez
+        if self._sha256 is None:
+            with self.buffer() as view:
+                self._sha256 = hashlib.sha256(view).hexdigest()
+        return self._sha256
+
+    def close(self):
+        """Libera el mmap y borra el archivo temporal, si lo hay."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._tmp_file is not None:
+            self._tmp_file.close()
+            self._tmp_file = None
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_pdf(pdf):
+    """Abre `pdf` (una ruta o un PdfSource) como archivo binario."""
+    return pdf.stream() if isinstance(pdf, PdfSource) else open(pdf, "rb")
+
+
+def pdf_name(pdf):
+    """Nombre de `pdf` para metadata["source"]: la ruta, o el nombre del archivo subido."""
+    return pdf.name if isinstance(pdf, PdfSource) else pdf
+
+
+def pdf_sha256(pdf):
+    """Hash SHA-256 del contenido de `pdf` (una ruta o un PdfSource)."""
+    if isinstance(pdf, PdfSource):
+        return pdf.sha256()
+    digest = hashlib.sha256()
+    with open(pdf, "rb") as f:
+        for block in iter(lambda: f.read(_WRITE_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
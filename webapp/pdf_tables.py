@@ -0,0 +1,275 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Este modulo saca de los prompts las tablas numericas de los PDF (asignaciones, retornos, pronosticos): se detectan
+ con pdfplumber, se guardan como DataFrames con columnas tipadas (en BigQuery, ver persistence_pdf.insert_tables_bq)
+ y en el texto de la pagina que se envia al LLM se reemplazan por un resumen compacto de una linea (columnas, filas y
+ rango de cada columna numerica). Los numeros siguen disponibles para consultarlos sin llamar al LLM.
+ Solo se consideran las tablas con una proporcion minima de celdas numericas (TABLES_MIN_NUMERIC_RATIO): las
+ grillas de los graficos y los recuadros de texto que pdfplumber tambien detecta como tablas se dejan en el texto.
+ Lo usa pdf_extract.TableExtractor, que busca las tablas en un pool de procesos propio (TABLES_MAX_WORKERS), aparte del
+ de extraccion de texto.
+"""
+
+import io
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pdfplumber
+
+import config
+
+conf = config.Config()
+
+# Numeros como los de los reportes: 1,234.5  -3.2  (3.2)  4.5%  $12  +1  12bp
+_NUMBER = re.compile(r"^\(?[-+−–]?\s*[$€£]?\s*\d[\d,]*(\.\d+)?\s*(%|bp|bps|x)?\)?$", re.IGNORECASE)
+_MISSING = {"", "-", "–", "—", "n/a", "na", "n.a.", "nm"}
+# Años y periodos de los encabezados: 2023, 2024E, FY2024, Q3 2024, 3Q24, 2023/24, 1H24
+_PERIOD = re.compile(r"^((FY|CY|Q[1-4]|H[12])\s*)?'?(19\d\d|20\d\d|2100)(\s*[-/]\s*\d{2,4})?\s*([EFPA]|YTD|Q[1-4]|H[12])?$"
+                     r"|^(FY|CY|[1-4]Q|[12]H)\s*'?\d\d[EFPA]?$", re.IGNORECASE)
+
+# Tolerancia (en puntos) de los bordes izquierdo y derecho, y distancia vertical maxima, para unir tablas apiladas
+_MERGE_TOLERANCE = 2
+_MERGE_MAX_GAP = 12
+# Largo maximo de cada nombre de columna en el resumen de una tabla
+_DIGEST_NAME_CHARS = 30
+
+
+def _cell(value):
+    return " ".join(str(value).split()) if value is not None else ""
+
+
+def parse_number(text):
+    """Valor numerico de una celda (los parentesis son negativos, se ignoran %, $ y separadores), o None."""
+    text = _cell(text)
+    if not _NUMBER.match(text):
+        return None
+    negative = (text.startswith("(") and text.endswith(")")) or text.lstrip("($€£ ")[:1] in ("-", "−", "–")
+    digits = re.sub(r"[^\d.]", "", text)
+    try:
+        value = float(digits)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def clean_rows(rows):
+    """Celdas como texto de una sola linea, sin las filas ni las columnas completamente vacias."""
+    rows = [[_cell(value) for value in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return []
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    keep = [column for column in range(width) if any(row[column] for row in rows)]
+    return [[row[column] for column in keep] for row in rows]
+
+
+def is_numeric_table(rows):
+    """
+    True si `rows` (ya limpias) parece una tabla de datos: al menos TABLES_MIN_ROWS filas y 2 columnas, la mitad de
+    las celdas con contenido, y al menos TABLES_MIN_NUMERIC_RATIO de ellas con un numero.
+    """
+    if len(rows) < conf.TABLES_MIN_ROWS or len(rows[0]) < 2:
+        return False
+    cells = [value for row in rows for value in row]
+    filled = [value for value in cells if value]
+    if len(filled) < len(cells) / 2:
+        return False
+    return sum(1 for value in filled if parse_number(value) is not None) / len(filled) >= conf.TABLES_MIN_NUMERIC_RATIO
+
+
+def is_period(text):
+    """True si la celda es un año o un periodo (p.ej. 2023, 2024E, FY24, Q3 2024), como en los encabezados."""
+    return bool(_PERIOD.match(_cell(text)))
+
+
+def _has_header(rows):
+    # La primera fila es el encabezado si sus unicos numeros son años o periodos (lo normal en las tablas
+    # financieras), o si es mayormente texto y el resto de la tabla es mas numerico que ella
+    first = [value for value in rows[0] if value]
+    numbers = [value for value in first if parse_number(value) is not None and not is_period(value)]
+    if not numbers:
+        return True
+    body = [value for row in rows[1:] for value in row if value]
+    body_ratio = sum(1 for value in body if parse_number(value) is not None) / len(body) if body else 0
+    first_ratio = len(numbers) / len(first)
+    return first_ratio < 0.5 and body_ratio > first_ratio
+
+
+def _column_names(header):
+    names = []
+    for number, name in enumerate(header, start=1):
+        name = name or F"col_{number}"
+        # Nombres repetidos (p.ej. dos columnas "2023") se numeran para que el DataFrame tenga columnas unicas
+        names.append(name if name not in names else F"{name}_{number}")
+    return names
+
+
+def table_dataframe(rows):
+    """
+    DataFrame de una tabla (filas ya limpias): la primera fila es el encabezado si no tiene mas numeros que años o
+    periodos (o si es mayormente texto, ver _has_header), y las columnas del resto de las filas en que todas las
+    celdas con contenido son numeros quedan como float (los faltantes como NaN).
+    """
+    header, body = (rows[0], rows[1:]) if _has_header(rows) else ([""] * len(rows[0]), rows)
+    df = pd.DataFrame(body, columns=_column_names(header))
+    for name in df.columns:
+        values = [value for value in df[name] if value.lower() not in _MISSING]
+        if values and all(parse_number(value) is not None for value in values):
+            df[name] = [parse_number(value) if value.lower() not in _MISSING else np.nan for value in df[name]]
+    return df
+
+
+def table_placeholder(page_number, table_number, df):
+    """Resumen de una linea de la tabla, que reemplaza a su contenido en el texto que se envia al LLM."""
+    columns = list(df.columns)
+    names = {name: str(name) if len(str(name)) <= _DIGEST_NAME_CHARS else str(name)[:_DIGEST_NAME_CHARS - 3] + "..."
+             for name in columns}
+    shown = ", ".join(names[name] for name in columns[:conf.TABLES_DIGEST_MAX_COLUMNS])
+    if len(columns) > conf.TABLES_DIGEST_MAX_COLUMNS:
+        shown += ", ..."
+    ranges = []
+    for name in columns[:conf.TABLES_DIGEST_MAX_COLUMNS]:
+        if pd.api.types.is_float_dtype(df[name]) and df[name].notna().any():
+            ranges.append(F"{names[name]} {df[name].min():g} to {df[name].max():g}")
+    digest = F"[Table {page_number + 1}.{table_number + 1}: {len(df)} rows x {len(columns)} columns ({shown})"
+    if ranges:
+        digest += "; " + "; ".join(ranges)
+    return digest + "]"
+
+
+def _tokens(text):
+    return text.split()
+
+
+def replace_table_text(text, tables):
+    """
+    Saca de `text` (el texto extraido de la pagina) las lineas que pertenecen a las tablas y pone en su lugar el
+    resumen de cada tabla. `tables` es una lista de (filas, resumen). Una linea pertenece a una tabla si todas sus
+    palabras estan en celdas de la tabla; se sacan los bloques de al menos dos lineas seguidas, para no borrar una
+    linea suelta del texto que casualmente coincida. Si no se encuentran las lineas de una tabla (p.ej. porque el
+    texto de la pagina mezcla la tabla con otra columna de texto) el texto queda como estaba.
+    """
+    lines = text.split("\n")
+    output = list(lines)
+    for rows, placeholder in tables:
+        vocabulary = {token for row in rows for value in row for token in _tokens(value)}
+        # Las lineas que ya se reemplazaron por otra tabla no se vuelven a tocar
+        matches = [output[index] == line and bool(_tokens(line)) and all(token in vocabulary for token in _tokens(line))
+                   for index, line in enumerate(lines)]
+        located = False
+        start = 0
+        while start < len(lines):
+            if not matches[start]:
+                start += 1
+                continue
+            end = start
+            while end < len(lines) and matches[end]:
+                end += 1
+            if end - start >= 2:
+                for index in range(start, end):
+                    output[index] = None
+                if not located:
+                    output[start] = placeholder
+                    located = True
+            start = end
+    return "\n".join(line for line in output if line is not None)
+
+
+def _merge_stacked(tables):
+    """
+    Une las tablas que pdfplumber detecta por separado pero son filas de una misma tabla (p.ej. tablas con solo
+    lineas horizontales, donde cada fila sale como una tabla): mismo ancho, mismos bordes y una debajo de la otra.
+    `tables` es una lista de (bbox, filas) y se devuelve igual.
+    """
+    merged = []
+    for bbox, rows in sorted(tables, key=lambda table: (table[0][1], table[0][0])):
+        if merged:
+            (x0, top, x1, bottom), previous = merged[-1]
+            if (len(rows[0]) == len(previous[0]) and abs(bbox[0] - x0) <= _MERGE_TOLERANCE
+                    and abs(bbox[2] - x1) <= _MERGE_TOLERANCE and 0 <= bbox[1] - bottom <= _MERGE_MAX_GAP):
+                merged[-1] = ((x0, top, x1, bbox[3]), previous + rows)
+                continue
+        merged.append((bbox, rows))
+    return merged
+
+
+def find_page_tables(page):
+    """Tablas numericas (filas limpias) de una pagina de pdfplumber."""
+    found = []
+    for table in page.find_tables():
+        rows = [[_cell(value) for value in row] for row in table.extract()]
+        if rows:
+            found.append((table.bbox, rows))
+    tables = []
+    for _, rows in _merge_stacked(found):
+        rows = clean_rows(rows)
+        if rows and is_numeric_table(rows):
+            tables.append(rows)
+    return tables
+
+
+def find_tables_range(pdf_input, first_page, last_page):
+    """
+    Tablas numericas de las paginas first_page..last_page (inclusive) de `pdf_input` (ruta o bytes del PDF), como
+    una lista con las tablas de cada pagina. Se ejecuta en los procesos del pool de tablas (ver get_table_pool()).
+    """
+    source = io.BytesIO(pdf_input) if isinstance(pdf_input, (bytes, bytearray)) else pdf_input
+    pages = []
+    try:
+        with pdfplumber.open(source, pages=list(range(first_page + 1, last_page + 2))) as pdf:
+            for page in pdf.pages:
+                pages.append(find_page_tables(page))
+                # pdfplumber guarda los objetos de cada pagina; se liberan al terminarla
+                page.flush_cache()
+    except Exception as e:
+        # Algunas excepciones de pdfminer no se pueden pasar al proceso principal (y rompen el pool)
+        raise RuntimeError(F"{type(e).__name__}: {e}") from None
+    return pages
+
+
+def document_tables(documents):
+    """
+    Tablas de un documento a partir de sus Document (metadata["tables"], ver pdf_extract.TableExtractor), como
+    diccionarios {"page", "table", "dataframe"}. Cada tabla aparece una sola vez aunque la pagina se haya dividido
+    en varios Document.
+    """
+    tables = {}
+    for document in documents:
+        for number, rows in enumerate(document.metadata.get("tables") or []):
+            key = (document.metadata["page"], number)
+            if key not in tables:
+                tables[key] = {"page": key[0], "table": number, "dataframe": table_dataframe(rows)}
+    return [tables[key] for key in sorted(tables)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_table_pool():
+    """
+    Pool de procesos de deteccion de tablas del proceso de la app (se crea la primera vez que se usa). Es aparte del
+    pool de extraccion de texto: las tareas de tablas de un documento no hacen esperar a sus rangos de texto.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=conf.TABLES_MAX_WORKERS)
+    return _pool
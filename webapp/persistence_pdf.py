@@ -21,9 +21,135 @@
  como funciones para descargar esos archivos desde GCS y obtener sus resumenes desde las correspondientes tablas en BigQuery
 """
 
-from google.cloud import storage, bigquery
+import collections
+import sys
+import threading
+import time
+
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from google.cloud.storage.retry import DEFAULT_RETRY
 import pandas as pd
 
+import bq_writer
+import config
+import gcp_clients
+
+conf = config.Config()
+
+class BQReadCache:
+    """
+    Cache en memoria de las lecturas de BigQuery del proceso, por tabla y, dentro de cada tabla, por documento (o
+    ALL para la tabla completa). Las entradas vencen a los `ttl_seconds`; las escrituras de este modulo invalidan
+    las entradas de los documentos que escriben (y ALL), asi que despues de cargar un documento nunca se lee una
+    version anterior. Una lectura que empezo antes de una invalidacion no se guarda, porque podria no incluir lo
+    que se acaba de escribir.
+    Las entradas vencidas se descartan, y si el cache supera `max_bytes` se descartan las usadas hace mas tiempo
+    (LRU), asi que la memoria del proceso no crece con la cantidad de documentos consultados.
+    """
+
+    ALL = "*"
+
+    def __init__(self, ttl_seconds, max_bytes):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # (tabla, clave) -> (momento en que se guardo, valor, tamaño), de la usada hace mas tiempo a la mas reciente
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        # Tamaño aproximado: los DataFrames (con el texto de las paginas) son casi todo el cache
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, list):
+            return sum(BQReadCache._size(item.get("dataframe")) for item in value) + sys.getsizeof(value)
+        return sys.getsizeof(value)
+
+    def _remove(self, entry_key):
+        self._bytes -= self._entries.pop(entry_key)[2]
+
+    def _evict(self):
+        now = time.monotonic()
+        for entry_key in [entry_key for entry_key, entry in self._entries.items()
+                          if now - entry[0] > self.ttl_seconds]:
+            self._remove(entry_key)
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def get(self, table_id, key):
+        """Valor guardado para `key` en la tabla, o None si no esta o ya vencio."""
+        with self._lock:
+            entry = self._entries.get((table_id, key))
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                self._remove((table_id, key))
+                return None
+            self._entries.move_to_end((table_id, key))
+            return entry[1]
+
+    def generation(self, table_id):
+        """Numero de invalidaciones de la tabla, a tomar antes de leer de BigQuery y pasar a put()."""
+        with self._lock:
+            return self._generations.get(table_id, 0)
+
+    def put(self, table_id, key, value, generation):
+        with self._lock:
+            if self._generations.get(table_id, 0) != generation:
+                return
+            if (table_id, key) in self._entries:
+                self._remove((table_id, key))
+            self._entries[(table_id, key)] = (time.monotonic(), value, self._size(value))
+            self._bytes += self._entries[(table_id, key)][2]
+            self._evict()
+
+    def invalidate(self, table_id, doc_ids=None):
+        """Descarta las entradas de `doc_ids` y la tabla completa, o toda la tabla si no se indican documentos."""
+        doc_ids = None if doc_ids is None else set(doc_ids) | {self.ALL}
+        with self._lock:
+            self._generations[table_id] = self._generations.get(table_id, 0) + 1
+            for entry_table, key in list(self._entries):
+                if entry_table == table_id and (doc_ids is None or key in doc_ids):
+                    self._remove((entry_table, key))
+
+
+_read_cache = BQReadCache(conf.BQ_READ_CACHE_TTL_SECONDS, conf.BQ_READ_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _cached_by_document(table_id, doc_ids, query, columns):
+    """
+    Filas de `doc_ids` (columna document_id), en el orden de `doc_ids`: las de los documentos que estan en el cache
+    salen de ahi y query(ids_faltantes) consulta en BigQuery solo las del resto, que se guardan por documento.
+    """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    frames = {doc_id: _read_cache.get(table_id, doc_id) for doc_id in doc_ids}
+    missing = [doc_id for doc_id, frame in frames.items() if frame is None]
+    if missing:
+        generation = _read_cache.generation(table_id)
+        df = query(missing)
+        groups = {doc_id: group for doc_id, group in df.groupby("document_id", sort=False)}
+        for doc_id in missing:
+            # Los documentos sin filas tambien se guardan, para no volver a consultarlos en cada interaccion
+            frames[doc_id] = groups.get(doc_id, df.iloc[0:0]).reset_index(drop=True)
+            _read_cache.put(table_id, doc_id, frames[doc_id], generation)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat([frames[doc_id] for doc_id in doc_ids], ignore_index=True)
+
+
+def _query_bq(sql, query_parameters=None):
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+    with gcp_clients.resetting("bigquery"):
+        return gcp_clients.get_bigquery_client().query(sql, job_config=job_config).to_dataframe()
+
+
+def _query_by_documents(sql, doc_ids):
+    # `sql` filtra con document_id IN UNNEST(@doc_ids)
+    return _query_bq(sql, [bigquery.ArrayQueryParameter("doc_ids", "STRING", list(doc_ids))])
+
 
 # Funcion que sube documento a Google Cloud Storage
 def upload_pdf_gcs(bucket_gcs, source_file_path, destination_gcs_name):
@@ -35,7 +161,7 @@ def upload_pdf_gcs(bucket_gcs, source_file_path, destination_gcs_name):
     # The ID of your GCS object
     destination_blob_name = destination_gcs_name
 
-    storage_client = storage.Client()
+    storage_client = gcp_clients.get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
@@ -47,22 +173,63 @@ def upload_pdf_gcs(bucket_gcs, source_file_path, destination_gcs_name):
     # generation-match precondition using its generation number.
     generation_match_precondition = 0
 
-    blob.upload_from_filename(source_file_name, if_generation_match=generation_match_precondition)
+    with gcp_clients.resetting("storage"):
+        blob.upload_from_filename(source_file_name, if_generation_match=generation_match_precondition)
 
     print(
         f"File {source_file_name} uploaded to {destination_blob_name}."
     )
 
 
+# Funcion que sube a Google Cloud Storage un documento desde un archivo abierto (p.ej. un PDF en memoria), en partes
+def upload_pdf_stream_gcs(bucket_gcs, source_stream, size, destination_gcs_name, chunk_size_mb=None, retry_seconds=None):
+    """
+    Uploads the contents of a seekable binary file object to the bucket with a resumable upload, sending
+    chunk_size_mb MB per request so memory use does not grow with the file size. Failed requests are retried for up
+    to retry_seconds, resuming from the bytes GCS already committed, and the CRC32C computed while uploading is
+    checked against the final object (on a mismatch the object is deleted and DataCorruption is raised).
+    """
+    chunk_size = (chunk_size_mb or conf.GCS_UPLOAD_CHUNK_MB) * 1024 * 1024
+    retry_seconds = conf.GCS_UPLOAD_RETRY_SECONDS if retry_seconds is None else retry_seconds
+
+    blob = gcp_clients.get_storage_client().bucket(bucket_gcs).blob(destination_gcs_name)
+    blob.chunk_size = chunk_size
+    # Same generation-match precondition as upload_pdf_gcs: never overwrite an existing object (and with it, the
+    # upload is safe to retry)
+    with gcp_clients.resetting("storage"):
+        blob.upload_from_file(source_stream, size=size, content_type="application/pdf", checksum="crc32c",
+                              if_generation_match=0, retry=DEFAULT_RETRY.with_deadline(retry_seconds))
+
+    print(
+        f"{size} bytes uploaded to {destination_gcs_name} in chunks of {chunk_size} bytes (CRC32C verified)."
+    )
+
+
+def delete_pdf_gcs(bucket_gcs, gcs_name):
+    """Deletes a blob from the bucket (nothing to do if it does not exist)."""
+    blob = gcp_clients.get_storage_client().bucket(bucket_gcs).blob(gcs_name)
+    with gcp_clients.resetting("storage"):
+        try:
+            blob.delete()
+        except NotFound:
+            return
+
+    print(f"Blob {gcs_name} deleted.")
+
+
 def list_pdf_gcs(bucket_gcs):
     """Lists all the blobs in the bucket."""
     bucket_name = bucket_gcs
     # List all the blobs in the bucket
-    storage_client = storage.Client()
-    blobs = storage_client.list_blobs(bucket_name)
+    storage_client = gcp_clients.get_storage_client()
+    with gcp_clients.resetting("storage"):
+        blobs = list(storage_client.list_blobs(bucket_name))
     documents = []
     
     for blob in blobs:
+        # En el bucket tambien pueden estar el cache de extraccion, que no son documentos
+        if not blob.name.lower().endswith(".pdf"):
+            continue
         documents.append({"name": blob.name, "url": blob.public_url.split('/')[-1]})
         print("Name: {} , URL: {}".format(blob.name, blob.public_url.split('/')[-1]))
         
@@ -77,7 +244,7 @@ def download_pdf_gcs(bucket_gcs, filename):
     # The ID of your GCS object
     source_blob_name = filename
 
-    storage_client = storage.Client()
+    storage_client = gcp_clients.get_storage_client()
 
     bucket = storage_client.bucket(bucket_name)
 
@@ -86,7 +253,8 @@ def download_pdf_gcs(bucket_gcs, filename):
     # any content from Google Cloud Storage. As we don't need additional data,
     # using `Bucket.blob` is preferred here.
     blob = bucket.blob(source_blob_name)
-    contents = blob.download_as_bytes()
+    with gcp_clients.resetting("storage"):
+        contents = blob.download_as_bytes()
     
     #print("Downloaded storage object {} from bucket {} as the following string: {}.".format(filename, bucket_name, contents))
 
@@ -95,44 +263,229 @@ def download_pdf_gcs(bucket_gcs, filename):
 
 # Funcion que inserta en BigQuery el resumen de un documento cargado
 def insert_doc_summary_bq(project, table_id, pandas_dataframe):
+    """
+    Queues the summary rows for the process BigQuery writer (streaming inserts, batched with the other sessions)
+    and returns without waiting for BigQuery; the returned Future completes when the rows are in the table.
+    """
     print("Inserting data into BigQuery")
 
-    # Create a pandas dataframe.
-    df = pandas_dataframe
-
-    # Create a BigQuery client.
-    client = bigquery.Client()
-
-    # Insert the dataframe into BigQuery.
-    df.to_gbq(
-        project_id = project,
-        destination_table = table_id,
-        if_exists='append'
+    return _write_rows_bq(table_id, pandas_dataframe, DOCUMENTS_SUMMARY_SCHEMA)
+
+
+# Esquema de la tabla de resumenes de documentos (DOCUMENTS_BQ_TABLE_ID)
+DOCUMENTS_SUMMARY_SCHEMA = [
+    bigquery.SchemaField("document_id", "STRING"),
+    bigquery.SchemaField("document_name", "STRING"),
+    bigquery.SchemaField("document_gcs_uri", "STRING"),
+    bigquery.SchemaField("document_llm_summary", "STRING"),
+]
+
+# Esquema de la tabla de resumenes por pagina (PAGES_BQ_TABLE_ID)
+PAGES_SUMMARY_SCHEMA = [
+    bigquery.SchemaField("document_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("page_number", "INTEGER"),
+    bigquery.SchemaField("page_numbers", "STRING"),
+    bigquery.SchemaField("page_hash", "STRING"),
+    bigquery.SchemaField("page_text", "STRING"),
+    bigquery.SchemaField("page_llm_summary", "STRING"),
+]
+
+# Esquema de la tabla de tablas numericas de los documentos (TABLES_BQ_TABLE_ID): una fila por celda; las celdas de
+# las columnas numericas tienen su valor en numeric_value (y value nulo), para consultarlas con SQL
+TABLES_SCHEMA = [
+    bigquery.SchemaField("document_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("page_number", "INTEGER"),
+    bigquery.SchemaField("table_number", "INTEGER"),
+    bigquery.SchemaField("row_number", "INTEGER"),
+    bigquery.SchemaField("column_number", "INTEGER"),
+    bigquery.SchemaField("column_name", "STRING"),
+    bigquery.SchemaField("value", "STRING"),
+    bigquery.SchemaField("numeric_value", "FLOAT"),
+]
+
+
+def _write_rows_bq(table_id, df, schema):
+    # Las filas como tipos de Python (sin NaN de pandas), con las columnas del esquema
+    rows = df[[field.name for field in schema]].astype(object)
+    rows = rows.where(rows.notna(), None).to_dict("records")
+    doc_ids = set(df["document_id"])
+
+    future = bq_writer.get_bigquery_writer().write(table_id, schema, rows)
+    # Se invalida al encolar y otra vez al escribir: una lectura hecha mientras las filas estaban en la cola no
+    # queda en el cache
+    _read_cache.invalidate(table_id, doc_ids)
+    future.add_done_callback(lambda _: _read_cache.invalidate(table_id, doc_ids))
+    return future
+
+
+def _load_dataframe_bq(table_id, df, schema):
+    job_config = bigquery.LoadJobConfig(
+        schema=schema,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
     )
-
-# Funcion que devuelve la lista de todos los resumenes de los documentos
+    with gcp_clients.resetting("bigquery"):
+        gcp_clients.get_bigquery_client().load_table_from_dataframe(df, table_id, job_config=job_config).result()
+
+
+def _pages_summary_rows(doc_id, pages_dataframe):
+    return pd.DataFrame({
+        "document_id": doc_id,
+        "page_number": pages_dataframe["page_number"].astype("int64"),
+        "page_numbers": pages_dataframe["page_numbers"],
+        "page_hash": pages_dataframe["page_hash"],
+        "page_text": pages_dataframe["chunks"],
+        "page_llm_summary": pages_dataframe["concise_summary"],
+    })
+
+
+# Funcion que inserta en BigQuery los resumenes por pagina de un documento, con el escritor del proceso
+def insert_pages_summaries_bq(table_id, doc_id, pages_dataframe):
+    """
+    Queues the per-page summaries (as returned by summarize_doc(return_details=True)) of one document for the
+    process BigQuery writer; the returned Future completes when the rows are in the table.
+    """
+    print("Inserting page summaries into BigQuery")
+
+    return _write_rows_bq(table_id, _pages_summary_rows(doc_id, pages_dataframe), PAGES_SUMMARY_SCHEMA)
+
+
+# Funcion que inserta en BigQuery los resumenes de varios documentos (modo batch), en un solo load job por tabla
+def insert_batch_summaries_bq(documents_table_id, pages_table_id, documents_dataframe, pages_by_doc):
+    """
+    Bulk loads the summaries of a batch of documents: `documents_dataframe` has the columns of DOCUMENTS_BQ_TABLE_ID
+    and `pages_by_doc` maps each document_id to its per-page dataframe (as returned by summarize_doc).
+    """
+    print("Inserting {} document summaries into BigQuery".format(len(documents_dataframe)))
+
+    _load_dataframe_bq(documents_table_id, documents_dataframe[[field.name for field in DOCUMENTS_SUMMARY_SCHEMA]],
+                       DOCUMENTS_SUMMARY_SCHEMA)
+    _read_cache.invalidate(documents_table_id, documents_dataframe["document_id"])
+    if pages_by_doc:
+        pages_df = pd.concat([_pages_summary_rows(doc_id, df) for doc_id, df in pages_by_doc.items()],
+                             ignore_index=True)
+        _load_dataframe_bq(pages_table_id, pages_df, PAGES_SUMMARY_SCHEMA)
+        _read_cache.invalidate(pages_table_id, pages_by_doc)
+
+
+def _table_cells_rows(doc_id, tables):
+    cells = []
+    for table in tables:
+        df = table["dataframe"]
+        for column_number, column_name in enumerate(df.columns):
+            numeric = pd.api.types.is_float_dtype(df[column_name])
+            for row_number, value in enumerate(df[column_name]):
+                cells.append({
+                    "document_id": doc_id,
+                    "page_number": table["page"],
+                    "table_number": table["table"],
+                    "row_number": row_number,
+                    "column_number": column_number,
+                    "column_name": str(column_name),
+                    "value": None if numeric else str(value),
+                    "numeric_value": float(value) if numeric and not pd.isna(value) else None,
+                })
+    return pd.DataFrame(cells, columns=[field.name for field in TABLES_SCHEMA])
+
+
+# Funcion que inserta en BigQuery las tablas numericas de uno o varios documentos, con el escritor del proceso
+def insert_tables_bq(table_id, tables_by_doc):
+    """
+    Queues the tables of each document, one row per cell, for the process BigQuery writer: `tables_by_doc` maps
+    each document_id to its tables (as returned by pdf_tables.document_tables). Returns a Future that completes
+    when the rows are in the table.
+    """
+    cells_df = pd.concat([_table_cells_rows(doc_id, tables) for doc_id, tables in tables_by_doc.items()],
+                         ignore_index=True) if tables_by_doc else pd.DataFrame(columns=[field.name for field in TABLES_SCHEMA])
+    print("Inserting {} table cells into BigQuery".format(len(cells_df)))
+    return _write_rows_bq(table_id, cells_df, TABLES_SCHEMA)
+
+
+# Funcion que devuelve las tablas numericas de un documento como DataFrames, ordenadas por pagina
+def get_doc_tables_bq(table_id, doc_id):
+    tables = _read_cache.get(table_id, doc_id)
+    if tables is None:
+        print("Getting tables from BigQuery")
+        generation = _read_cache.generation(table_id)
+        sql = F'SELECT page_number, table_number, row_number, column_number, column_name, value, numeric_value FROM `{table_id}` WHERE document_id = @doc_id'
+        try:
+            tables = _tables_from_cells(_query_bq(sql, [bigquery.ScalarQueryParameter("doc_id", "STRING", doc_id)]))
+        except NotFound:
+            # La tabla se crea con la primera escritura de tablas (ver bq_writer): hasta entonces no hay tablas
+            tables = []
+        _read_cache.put(table_id, doc_id, tables, generation)
+    # Copias, para que quien las use pueda modificarlas sin cambiar el cache
+    return [{**table, "dataframe": table["dataframe"].copy()} for table in tables]
+
+
+def _tables_from_cells(cells_df):
+    tables = []
+    for (page_number, table_number), table_df in cells_df.groupby(["page_number", "table_number"], sort=True):
+        columns = table_df[["column_number", "column_name"]].drop_duplicates().sort_values("column_number")
+        numeric = table_df.groupby("column_number")["value"].apply(lambda values: values.isna().all())
+        df = pd.DataFrame({
+            name: table_df[table_df["column_number"] == number].sort_values("row_number")[
+                "numeric_value" if numeric[number] else "value"].reset_index(drop=True)
+            for number, name in zip(columns["column_number"], columns["column_name"])
+        })
+        tables.append({"page": int(page_number), "table": int(table_number), "dataframe": df})
+    return tables
+
+
+def _pages_summaries(table_id, doc_ids):
+    # Las dos lecturas de resumenes por pagina comparten las entradas del cache de cada documento
+    sql = F'SELECT document_id, page_number, page_numbers, page_hash, page_text, page_llm_summary FROM `{table_id}` WHERE document_id IN UNNEST(@doc_ids) ORDER BY document_id, page_number'
+
+    def _query(missing_ids):
+        print("Getting page summaries of {} documents from BigQuery".format(len(missing_ids)))
+        return _query_by_documents(sql, missing_ids)
+
+    return _cached_by_document(table_id, doc_ids, _query, [field.name for field in PAGES_SUMMARY_SCHEMA])
+
+
+# Funcion que devuelve los resumenes por pagina de un documento, ordenados por pagina
+def get_pages_summaries_bq(table_id, doc_id):
+    df = _pages_summaries(table_id, [doc_id])
+
+    return df.drop(columns=["document_id"])
+
+
+# Funcion que devuelve los resumenes de un conjunto de documentos
+def get_docs_summaries_bq(table_id, doc_ids):
+    sql = F'SELECT document_id, document_name, document_gcs_uri, document_llm_summary FROM `{table_id}` WHERE document_id IN UNNEST(@doc_ids)'
+
+    def _query(missing_ids):
+        print("Getting summaries of {} documents from BigQuery".format(len(missing_ids)))
+        return _query_by_documents(sql, missing_ids)
+
+    return _cached_by_document(table_id, doc_ids, _query, [field.name for field in DOCUMENTS_SUMMARY_SCHEMA])
+
+
+# Funcion que devuelve los resumenes por pagina de un conjunto de documentos, ordenados por documento y pagina
+def get_docs_pages_summaries_bq(table_id, doc_ids):
+    df = _pages_summaries(table_id, sorted(doc_ids))
+
+    return df.drop(columns=["page_text"])
+
+
+# Funcion que devuelve el resumen de un documento
 def get_doc_summary_bq(table_id, doc_id):
-    print("Getting data from BigQuery")
-    client = bigquery.Client()
-
-    sql = F'SELECT document_id, document_name, document_gcs_uri, document_llm_summary FROM `{table_id}` WHERE document_id = "{doc_id}"' 
-    
-    df = client.query(sql).to_dataframe()
-
-    return df
-
+    return get_docs_summaries_bq(table_id, [doc_id])
 
 
 # Funcion que devuelve la lista de todos los resumenes de los documentos
 def get_all_summaries_bq(table_id):
-    print("Getting data from BigQuery")
-    client = bigquery.Client()
-
-    sql = F'SELECT document_id, document_name, document_gcs_uri, document_llm_summary FROM `{table_id}`' 
-    
-    df = client.query(sql).to_dataframe()
-
-    return df
+    df = _read_cache.get(table_id, BQReadCache.ALL)
+    if df is None:
+        print("Getting data from BigQuery")
+        generation = _read_cache.generation(table_id)
+        df = _query_bq(F'SELECT document_id, document_name, document_gcs_uri, document_llm_summary FROM `{table_id}`')
+        _read_cache.put(table_id, BQReadCache.ALL, df, generation)
+        # Indice por documento: la seleccion de un documento en la pagina de revision ya no consulta BigQuery
+        for doc_id, rows in df.groupby("document_id", sort=False):
+            _read_cache.put(table_id, doc_id, rows.reset_index(drop=True), generation)
+
+    # Una copia, para que quien la use pueda modificarla (p.ej. renombrar columnas) sin cambiar el cache
+    return df.copy()
 
 # Funcion helper para crear un bucket en GCS
 def create_bucket_gcs(bucket_gcs, bucket_region):
@@ -140,7 +493,7 @@ def create_bucket_gcs(bucket_gcs, bucket_region):
     # The ID to give your GCS bucket
     # bucket_name = "your-new-bucket-name"
 
-    storage_client = storage.Client()
+    storage_client = gcp_clients.get_storage_client()
 
     bucket = storage_client.create_bucket(bucket_gcs, location=bucket_region)
 
@@ -19,81 +19,744 @@
  y finalmente con cada resumen parcial, genera un resumen general de todo el documento.
 """
 
+import asyncio
+import itertools
+import math
+import queue
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path as p
 
 import pandas as pd
 from langchain import PromptTemplate
-from langchain.chains.summarize import load_summarize_chain
+from langchain.docstore.document import Document
 from langchain.document_loaders import PyPDFLoader
-from langchain.llms import VertexAI
 
-import vertexai
+import config
+import llm_cache
+import llm_client
+import llm_metrics
+import page_summary_store
+import page_triage
+import pdf_sections
 
+conf = config.Config()
 
+# Metodos de resumen soportados por summarize_doc(), "auto" elige la estrategia con estimate_strategies()
+CHAIN_TYPES = ("refine", "map_reduce", "auto")
 
+# Estrategias que puede elegir chain_type="auto": nombre -> (chain_type, pack)
+# "packed" es refine sobre paginas agrupadas, que se convierte en una sola llamada "stuff" si el documento cabe entero
+STRATEGIES = {
+    "refine": ("refine", False),
+    "packed": ("refine", True),
+    "map_reduce": ("map_reduce", False),
+}
 
-def summarize_doc(project, location, vertex_model, pages):
-    """
-    El método refine se trata de dividir el documento en piezas de texto llamadas chunks 
-    (al igual que otros métodos de summarización de texto de grandes documentos), 
-    pero a diferencia de otros métodos que procesan los chunks en paralelo haciendo un resumen de cada uno 
-    mediante múltiples llamadas al LLM, para al final resumir todos esos resumenes 
-    (potenialmente perdiendo algo del contexto por ese paralelismo ya que se hacen resúmenes independientes); 
-    en el método Refine, se usa un prompt para realizar el resumen del primer chunk, y luego de forma serializada, 
-    se le hacen llamadas consecutivas al LLM con otro prompt para hacer resúmenes de los nuevos chunks, 
-    incorporando el resumen que ya se hizo, "refinando" el resumen total en cada iteración hasta que se resume todo el documento, 
-    logrando así mantener algo del contexto. Este método tiene la desventaja de que como se ejecutan las llamadas de forma serial,
-    no es tan paralelizable como otros métodos, ya cada llamada con el segundo prompt depende del resumen "refinado" de la iteración anterior
-    """
+# Largo asumido del resumen de una pagina, para estimar el tamaño de los prompts de collapse/combine
+SUMMARY_CHARS_ESTIMATE = 400
 
-    vertexai.init(project=project, location=location)
+# Caracteres promedio por token, para estimar tokens sin llamar a la API de conteo de tokens
+CHARS_PER_TOKEN = 4
 
-    question_prompt_template = """
-                    Provide a summary of the following text.
-                    TEXT: {text}
-                    SUMMARY:
-                    """
 
-    question_prompt = PromptTemplate(
-        template=question_prompt_template, input_variables=["text"]
-    )
+question_prompt_template = """
+                Provide a summary of the following text.
+                TEXT: {text}
+                SUMMARY:
+                """
+
+question_prompt = PromptTemplate(template=question_prompt_template, input_variables=["text"])
 
-    refine_prompt_template = """
+refine_prompt_template = """
                 Write a concise summary of the following text delimited by triple backquotes.
                 Return your response in no more than 2 bullet points which covers the key points of the text.
                 ```{text}```
                 BULLET POINT SUMMARY:
                 """
 
-    refine_prompt = PromptTemplate(
-        template=refine_prompt_template, input_variables=["text"]
-    )
+refine_prompt = PromptTemplate(template=refine_prompt_template, input_variables=["text"])
+
+map_prompt_template = """
+                Write a concise summary of the following text delimited by triple backquotes.
+                Return your response in no more than 2 bullet points which covers the key points of the text.
+                ```{text}```
+                BULLET POINT SUMMARY:
+                """
+
+map_prompt = PromptTemplate(template=map_prompt_template, input_variables=["text"])
+
+collapse_prompt_template = """
+                The following text delimited by triple backquotes is a set of partial summaries of consecutive pages of a financial document.
+                Consolidate them into a single concise bullet point summary, keeping the key figures and the key points of the text.
+                ```{text}```
+                BULLET POINT SUMMARY:
+                """
+
+collapse_prompt = PromptTemplate(template=collapse_prompt_template, input_variables=["text"])
+
+combine_prompt_template = """
+                The following text delimited by triple backquotes is a set of partial summaries of a financial document.
+                Write a summary of the whole document which covers the key points of all the partial summaries.
+                ```{text}```
+                SUMMARY:
+                """
+
+combine_prompt = PromptTemplate(template=combine_prompt_template, input_variables=["text"])
+
+
+def estimate_tokens(text):
+    """Estimacion rapida (sin llamadas a la API) de la cantidad de tokens de un texto."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def page_numbers_label(page_numbers):
+    """Convierte una lista de numeros de pagina en una etiqueta legible, p.ej. [3, 4, 5] -> "3-5"."""
+    if not page_numbers:
+        return ""
+    if len(page_numbers) == 1:
+        return str(page_numbers[0])
+    return f"{page_numbers[0]}-{page_numbers[-1]}"
+
+
+def pack_pages(pages, token_budget):
+    """
+    Agrupa de forma greedy paginas (Documents) adyacentes en chunks que llenan el presupuesto de tokens del modelo,
+    para hacer una llamada al LLM por chunk en vez de una por pagina. Las paginas que por si solas exceden el
+    presupuesto quedan en su propio chunk.
+
+    Cada chunk conserva la procedencia en su metadata: "page" es la primera pagina del chunk y "page_numbers"
+    la lista de todas las paginas que contiene.
+    """
+    return list(iter_pack_pages(pages, token_budget))
+
+
+def iter_pack_pages(pages, token_budget):
+    """Version generadora de pack_pages(): entrega cada chunk apenas se completa, sin esperar al resto de las paginas."""
+    current_texts, current_pages, current_tokens, current_source = [], [], 0, None
+
+    def _chunk():
+        return Document(
+            page_content="\n\n".join(current_texts),
+            metadata={"source": current_source, "page": current_pages[0], "page_numbers": list(current_pages)},
+        )
+
+    for page in pages:
+        tokens = estimate_tokens(page.page_content)
+        source = page.metadata["source"]
+        if current_texts and (current_tokens + tokens > token_budget or source != current_source):
+            yield _chunk()
+            current_texts, current_pages, current_tokens = [], [], 0
+        current_texts.append(page.page_content)
+        current_source = source
+        current_tokens += tokens
+        # load_and_split() puede partir una pagina larga en varios Documents con el mismo numero de pagina
+        page_number = page.metadata["page"]
+        for number in page.metadata.get("page_numbers", [page_number]):
+            if number not in current_pages:
+                current_pages.append(number)
+    if current_texts:
+        yield _chunk()
+
+
+class PageProgress:
+    """
+    Reporta cada resumen de pagina apenas esta listo a la funcion `on_page`, junto con el avance (pagina i de N)
+    y un ETA calculado con la latencia medida de las llamadas al LLM hechas hasta el momento.
+    """
+
+    def __init__(self, on_page, total, parallelism=1):
+        self.on_page = on_page
+        self.total = total
+        self.parallelism = max(1, parallelism)
+        self.completed = 0
+        self.llm_latencies = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def report(self, page, summary, reused, latency):
+        if self.on_page is None:
+            return
+        with self._lock:
+            self.completed += 1
+            self.total = max(self.total, self.completed)
+            if not reused:
+                self.llm_latencies.append(latency)
+            remaining = self.total - self.completed
+            mean_latency = sum(self.llm_latencies) / len(self.llm_latencies) if self.llm_latencies else 0.0
+            self.on_page({
+                "completed": self.completed,
+                "total": self.total,
+                "page_number": page.metadata["page"],
+                "page_numbers": page_numbers_label(page.metadata.get("page_numbers", [page.metadata["page"]])),
+                "summary": summary,
+                "reused": reused,
+                "latency": latency,
+                "elapsed": time.time() - self.started,
+                "eta": mean_latency * remaining / min(self.parallelism, remaining or 1),
+            })
+
+
+class ModelTiers:
+    """
+    Modelos de un resumen: `fast` para los pasos por pagina (refine, map y collapse) y `final` para la consolidacion
+    final (combine, o la unica llamada "stuff"). Si una llamada al modelo rapido falla con un error transitorio, se
+    repite con el modelo final (ver llm_client.predict_with_fallback()).
+    Tambien lleva la cuenta de llamadas y segundos por modelo para el reporte de latencia (ver report()).
+    """
+
+    def __init__(self, fast, final):
+        self.fast = fast
+        self.final = final
+        self._usage = {"fast": [0, 0.0], "final": [0, 0.0]}
+        self._lock = threading.Lock()
+
+    def _record(self, tier, started):
+        with self._lock:
+            self._usage[tier][0] += 1
+            self._usage[tier][1] += time.time() - started
+
+    def predict_page(self, text):
+        """Devuelve la tupla (respuesta, nombre_del_modelo_que_respondio)."""
+        started = time.time()
+        response, llm = llm_client.predict_with_fallback(self.fast, self.final, text)
+        self._record("fast", started)
+        return response, llm.model_name
+
+    async def apredict_page(self, text):
+        started = time.time()
+        response, llm = await llm_client.apredict_with_fallback(self.fast, self.final, text)
+        self._record("fast", started)
+        return response, llm.model_name
+
+    def predict_final(self, text):
+        started = time.time()
+        response = llm_client.predict(self.final, text)
+        self._record("final", started)
+        return response
+
+    async def apredict_final(self, text):
+        started = time.time()
+        response = await llm_client.apredict(self.final, text)
+        self._record("final", started)
+        return response
+
+    def report(self):
+        """Lista con las llamadas, segundos totales y promedio de cada nivel de modelo en este resumen."""
+        with self._lock:
+            return [
+                {"tier": tier, "model": llm.model_name, "calls": calls, "seconds": seconds,
+                 "mean_seconds": seconds / calls if calls else 0.0}
+                for tier, llm, (calls, seconds) in [("fast", self.fast, self._usage["fast"]),
+                                                    ("final", self.final, self._usage["final"])]
+            ]
+
+
+class _LazyPages:
+    """
+    Paginas (o chunks) que se generan a medida que se consume `iterable`, con la misma interfaz que
+    pdf_pipeline.PageStream: la primera iteracion las va generando y las siguientes devuelven las ya generadas.
+    `total` es la cantidad estimada, para mostrar el avance.
+    """
+
+    def __init__(self, iterable, total):
+        self.total = total
+        self.pages = []
+        self._iterable = iterable
+        self._consumed = False
+
+    def __iter__(self):
+        if self._consumed:
+            yield from self.pages
+            return
+        self._consumed = True
+        for page in self._iterable:
+            self.pages.append(page)
+            yield page
+
+
+def _page_count(pages):
+    # Un PageStream conoce la cantidad de paginas del PDF antes de extraerlas (el splitter puede agregar algun chunk)
+    return len(pages) if isinstance(pages, list) else pages.total
+
+
+def _page_key(vertex_model, prompt, page, existing_answer=""):
+    """Clave del resumen de una pagina en el almacen de resumenes (ver page_summary_store)."""
+    # Si el prompt usa el resumen previo (refine "real"), el resumen de la pagina depende tambien de ese contexto
+    context = existing_answer if "existing_answer" in prompt.input_variables else ""
+    fingerprint = page_summary_store.page_fingerprint(page.page_content)
+    return page_summary_store.page_summary_key(vertex_model, prompt.template, fingerprint, context)
+
+
+def _refine_inputs(prompt, page, existing_answer):
+    inputs = {"text": page.page_content}
+    if "existing_answer" in prompt.input_variables:
+        inputs["existing_answer"] = existing_answer
+    return inputs
+
+
+async def _aiter_pages(pages):
+    """Itera `pages` sin bloquear el event loop mientras se espera a que se extraiga la siguiente pagina."""
+    if isinstance(pages, list):
+        for page in pages:
+            yield page
+        return
+    iterator = iter(pages)
+    while (page := await asyncio.to_thread(next, iterator, None)) is not None:
+        yield page
+
+
+def _refine_summaries(tiers, pages, store, progress):
+    """
+    Ejecuta el metodo refine paso a paso: la primera pagina se resume con question_prompt y las siguientes con
+    refine_prompt (recibiendo el resumen anterior como "existing_answer" si el prompt lo usa), igual que la cadena
+    refine de LangChain. Los pasos cuyo resumen ya esta en `store` no llaman al LLM.
+
+    Cada paso se guarda en `store` apenas se resume, indexado por el modelo que lo genero, la pagina y el resumen
+    anterior: si el resumen falla a mitad de camino, al reintentar el mismo documento los pasos ya hechos salen de
+    `store` y el refine continua desde la ultima pagina resumida. Un paso que resolvio el modelo de respaldo (ver
+    ModelTiers) queda guardado con ese modelo, por lo que no se sirve como si fuera del modelo rapido.
+
+    `pages` puede ser una lista o un pdf_pipeline.PageStream, en cuyo caso cada pagina se resume apenas se extrae.
+
+    Devuelve una tupla (resumenes_por_pagina, lista_de_flags_reutilizado).
+    """
+    summaries, reused = [], []
+    for i, page in enumerate(pages):
+        prompt = question_prompt if i == 0 else refine_prompt
+        existing_answer = summaries[-1] if summaries else ""
+        key = _page_key(tiers.fast.model_name, prompt, page, existing_answer)
+        started = time.time()
+        summary = store.get(key) if store else None
+        reused.append(summary is not None)
+        if summary is None:
+            summary, model = tiers.predict_page(prompt.format(**_refine_inputs(prompt, page, existing_answer)))
+            if store:
+                store.put_many({_page_key(model, prompt, page, existing_answer): summary})
+        summaries.append(summary)
+        progress.report(page, summary, reused[-1], time.time() - started)
+
+    return summaries, reused
+
+
+async def _arefine_summaries(tiers, pages, store, progress):
+    """Version asincronica de _refine_summaries()."""
+    summaries, reused = [], []
+    i = -1
+    async for page in _aiter_pages(pages):
+        i += 1
+        prompt = question_prompt if i == 0 else refine_prompt
+        existing_answer = summaries[-1] if summaries else ""
+        key = _page_key(tiers.fast.model_name, prompt, page, existing_answer)
+        started = time.time()
+        # El store es SQLite: sus lecturas y escrituras no bloquean el event loop
+        summary = await asyncio.to_thread(store.get, key) if store else None
+        reused.append(summary is not None)
+        if summary is None:
+            summary, model = await tiers.apredict_page(prompt.format(**_refine_inputs(prompt, page, existing_answer)))
+            if store:
+                await asyncio.to_thread(store.put_many, {_page_key(model, prompt, page, existing_answer): summary})
+        summaries.append(summary)
+        progress.report(page, summary, reused[-1], time.time() - started)
+
+    return summaries, reused
+
+
+def _check_reduce_fanout(reduce_fanout):
+    # Con grupos de un solo resumen el paso collapse nunca reduce la cantidad de resumenes y no terminaria
+    if reduce_fanout < 2:
+        raise ValueError(f"reduce_fanout debe ser al menos 2, se recibio: {reduce_fanout}")
+
+
+def _collapse_groups(partial_summaries, reduce_fanout):
+    """Agrupa los resumenes parciales consecutivos de a `reduce_fanout` para el paso collapse."""
+    return [
+        "\n".join(partial_summaries[i:i + reduce_fanout])
+        for i in range(0, len(partial_summaries), reduce_fanout)
+    ]
+
+
+def _combine_summaries(tiers, summaries, max_workers, reduce_fanout):
+    """
+    Consolida los resumenes parciales en el resumen del documento: se agrupan de a `reduce_fanout` resumenes
+    consecutivos y cada grupo se consolida en paralelo con el modelo rapido (paso "collapse") hasta que queda un solo
+    grupo, que se resume con el modelo final (paso "combine").
+    """
+    if not summaries:
+        return ""
+
+    partial_summaries = list(summaries)
+    if len(partial_summaries) > reduce_fanout:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(partial_summaries) > reduce_fanout:
+                groups = _collapse_groups(partial_summaries, reduce_fanout)
+                partial_summaries = [
+                    summary for summary, _ in
+                    executor.map(lambda group: tiers.predict_page(collapse_prompt.format(text=group)), groups)
+                ]
+
+    return tiers.predict_final(combine_prompt.format(text="\n".join(partial_summaries)))
+
+
+async def _acombine_summaries(tiers, summaries, max_workers, reduce_fanout):
+    """Version asincronica de _combine_summaries(), con a lo sumo `max_workers` llamadas en vuelo."""
+    if not summaries:
+        return ""
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def _collapse(group):
+        async with semaphore:
+            summary, _ = await tiers.apredict_page(collapse_prompt.format(text=group))
+            return summary
+
+    partial_summaries = list(summaries)
+    while len(partial_summaries) > reduce_fanout:
+        groups = _collapse_groups(partial_summaries, reduce_fanout)
+        partial_summaries = await asyncio.gather(*(_collapse(group) for group in groups))
+
+    return await tiers.apredict_final(combine_prompt.format(text="\n".join(partial_summaries)))
+
+
+def _map_reduce_summaries(tiers, pages, max_workers, reduce_fanout, known_summaries, progress, save=None):
+    """
+    Resume cada pagina de forma independiente y concurrente (paso "map"), y luego reduce los resumenes parciales
+    de forma jerarquica con _combine_summaries().
+    Con N paginas el numero de rondas seriales de llamadas al LLM es aprox. 1 + log_fanout(N), en vez de N.
+    Los pasos map y collapse usan el modelo rapido de `tiers` y el paso combine el modelo final.
+
+    `known_summaries` trae el resumen ya conocido de cada pagina (o None), esas paginas no se vuelven a resumir.
+    Si se pasa `save(i, resumen, modelo)`, se llama apenas termina el resumen de cada pagina nueva, con el modelo que
+    lo genero, para que un error en los pasos siguientes no pierda los resumenes ya pagados.
+    Devuelve una tupla (resumenes_por_pagina, resumen_final).
+    """
+
+    def _map(i):
+        started = time.time()
+        summary, model = tiers.predict_page(map_prompt.format(text=pages[i].page_content))
+        return summary, model, time.time() - started
+
+    page_summaries = list(known_summaries)
+    missing = [i for i, summary in enumerate(page_summaries) if summary is None]
+    for i, summary in enumerate(page_summaries):
+        if summary is not None:
+            progress.report(pages[i], summary, True, 0.0)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map: un resumen por pagina, se reporta cada pagina en el orden en que el LLM las va terminando
+        futures = {executor.submit(_map, i): i for i in missing}
+        for future in as_completed(futures):
+            i = futures[future]
+            page_summaries[i], model, latency = future.result()
+            if save:
+                save(i, page_summaries[i], model)
+            progress.report(pages[i], page_summaries[i], False, latency)
+
+    # collapse y combine: resumen final a partir de los resumenes de cada pagina
+    final_summary = _combine_summaries(tiers, page_summaries, max_workers, reduce_fanout)
+
+    return page_summaries, final_summary
+
+
+async def _amap_reduce_summaries(tiers, pages, max_workers, reduce_fanout, known_summaries, progress, save=None):
+    """Version asincronica de _map_reduce_summaries(), con a lo sumo `max_workers` llamadas en vuelo por documento."""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def _map(i):
+        started = time.time()
+        async with semaphore:
+            page_summaries[i], model = await tiers.apredict_page(map_prompt.format(text=pages[i].page_content))
+        if save:
+            # El almacen puede estar en GCS o BigQuery: no bloquear el event loop mientras se guarda
+            await asyncio.to_thread(save, i, page_summaries[i], model)
+        progress.report(pages[i], page_summaries[i], False, time.time() - started)
+
+    page_summaries = list(known_summaries)
+    missing = [i for i, summary in enumerate(page_summaries) if summary is None]
+    for i, summary in enumerate(page_summaries):
+        if summary is not None:
+            progress.report(pages[i], summary, True, 0.0)
+
+    await asyncio.gather(*(_map(i) for i in missing))
 
-    vertex_llm_text = VertexAI(model_name=vertex_model)
+    final_summary = await _acombine_summaries(tiers, page_summaries, max_workers, reduce_fanout)
 
-    refine_chain = load_summarize_chain(
-        vertex_llm_text,
-        chain_type="refine",
-        question_prompt=question_prompt,
-        refine_prompt=refine_prompt,
-        return_intermediate_steps=True,
+    return page_summaries, final_summary
+
+
+def _triage(pages, pack, token_budget):
+    """
+    Quita las lineas repetidas y omite las paginas de poca informacion (ver page_triage) y calcula cuantos tokens
+    y llamadas al LLM se ahorran con respecto a resumir el documento completo.
+    """
+    kept, skipped = page_triage.triage_pages(pages)
+    return kept, _triage_stats(pages, kept, skipped, pack, token_budget)
+
+
+def _iter_triage(pages, sample, pack, token_budget, stats):
+    """
+    Version incremental de _triage() para paginas que se van extrayendo (ver page_triage.iter_triage_pages()):
+    entrega las paginas a resumir apenas llegan y completa `stats` al terminar de recorrerlas.
+    """
+    seen, kept, skipped = [], [], []
+
+    def _record(docs):
+        for page in docs:
+            seen.append(page)
+            yield page
+
+    for page in page_triage.iter_triage_pages(_record(pages), sample, skipped):
+        kept.append(page)
+        yield page
+
+    stats.update(_triage_stats(seen, kept, skipped, pack, token_budget))
+
+
+def _triage_stats(pages, kept, skipped, pack, token_budget):
+    def _calls(docs):
+        return len(pack_pages(docs, token_budget)) if pack else len(docs)
+
+    tokens_before = sum(estimate_tokens(page.page_content) for page in pages)
+    tokens_after = sum(estimate_tokens(page.page_content) for page in kept)
+    # Una pagina del PDF partida en varios chunks se omite completa y se cuenta una vez
+    skipped_pages = list(dict.fromkeys((page.metadata["page"], label) for page, label in skipped))
+    stats = {
+        "pages_skipped": len(skipped_pages),
+        "skipped_pages": skipped_pages,
+        "tokens_saved": tokens_before - tokens_after,
+        "calls_saved": _calls(pages) - _calls(kept),
+    }
+    print("Paginas omitidas: {pages_skipped}, tokens ahorrados: {tokens_saved}, llamadas ahorradas: {calls_saved}".format(**stats))
+
+    return stats
+
+
+def _collapse_calls(n_summaries, reduce_fanout):
+    """Cantidad de llamadas y de rondas seriales del paso collapse de map_reduce para `n_summaries` resumenes."""
+    calls, rounds = 0, 0
+    while n_summaries > reduce_fanout:
+        n_summaries = math.ceil(n_summaries / reduce_fanout)
+        calls += n_summaries
+        rounds += 1
+    return calls, rounds
+
+
+def estimate_strategies(pages, vertex_model, max_workers=8, reduce_fanout=8, token_budget=6000, final_model=None):
+    """
+    Estima, sin llamar al LLM, el volumen de tokens de entrada, la cantidad de llamadas y el tiempo total de cada
+    estrategia de STRATEGIES. La latencia de cada llamada sale de las llamadas medidas en corridas anteriores
+    (ver llm_metrics) segun el modelo y el tamaño del prompt, y el tiempo total respeta la cuota de llamadas por minuto.
+    `vertex_model` es el modelo de los pasos por pagina y `final_model` el de la consolidacion final (ver ModelTiers).
+    Devuelve una lista de diccionarios {"strategy", "calls", "input_tokens", "seconds"}.
+    """
+    _check_reduce_fanout(reduce_fanout)
+    recorder = llm_metrics.get_latency_recorder()
+    latency = {"fast": recorder.stats(vertex_model), "final": recorder.stats(final_model or vertex_model)}
+
+    def _call_seconds(prompt_chars, tier="fast"):
+        if latency[tier] is None:
+            return conf.LLM_DEFAULT_CALL_SECONDS
+        return latency[tier]["base_seconds"] + latency[tier]["seconds_per_char"] * prompt_chars
+
+    def _estimate(strategy, prompt_sizes, seconds):
+        calls = len(prompt_sizes)
+        # Con la cuota por minuto, N llamadas no pueden terminar antes de N / (cuota por segundo)
+        quota_seconds = calls * 60.0 / conf.LLM_REQUESTS_PER_MINUTE
+        return {
+            "strategy": strategy,
+            "calls": calls,
+            "input_tokens": sum(size // CHARS_PER_TOKEN + 1 for size in prompt_sizes),
+            "seconds": max(seconds, quota_seconds),
+        }
+
+    def _reduce(n_summaries):
+        # collapse y combine de `n_summaries` resumenes parciales (ver _combine_summaries())
+        collapse_calls, collapse_rounds = _collapse_calls(n_summaries, reduce_fanout)
+        reduce_size = len(collapse_prompt_template) + reduce_fanout * SUMMARY_CHARS_ESTIMATE
+        seconds = collapse_rounds * _call_seconds(reduce_size) + _call_seconds(reduce_size, "final")
+        return [reduce_size] * (collapse_calls + 1), seconds
+
+    estimates = []
+
+    def _refine(prompt_sizes):
+        # Una llamada serial por pagina; con conf.SUMMARY_REFINE_CONSOLIDATE, luego collapse y combine
+        seconds = sum(_call_seconds(size) for size in prompt_sizes)
+        if not conf.SUMMARY_REFINE_CONSOLIDATE:
+            return prompt_sizes, seconds
+        reduce_sizes, reduce_seconds = _reduce(len(prompt_sizes))
+        return prompt_sizes + reduce_sizes, seconds + reduce_seconds
+
+    # refine: una llamada serial por pagina
+    refine_sizes = [len(refine_prompt_template) + len(page.page_content) for page in pages]
+    estimates.append(_estimate("refine", *_refine(refine_sizes)))
+
+    # packed: refine (o una sola llamada "stuff") sobre las paginas agrupadas
+    packed = pack_pages(pages, token_budget)
+    packed_sizes = [len(refine_prompt_template) + len(chunk.page_content) for chunk in packed]
+    if len(packed) > 1:
+        estimates.append(_estimate("packed", *_refine(packed_sizes)))
+    else:
+        estimates.append(_estimate("stuff", packed_sizes, _call_seconds(packed_sizes[0], "final") if packed else 0.0))
+
+    # map_reduce: las paginas se resumen en tandas de `max_workers` llamadas concurrentes, luego collapse y combine
+    map_sizes = [len(map_prompt_template) + len(page.page_content) for page in pages]
+    parallelism = max(1, min(max_workers, conf.LLM_MAX_CONCURRENT_REQUESTS))
+    map_seconds = math.ceil(len(pages) / parallelism) * (
+        sum(_call_seconds(size) for size in map_sizes) / max(1, len(map_sizes))
     )
+    reduce_sizes, reduce_seconds = _reduce(len(pages))
+    estimates.append(_estimate("map_reduce", map_sizes + reduce_sizes, map_seconds + reduce_seconds))
+
+    return estimates
 
 
-    # La funcion refine_chain() es la que llama al Modelo LLM y hace los resumenes (este paso puede tomar un tiempo)
-    refine_outputs = refine_chain({"input_documents": pages})
+def choose_strategy(estimates, slo_seconds, preference):
+    """
+    Elige la estrategia para chain_type="auto": entre las estrategias aceptadas en `preference` (ordenadas de mayor
+    a menor calidad) que se estima que terminan dentro de `slo_seconds`, la de mayor calidad; si ninguna cumple el
+    SLO, la mas rapida de las aceptadas. Devuelve el nombre de la estrategia en STRATEGIES.
+    """
+    # "stuff" es la forma que toma "packed" cuando el documento entra en una sola llamada
+    by_name = {("packed" if e["strategy"] == "stuff" else e["strategy"]): e for e in estimates}
+    accepted = [name for name in preference if name in by_name] or list(by_name)
+    within_slo = [name for name in accepted if by_name[name]["seconds"] <= slo_seconds]
+    if within_slo:
+        return within_slo[0]
+    return min(accepted, key=lambda name: by_name[name]["seconds"])
+
+
+def plan_summary(pages, vertex_model, max_workers=8, reduce_fanout=8, token_budget=6000, triage=False, final_model=None):
+    """
+    Estimacion previa para mostrar al usuario antes de resumir: aplica el mismo filtrado de paginas que
+    summarize_doc(triage=...) y devuelve la tupla (estrategia_que_elegiria_auto, estimaciones).
+    """
+    if triage:
+        pages, _ = page_triage.triage_pages(pages)
+    estimates = estimate_strategies(pages, vertex_model, max_workers, reduce_fanout, token_budget, final_model)
+    return choose_strategy(estimates, conf.SUMMARY_LATENCY_SLO_SECONDS, conf.SUMMARY_STRATEGY_PREFERENCE), estimates
+
+
+def _prepare(project, location, vertex_model, pages, chain_type, pack, token_budget, reuse_pages, triage,
+             max_workers, reduce_fanout, final_model):
+    """Pasos comunes a summarize_doc() y asummarize_doc() antes de llamar al LLM."""
+    if chain_type not in CHAIN_TYPES:
+        raise ValueError(f"chain_type debe ser uno de {CHAIN_TYPES}, se recibio: {chain_type}")
+    _check_reduce_fanout(reduce_fanout)
+
+    llm_client.init_vertexai(project, location)
+
+    # Las respuestas del LLM se sirven desde el cache persistente cuando el mismo prompt ya se resumio antes
+    llm_cache.init_llm_cache()
+
+    # Los clientes VertexAI se reutilizan entre documentos y sesiones
+    tiers = ModelTiers(llm_client.get_llm(vertex_model), llm_client.get_llm(final_model or vertex_model))
+
+    def _choose(sample):
+        estimates = estimate_strategies(sample, vertex_model, max_workers, reduce_fanout, token_budget, final_model)
+        strategy = choose_strategy(estimates, conf.SUMMARY_LATENCY_SLO_SECONDS, conf.SUMMARY_STRATEGY_PREFERENCE)
+        prepare_stats.update({"strategy": strategy, "estimates": estimates})
+        print(f"Estrategia elegida: {strategy}")
+        return STRATEGIES[strategy]
+
+    # Con un PageStream (ver pdf_pipeline) el resumen empieza antes de que se extraiga todo el documento: refine sin
+    # agrupar ni filtrar resume cada pagina apenas se extrae, y con pack, triage o "auto" se leen solo las primeras
+    # paginas (ver _read_ahead()) y el resto se filtra y agrupa a medida que llega. Solo map_reduce espera a todas.
+    prepare_stats = {}
+    head, rest = None, None
+    if not isinstance(pages, list):
+        if chain_type == "map_reduce":
+            pages = list(pages)
+        elif pack or triage or chain_type == "auto":
+            head, rest = _read_ahead(pages, token_budget)
+            if rest is None:
+                pages = head
+
+    if rest is not None:
+        # La estrategia se estima con las primeras paginas, extrapoladas a la cantidad de paginas del PDF
+        sample = page_triage.triage_pages(head)[0] if triage else head
+        if chain_type == "auto":
+            chain_type, pack = _choose(_extrapolate(sample, round(pages.total * len(sample) / len(head))))
+        if chain_type == "map_reduce":
+            pages, rest = head + list(rest), None
+
+    if rest is not None:
+        units = itertools.chain(head, rest)
+        if triage:
+            units = _iter_triage(units, head, pack, token_budget, prepare_stats)
+        if pack:
+            units = iter_pack_pages(units, token_budget)
+        sample_units = pack_pages(sample, token_budget) if pack else sample
+        pages = _LazyPages(units, max(1, round(pages.total * len(sample_units) / len(head))))
+    else:
+        if triage:
+            pages, triage_stats = _triage(pages, pack, token_budget)
+            prepare_stats.update(triage_stats)
+        if chain_type == "auto":
+            chain_type, pack = _choose(pages)
+        if pack:
+            pages = pack_pages(pages, token_budget)
+
+    # Almacen de resumenes por pagina: las paginas con el mismo texto que ya se resumieron antes no vuelven al LLM
+    store = page_summary_store.get_page_summary_store() if reuse_pages else None
+
+    return tiers, pages, store, chain_type, pack, prepare_stats
+
+
+def _read_ahead(pages, token_budget):
+    """
+    Lee las primeras paginas de un PageStream: al menos conf.SUMMARY_STREAM_WINDOW_PAGES paginas del PDF (el splitter
+    puede partir una pagina en varios chunks) y mas de `token_budget` tokens, para detectar encabezados y pies de pagina, elegir la estrategia y saber que el documento no cabe en una
+    sola llamada "stuff" sin esperar al resto del documento.
+    Devuelve una tupla (primeras_paginas, iterador_del_resto), o (todas_las_paginas, None) si el documento termino antes.
+    """
+    iterator = iter(pages)
+    head, tokens, page_numbers = [], 0, set()
+    for page in iterator:
+        head.append(page)
+        tokens += estimate_tokens(page.page_content)
+        page_numbers.add(page.metadata["page"])
+        if len(page_numbers) >= conf.SUMMARY_STREAM_WINDOW_PAGES and tokens > token_budget:
+            return head, iterator
+    return head, None
+
+
+def _extrapolate(sample, total):
+    """Repite las paginas de `sample` hasta `total` paginas, para estimar un documento del que solo se leyo el comienzo."""
+    return [sample[i % len(sample)] for i in range(max(total, len(sample)))]
+
+
+def _known_map_summaries(store, vertex_model, pages):
+    keys = [_page_key(vertex_model, map_prompt, page) for page in pages]
+    known = store.get_many(keys) if store else {}
+    return [known.get(key) for key in keys]
+
+
+def _page_saver(store, pages):
+    """
+    Devuelve save(i, resumen, modelo) para guardar cada resumen de pagina del paso map apenas se calcula, con el
+    modelo que lo genero, o None sin almacen.
+    """
+    if not store:
+        return None
+    return lambda i, summary, model: store.put_many({_page_key(model, map_prompt, pages[i]): summary})
 
 
+def _build_result(pages, page_summaries, final_summary, reused, prepare_stats, return_details):
+    """Arma el dataframe por pagina y el resumen del documento, comun a summarize_doc() y asummarize_doc()."""
+    stats = {"pages_reused": sum(reused), "pages_recomputed": len(reused) - sum(reused), **prepare_stats}
+    print("Paginas reutilizadas: {pages_reused}, paginas resumidas con el LLM: {pages_recomputed}".format(**stats))
+
     # Se crea un arreglo de los resumenes que se ha realizado para cada pagina del documento y se agregan a un diccionanio llamado final_refine_data[]. Luego se crea un Dataframe en Pandas a partir de este diccionario para visualizar el resumen de cada chunk (pagina del doc)
     final_refine_data = []
-    for doc, out in zip(
-        refine_outputs["input_documents"], refine_outputs["intermediate_steps"]
-    ):
+    for doc, out in zip(pages, page_summaries):
         output = {}
         output["file_name"] = p(doc.metadata["source"]).stem
         output["file_type"] = p(doc.metadata["source"]).suffix
         output["page_number"] = doc.metadata["page"]
+        output["page_numbers"] = page_numbers_label(doc.metadata.get("page_numbers", [doc.metadata["page"]]))
+        output["page_hash"] = page_summary_store.page_fingerprint(doc.page_content)
         output["chunks"] = doc.page_content
         output["concise_summary"] = out
         final_refine_data.append(output)
@@ -106,11 +769,249 @@ def summarize_doc(project, location, vertex_model, pages):
 
     summarized_text = ""
 
-    for ind in pdf_refine_summary["concise_summary"]:
-        summarized_text += ind
-        
+    # El resumen del documento es la consolidacion final (map_reduce, stuff o refine con
+    # conf.SUMMARY_REFINE_CONSOLIDATE); si no la hay, la concatenacion de los resumenes de refine
+    if final_summary is not None:
+        summarized_text = final_summary
+    else:
+        for ind in pdf_refine_summary["concise_summary"]:
+            summarized_text += ind
+
     # print(summarized_text)
 
     print("Total Character lenght of document summary: {}".format(len(summarized_text)))
 
+    if return_details:
+        return summarized_text, pdf_refine_summary, stats
+
     return summarized_text
+
+
+def summarize_doc(project, location, vertex_model, pages, chain_type="refine", max_workers=8, reduce_fanout=8,
+                  pack=False, token_budget=6000, reuse_pages=True, triage=False, return_details=False, on_page=None,
+                  final_model=None):
+    """
+    El método refine se trata de dividir el documento en piezas de texto llamadas chunks 
+    (al igual que otros métodos de summarización de texto de grandes documentos), 
+    pero a diferencia de otros métodos que procesan los chunks en paralelo haciendo un resumen de cada uno 
+    mediante múltiples llamadas al LLM, para al final resumir todos esos resumenes 
+    (potenialmente perdiendo algo del contexto por ese paralelismo ya que se hacen resúmenes independientes); 
+    en el método Refine, se usa un prompt para realizar el resumen del primer chunk, y luego de forma serializada, 
+    se le hacen llamadas consecutivas al LLM con otro prompt para hacer resúmenes de los nuevos chunks, 
+    incorporando el resumen que ya se hizo, "refinando" el resumen total en cada iteración hasta que se resume todo el documento, 
+    logrando así mantener algo del contexto. Este método tiene la desventaja de que como se ejecutan las llamadas de forma serial,
+    no es tan paralelizable como otros métodos, ya cada llamada con el segundo prompt depende del resumen "refinado" de la iteración anterior.
+    El resumen del documento es la concatenación de los resúmenes de las páginas; con conf.SUMMARY_REFINE_CONSOLIDATE
+    se consolidan en cambio con los mismos pasos collapse y combine que map_reduce (más llamadas, la última con el
+    modelo final).
+
+    Con chain_type="map_reduce" se usa en cambio el método map-reduce (con collapse): cada página se resume de forma
+    concurrente con a lo sumo `max_workers` llamadas simultáneas al LLM, y los resúmenes parciales se consolidan
+    jerárquicamente de a `reduce_fanout`. Se generan las mismas filas "concise_summary" por página que con refine,
+    y se devuelve el resumen consolidado del documento.
+
+    Con pack=True las páginas adyacentes se agrupan antes (ver pack_pages()) en chunks de hasta `token_budget` tokens,
+    de modo que cada llamada al LLM aprovecha la ventana de contexto del modelo. Si el documento completo cabe en un solo
+    chunk, se hace una única llamada "stuff" con el texto completo. La columna "page_numbers" del resultado indica
+    qué páginas cubre cada fila.
+
+    Con reuse_pages=True se calcula una huella del texto de cada página y se reutilizan los resúmenes de páginas
+    idénticas ya resumidas antes (p.ej. en una versión anterior del mismo informe), por lo que solo las páginas que
+    cambiaron pasan por el LLM. El resumen final se arma con los resúmenes reutilizados y los nuevos.
+
+    Con triage=True, antes de llamar al LLM se quitan los encabezados/pies de página repetidos y se omiten las
+    páginas de poca información (índices, disclosures, contactos, páginas en blanco o solo imágenes), ver page_triage.
+
+    Con chain_type="auto" antes de llamar al LLM se estima el costo y la duración de cada estrategia (refine,
+    map_reduce y páginas agrupadas/stuff, ver estimate_strategies()) y se elige una con choose_strategy() según
+    conf.SUMMARY_LATENCY_SLO_SECONDS y conf.SUMMARY_STRATEGY_PREFERENCE; en ese caso se ignora `pack`.
+
+    Con return_details=True se devuelve la tupla (resumen, dataframe_por_pagina, estadisticas), donde las
+    estadisticas indican cuantas paginas se reutilizaron ("pages_reused") y cuantas se resumieron ("pages_recomputed"),
+    y con triage=True cuantas se omitieron ("pages_skipped") y cuantos tokens y llamadas se ahorraron
+    ("tokens_saved", "calls_saved"), y con chain_type="auto" la estrategia elegida ("strategy") y las estimaciones
+    ("estimates").
+
+    Si se pasa `on_page`, se la llama con un diccionario por cada página apenas su resumen está listo (ver PageProgress),
+    lo que permite mostrar el avance sin esperar a que termine todo el documento (ver iter_summarize_doc()).
+
+    Con `final_model` los pasos por página (refine, map, collapse) usan `vertex_model`, un modelo rápido y barato, y solo
+    la consolidación final (combine, o la llamada "stuff") usa `final_model`, que es además el respaldo si una llamada
+    al modelo rápido falla por un error transitorio (ver ModelTiers). Con return_details=True las estadisticas incluyen en "models" las
+    llamadas y la latencia de cada modelo, para compararlos.
+
+    `pages` puede ser tambien un pdf_pipeline.PageStream: con chain_type="refine" cada página se resume apenas se
+    extrae del PDF. Con pack, triage o chain_type="auto" primero se leen las primeras páginas (ver _read_ahead()):
+    con ellas se detectan los encabezados y pies de página repetidos y se estima la estrategia de "auto", y el resto
+    del documento se filtra y agrupa a medida que se extrae. Solo chain_type="map_reduce" (elegido o por "auto")
+    espera a que se extraigan todas las páginas.
+    """
+
+    tiers, pages, store, chain_type, pack, prepare_stats = _prepare(
+        project, location, vertex_model, pages, chain_type, pack, token_budget, reuse_pages, triage,
+        max_workers, reduce_fanout, final_model
+    )
+
+    progress = PageProgress(on_page, _page_count(pages), max_workers if chain_type == "map_reduce" else 1)
+
+    if pack and isinstance(pages, list) and len(pages) == 1:
+        # "stuff": todo el documento cabe en una sola llamada al LLM
+        started = time.time()
+        key = _page_key(tiers.final.model_name, question_prompt, pages[0])
+        final_summary = store.get(key) if store else None
+        reused = [final_summary is not None]
+        if final_summary is None:
+            final_summary = tiers.predict_final(question_prompt.format(text=pages[0].page_content))
+            if store:
+                store.put_many({key: final_summary})
+        page_summaries = [final_summary]
+        progress.report(pages[0], final_summary, reused[0], time.time() - started)
+    elif chain_type == "map_reduce":
+        known_summaries = _known_map_summaries(store, tiers.fast.model_name, pages)
+        page_summaries, final_summary = _map_reduce_summaries(
+            tiers, pages, max_workers, reduce_fanout, known_summaries, progress, _page_saver(store, pages)
+        )
+        reused = [summary is not None for summary in known_summaries]
+    else:
+        # Este paso llama al Modelo LLM de forma serial y hace los resumenes (este paso puede tomar un tiempo)
+        page_summaries, reused = _refine_summaries(tiers, pages, store, progress)
+        final_summary = None
+        if conf.SUMMARY_REFINE_CONSOLIDATE:
+            # Consolidacion opcional con el modelo final, igual que en map_reduce
+            final_summary = _combine_summaries(tiers, page_summaries, max_workers, reduce_fanout)
+
+    prepare_stats["models"] = tiers.report()
+    return _build_result(list(pages), page_summaries, final_summary, reused, prepare_stats, return_details)
+
+
+async def asummarize_doc(project, location, vertex_model, pages, chain_type="refine", max_workers=8, reduce_fanout=8,
+                         pack=False, token_budget=6000, reuse_pages=True, triage=False, return_details=False, on_page=None,
+                         final_model=None):
+    """
+    Version asincronica de summarize_doc(), con los mismos parametros y el mismo resultado. Reutiliza un unico cliente
+    VertexAI y todas sus llamadas al LLM pasan por el limitador de cuota compartido del proceso (ver llm_client), por
+    lo que muchas subidas concurrentes de distintas sesiones se reparten la cuota por minuto del modelo en orden de
+    llegada en vez de recibir errores 429.
+    """
+
+    tiers, pages, store, chain_type, pack, prepare_stats = _prepare(
+        project, location, vertex_model, pages, chain_type, pack, token_budget, reuse_pages, triage,
+        max_workers, reduce_fanout, final_model
+    )
+
+    progress = PageProgress(on_page, _page_count(pages), max_workers if chain_type == "map_reduce" else 1)
+
+    if pack and isinstance(pages, list) and len(pages) == 1:
+        started = time.time()
+        key = _page_key(tiers.final.model_name, question_prompt, pages[0])
+        final_summary = store.get(key) if store else None
+        reused = [final_summary is not None]
+        if final_summary is None:
+            final_summary = await tiers.apredict_final(question_prompt.format(text=pages[0].page_content))
+            if store:
+                store.put_many({key: final_summary})
+        page_summaries = [final_summary]
+        progress.report(pages[0], final_summary, reused[0], time.time() - started)
+    elif chain_type == "map_reduce":
+        known_summaries = _known_map_summaries(store, tiers.fast.model_name, pages)
+        page_summaries, final_summary = await _amap_reduce_summaries(
+            tiers, pages, max_workers, reduce_fanout, known_summaries, progress, _page_saver(store, pages)
+        )
+        reused = [summary is not None for summary in known_summaries]
+    else:
+        page_summaries, reused = await _arefine_summaries(tiers, pages, store, progress)
+        final_summary = None
+        if conf.SUMMARY_REFINE_CONSOLIDATE:
+            final_summary = await _acombine_summaries(tiers, page_summaries, max_workers, reduce_fanout)
+
+    prepare_stats["models"] = tiers.report()
+    return _build_result(list(pages), page_summaries, final_summary, reused, prepare_stats, return_details)
+
+
+def _section_key(vertex_model, section_pages, token_budget):
+    """Clave del resumen de una seccion en el almacen de resumenes: modelo, prompts y texto de la seccion."""
+    fingerprint = page_summary_store.page_fingerprint("\n".join(page.page_content for page in section_pages))
+    prompts = "\x00".join([question_prompt.template, map_prompt.template, combine_prompt.template])
+    return page_summary_store.page_summary_key(vertex_model, prompts, fingerprint, f"section:{token_budget}")
+
+
+async def asummarize_sections(project, location, vertex_model, pages, sections, max_workers=8, reduce_fanout=8,
+                              token_budget=6000, reuse_sections=True, on_section=None, final_model=None):
+    """
+    Resume por separado y en paralelo cada una de las `sections` del documento (ver pdf_sections.read_sections()),
+    con las paginas de `pages` que caen en cada una. Si la seccion cabe en `token_budget` tokens se resume con una
+    sola llamada al LLM; si no, se agrupan sus paginas (ver pack_pages()) y se resume con map-reduce.
+    Con reuse_sections=True el resumen de cada seccion se guarda en el almacen de resumenes (ver page_summary_store)
+    y una seccion con el mismo texto no vuelve al LLM, aunque el resto del documento haya cambiado.
+
+    Devuelve un dataframe con una fila por seccion: title, first_page, last_page, section_summary, reused.
+    Si se pasa `on_section`, se la llama con cada fila (como diccionario) apenas esa seccion esta resumida.
+    `final_model` funciona igual que en summarize_doc().
+    """
+    _check_reduce_fanout(reduce_fanout)
+    llm_client.init_vertexai(project, location)
+    llm_cache.init_llm_cache()
+    tiers = ModelTiers(llm_client.get_llm(vertex_model), llm_client.get_llm(final_model or vertex_model))
+    store = page_summary_store.get_page_summary_store() if reuse_sections else None
+
+    async def _summarize_section(section, section_pages):
+        key = _section_key(tiers.fast.model_name + "\x00" + tiers.final.model_name, section_pages, token_budget)
+        summary = store.get(key) if store else None
+        reused = summary is not None
+        if summary is None and not section_pages:
+            summary = ""
+        elif summary is None:
+            chunks = pack_pages(section_pages, token_budget)
+            if len(chunks) == 1:
+                summary = await tiers.apredict_final(question_prompt.format(text=chunks[0].page_content))
+            else:
+                _, summary = await _amap_reduce_summaries(tiers, chunks, max_workers, reduce_fanout,
+                                                          [None] * len(chunks), PageProgress(None, len(chunks)))
+            if store:
+                store.put_many({key: summary})
+
+        row = {**section, "section_summary": summary, "reused": reused}
+        if on_section is not None:
+            on_section(row)
+        return row
+
+    rows = await asyncio.gather(*(
+        _summarize_section(section, section_pages)
+        for section, section_pages in pdf_sections.group_pages_by_section(pages, sections)
+    ))
+    return pd.DataFrame(rows, columns=["title", "first_page", "last_page", "section_summary", "reused"])
+
+
+def summarize_sections(**summarize_kwargs):
+    """Version sincronica de asummarize_sections(), con los mismos parametros."""
+    return asyncio.run(asummarize_sections(**summarize_kwargs))
+
+
+def iter_summarize_doc(**summarize_kwargs):
+    """
+    Version generadora de summarize_doc(): ejecuta el resumen en un thread aparte y va entregando un evento
+    {"type": "page", ...} por cada pagina apenas su resumen esta listo (ver PageProgress), y al final un evento
+    {"type": "done", "summary": ..., "pages": dataframe_por_pagina, "stats": ...} con el mismo resultado que
+    summarize_doc(..., return_details=True). Si el resumen falla, la excepcion se relanza en quien consume el generador.
+    """
+    events = queue.Queue()
+
+    def _worker():
+        try:
+            summary, pages_df, stats = summarize_doc(
+                **summarize_kwargs, return_details=True,
+                on_page=lambda event: events.put({"type": "page", **event}),
+            )
+            events.put({"type": "done", "summary": summary, "pages": pages_df, "stats": stats})
+        except Exception as e:
+            events.put({"type": "error", "error": e})
+
+    threading.Thread(target=_worker, daemon=True).start()
+
+    while True:
+        event = events.get()
+        if event["type"] == "error":
+            raise event["error"]
+        yield event
+        if event["type"] == "done":
+            return
@@ -0,0 +1,26 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ Los modulos de la app se importan desde la carpeta webapp (igual que al correr streamlit), asi que los tests la
+ agregan al path. Correr con `python -m pytest tests` desde la carpeta webapp.
+"""
+
+import sys
+from pathlib import Path
+
+WEBAPP_DIR = Path(__file__).resolve().parents[1]
+DATA_DIR = WEBAPP_DIR.parent / "data"
+
+sys.path.insert(0, str(WEBAPP_DIR))
@@ -0,0 +1,112 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests de BigQueryWriter con un cliente de BigQuery falso."""
+
+import threading
+
+import pytest
+from google.cloud import bigquery
+
+import bq_writer
+import gcp_clients
+
+SCHEMA = [bigquery.SchemaField("id", "STRING")]
+
+
+class FakeClient:
+    def __init__(self, fail_rows=0):
+        self.created = []
+        self.inserts = []
+        self.fail_rows = fail_rows
+        self.lock = threading.Lock()
+
+    def create_table(self, table, exists_ok=False):
+        self.created.append(table.table_id)
+
+    def insert_rows(self, table_id, rows, selected_fields=None, row_ids=None):
+        with self.lock:
+            self.inserts.append((table_id, list(rows)))
+        # Las primeras `fail_rows` filas de cada envio fallan
+        return [{"index": index, "errors": ["backendError"]} for index in range(min(self.fail_rows, len(rows)))]
+
+    def rows(self, table_id):
+        return [row for table, rows in self.inserts if table == table_id for row in rows]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(gcp_clients, "get_bigquery_client", lambda: fake)
+    return fake
+
+
+def test_flush_sends_pending_rows_before_the_deadline(client):
+    writer = bq_writer.BigQueryWriter(batch_rows=100, flush_seconds=3600, max_retries=0)
+    future = writer.write("p.d.summaries", SCHEMA, [{"id": "a"}, {"id": "b"}])
+
+    writer.flush(timeout=5)
+
+    assert future.done() and future.exception() is None
+    assert client.rows("p.d.summaries") == [{"id": "a"}, {"id": "b"}]
+    assert client.created == ["p.d.summaries"]
+    writer.close(timeout=5)
+
+
+def test_batches_are_sent_per_table(client):
+    writer = bq_writer.BigQueryWriter(batch_rows=2, flush_seconds=3600, max_retries=0)
+    writer.write("p.d.a", SCHEMA, [{"id": "1"}, {"id": "2"}, {"id": "3"}])
+    writer.write("p.d.b", SCHEMA, [{"id": "4"}])
+
+    writer.close(timeout=5)
+
+    assert client.rows("p.d.a") == [{"id": "1"}, {"id": "2"}, {"id": "3"}]
+    assert client.rows("p.d.b") == [{"id": "4"}]
+    # Una tabla se crea una sola vez aunque reciba varios envios
+    assert sorted(client.created) == ["p.d.a", "p.d.b"]
+
+
+def test_close_sends_pending_rows_and_rejects_new_writes(client):
+    writer = bq_writer.BigQueryWriter(batch_rows=100, flush_seconds=3600, max_retries=0)
+    future = writer.write("p.d.summaries", SCHEMA, [{"id": "a"}])
+
+    writer.close(timeout=5)
+    writer.close(timeout=5)
+
+    assert future.result(timeout=0) is None
+    assert client.rows("p.d.summaries") == [{"id": "a"}]
+    with pytest.raises(RuntimeError):
+        writer.write("p.d.summaries", SCHEMA, [{"id": "b"}])
+    with pytest.raises(RuntimeError):
+        writer.flush(timeout=5)
+
+
+def test_failed_rows_fail_the_future(client):
+    client.fail_rows = 1
+    writer = bq_writer.BigQueryWriter(batch_rows=100, flush_seconds=3600, max_retries=0)
+    future = writer.write("p.d.summaries", SCHEMA, [{"id": "a"}, {"id": "b"}])
+
+    writer.flush(timeout=5)
+
+    with pytest.raises(RuntimeError, match="backendError"):
+        future.result(timeout=0)
+    writer.close(timeout=5)
+
+
+def test_empty_write_does_not_start_the_thread(client):
+    writer = bq_writer.BigQueryWriter()
+
+    assert writer.write("p.d.summaries", SCHEMA, []).result(timeout=0) is None
+    assert writer._thread is None
+    writer.close()
@@ -0,0 +1,129 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests del circuit breaker de las llamadas al LLM, en especial de la llamada de prueba (half-open)."""
+
+import asyncio
+import types
+
+import pytest
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+
+import llm_client
+from llm_client import CircuitBreaker, CircuitOpenError
+
+
+def _open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_threshold_and_rejects_until_reset():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=3600)
+    assert breaker.check() is False
+    breaker.record_failure()
+    assert breaker.check() is False
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_only_one_probe_at_a_time():
+    breaker = _open_breaker()
+    assert breaker.check() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_released_probe_lets_the_next_call_probe_again():
+    breaker = _open_breaker()
+    assert breaker.check() is True
+    breaker.release_probe()
+    assert breaker.check() is True
+
+
+def test_probe_success_closes_and_failure_reopens():
+    breaker = _open_breaker()
+    breaker.check()
+    breaker.record_success()
+    assert breaker.check() is False
+
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=0)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    breaker.reset_seconds = 3600
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    # Sin cache, sin metricas y sin esperas: solo el circuito y los reintentos de predict()/apredict()
+    model = types.SimpleNamespace(model_name="test-model")
+    breaker = _open_breaker()
+    monkeypatch.setattr(llm_client, "get_circuit_breaker", lambda model_name: breaker)
+    monkeypatch.setattr(llm_client, "_cache_lookup", lambda llm, text: None)
+    monkeypatch.setattr(llm_client, "_cache_update", lambda llm, text, response: None)
+    monkeypatch.setattr(llm_client, "_count", lambda llm, event: None)
+    monkeypatch.setattr(llm_client, "_backoff", lambda attempt: 0)
+    monkeypatch.setattr(llm_client.conf, "LLM_MAX_RETRIES", 0)
+    model.breaker = breaker
+    return model
+
+
+def _raise(error):
+    def call(*args, **kwargs):
+        raise error
+    return call
+
+
+def _araise(error):
+    async def call(*args, **kwargs):
+        raise error
+    return call
+
+
+@pytest.mark.parametrize("error", [ResourceExhausted("quota"), ValueError("bad request")])
+def test_predict_releases_the_probe_on_non_transient_errors(llm, monkeypatch, error):
+    monkeypatch.setattr(llm_client, "_hedged_call", _raise(error))
+
+    with pytest.raises(type(error)):
+        llm_client.predict(llm, "hola")
+
+    # El circuito sigue medio abierto: la proxima llamada puede volver a probar
+    assert llm.breaker.check() is True
+
+
+@pytest.mark.parametrize("error", [ResourceExhausted("quota"), ValueError("bad request")])
+def test_apredict_releases_the_probe_on_non_transient_errors(llm, monkeypatch, error):
+    monkeypatch.setattr(llm_client, "_ahedged_call", _araise(error))
+
+    with pytest.raises(type(error)):
+        asyncio.run(llm_client.apredict(llm, "hola"))
+
+    assert llm.breaker.check() is True
+
+
+def test_predict_probe_failure_reopens_the_circuit(llm, monkeypatch):
+    monkeypatch.setattr(llm_client, "_hedged_call", _raise(ServiceUnavailable("down")))
+
+    with pytest.raises(ServiceUnavailable):
+        llm_client.predict(llm, "hola")
+
+    llm.breaker.reset_seconds = 3600
+    with pytest.raises(CircuitOpenError):
+        llm.breaker.check()
@@ -0,0 +1,96 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests de page_triage sobre los informes de ejemplo de la carpeta data/."""
+
+import functools
+
+import pytest
+from langchain.docstore.document import Document
+
+import page_triage
+import pdf_extract
+from conftest import DATA_DIR
+
+
+@functools.lru_cache(maxsize=None)
+def _sample_chunks(name):
+    # Los mismos chunks que recibe el triage en la app (load_and_split parte las paginas largas), sin cache ni OCR
+    return tuple(pdf_extract.load_and_split(str(DATA_DIR / name), backend="pypdfium2", use_cache=False,
+                                            use_ocr=False, use_tables=False, workers=1))
+
+
+def _skipped_pages(skipped):
+    return dict((page.metadata["page"], label) for page, label in skipped)
+
+
+def _doc(text, page):
+    return Document(page_content=text, metadata={"source": "test.pdf", "page": page})
+
+
+def test_merrill_header_is_stripped_and_disclosures_skipped():
+    chunks = list(_sample_chunks("merrill_October_2023.pdf"))
+    # La pagina larga queda en varios chunks: el encabezado solo esta en el primero de cada pagina
+    assert len(chunks) > len({chunk.metadata["page"] for chunk in chunks})
+
+    kept, skipped = page_triage.triage_pages(chunks)
+
+    assert not any("RETURN TO FIRST PAGE" in chunk.page_content for chunk in kept)
+    assert _skipped_pages(skipped) == {7: "disclosure"}
+
+
+def test_jpmorgan_alternating_headers_contact_and_disclosure_pages():
+    chunks = list(_sample_chunks("jpmorgan_2023_outlook.pdf"))
+
+    kept, skipped = page_triage.triage_pages(chunks)
+
+    for chunk in kept:
+        first_lines = [line.strip() for line in chunk.page_content.splitlines() if line.strip()][:2]
+        assert not any(line.startswith("J.P. Morgan Asset Management") for line in first_lines)
+        assert not any(line.endswith("A slow economy but better markets") for line in first_lines)
+    assert _skipped_pages(skipped) == {11: "contact", 13: "disclosure"}
+
+
+@pytest.mark.parametrize("name", ["merrill_October_2023.pdf", "jpmorgan_2023_outlook.pdf"])
+def test_incremental_triage_skips_the_same_pages(name):
+    chunks = list(_sample_chunks(name))
+    sample = [chunk for chunk in chunks if chunk.metadata["page"] < 10]
+
+    skipped = []
+    kept = list(page_triage.iter_triage_pages(iter(chunks), sample, skipped))
+
+    expected_kept, expected_skipped = page_triage.triage_pages(chunks)
+    assert len(kept) == len(expected_kept)
+    assert _skipped_pages(skipped) == _skipped_pages(expected_skipped)
+
+
+def test_short_pages_and_generic_financial_words_are_content():
+    assert page_triage.classify_page("") == "blank"
+    assert page_triage.classify_page("  12  ") == "blank"
+    assert page_triage.classify_page("Key takeaway: we expect rates to fall 50bp in 2024.") == "content"
+    text = "\n".join(["Our subsidiary and its affiliates issued securities worth $2bn in the quarter."] * 12)
+    assert page_triage.classify_page(text) == "content"
+
+
+def test_all_boilerplate_document_keeps_the_original_pages():
+    pages = [_doc(F"ACME Quarterly Outlook\nPage {number}", number) for number in range(5)]
+
+    kept, skipped = page_triage.triage_pages(pages)
+    assert [page.page_content for page in kept] == [page.page_content for page in pages]
+    assert skipped == []
+
+    skipped = []
+    kept = list(page_triage.iter_triage_pages(iter(pages), pages, skipped))
+    assert [page.page_content for page in kept] == [page.page_content for page in pages]
+    assert skipped == []
@@ -19,6 +19,7 @@ import google.auth.transport.requests
 
 import os
 import config
+import gcp_clients
 
 conf = config.Config()
 
@@ -206,11 +207,20 @@ class MatchingEngine(VectorStore):
 
         logger.debug(f"Querying Matching Engine Index Endpoint {rpc_address}")
 
-        request = google.auth.transport.requests.Request()
-        self.credentials.refresh(request)
-        header = {"Authorization": "Bearer " + self.credentials.token}
-
-        return requests.post(rpc_address, data=endpoint_json_data, headers=header)
+        # Refresh the token only when it is expired, not on every query. On auth or
+        # connection errors the shared clients and credentials are dropped (see
+        # gcp_clients.resetting), so the next vector store gets fresh ones
+        with gcp_clients.resetting("index", "index_endpoint", "resource"):
+            if not self.credentials.valid:
+                request = google.auth.transport.requests.Request()
+                self.credentials.refresh(request)
+            header = {"Authorization": "Bearer " + self.credentials.token}
+
+            response = requests.post(rpc_address, data=endpoint_json_data, headers=header)
+        if response.status_code == 401:
+            # Token rejected (e.g. revoked credentials)
+            gcp_clients.reset_clients()
+        return response
 
     def similarity_search(
         self, query: str, k: int = 4, search_distance: float = 0.65, **kwargs: Any
@@ -377,9 +387,11 @@ class MatchingEngine(VectorStore):
         if credentials_path:
             credentials = cls._create_credentials_from_file(credentials_path)
         else:
-            credentials, _ = google.auth.default()
-            request = google.auth.transport.requests.Request()
-            credentials.refresh(request)
+            # Default credentials: the clients, the index and the endpoint are
+            # created once per process and reused (see gcp_clients)
+            return cls._from_registry(
+                project_id, region, gcs_bucket_name, index_id, endpoint_id, embedding
+            )
 
         index = cls._create_index_by_id(index_id, project_id, region, credentials)
         endpoint = cls._create_endpoint_by_id(
@@ -406,6 +418,56 @@ class MatchingEngine(VectorStore):
             gcs_bucket_name=gcs_bucket_name,
         )
 
+    @classmethod
+    def _from_registry(
+        cls: Type["MatchingEngine"],
+        project_id: str,
+        region: str,
+        gcs_bucket_name: str,
+        index_id: str,
+        endpoint_id: str,
+        embedding: Optional[Embeddings] = None,
+    ) -> "MatchingEngine":
+        """Builds the vector store from the process-wide clients of gcp_clients.
+
+        The index and endpoint are fetched, and aiplatform is initialized,
+        only the first time they are requested in the process.
+        """
+        credentials = gcp_clients.get_credentials()
+        index_client = gcp_clients.get_index_client(region)
+        index = gcp_clients.get_resource(
+            ("matching_engine_index", region, index_id),
+            lambda: index_client.get_index(
+                request=aiplatform_v1.GetIndexRequest(name=index_id)
+            ),
+        )
+        endpoint = gcp_clients.get_resource(
+            ("matching_engine_endpoint", project_id, region, endpoint_id),
+            lambda: cls._create_endpoint_by_id(
+                endpoint_id, project_id, region, credentials
+            ),
+        )
+        gcp_clients.get_resource(
+            ("aiplatform_init", project_id, region, gcs_bucket_name),
+            lambda: cls._init_aiplatform(
+                project_id, region, gcs_bucket_name, credentials
+            )
+            or True,
+        )
+
+        return cls(
+            project_id=project_id,
+            region=region,
+            index=index,
+            endpoint=endpoint,
+            embedding=embedding or cls._get_default_embeddings(),
+            gcs_client=gcp_clients.get_storage_client(),
+            index_client=index_client,
+            index_endpoint_client=gcp_clients.get_index_endpoint_client(region),
+            credentials=credentials,
+            gcs_bucket_name=gcs_bucket_name,
+        )
+
     @classmethod
     def _validate_gcs_bucket(cls, gcs_bucket_name: str) -> str:
         """Validates the gcs_bucket_name as a bucket name.
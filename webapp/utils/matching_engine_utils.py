@@ -6,6 +6,8 @@ import logging
 from google.cloud import aiplatform_v1 as aipv1
 from google.protobuf import struct_pb2
 
+import gcp_clients
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
@@ -18,15 +20,9 @@ class MatchingEngineUtils:
         self.index_endpoint_name = f"{self.index_name}-endpoint"
         self.PARENT = f"projects/{self.project_id}/locations/{self.region}"
 
-        ENDPOINT = f"{self.region}-aiplatform.googleapis.com"
-        # set index client
-        self.index_client = aipv1.IndexServiceClient(
-            client_options=dict(api_endpoint=ENDPOINT)
-        )
-        # set index endpoint client
-        self.index_endpoint_client = aipv1.IndexEndpointServiceClient(
-            client_options=dict(api_endpoint=ENDPOINT)
-        )
+        # set index and index endpoint clients (shared by the whole process, see gcp_clients)
+        self.index_client = gcp_clients.get_index_client(self.region)
+        self.index_endpoint_client = gcp_clients.get_index_endpoint_client(self.region)
 
     def get_index(self):
         # Check if index exists